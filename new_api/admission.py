@@ -0,0 +1,385 @@
+"""
+Controle de admissão dos endpoints de predição
+
+Cada endpoint (ex.: /recommendation, /recommendation/batch, /clusterization/customer)
+tem um limite próprio de requisições simultâneas e uma fila de espera limitada. Sob
+pico de tráfego, o excedente é rejeitado na hora (503 + Retry-After) em vez de
+enfileirar sem limite e aumentar a latência de todas as requisições.
+
+O cliente pode informar um prazo no header `X-Request-Deadline-Ms` (milissegundos a
+partir da chegada). Se a espera estimada na fila mais o tempo típico de atendimento do
+endpoint passarem do prazo, a requisição é rejeitada antes de qualquer trabalho (504);
+o mesmo acontece se o prazo acabar enquanto ela espera na fila. O prazo acompanha a
+requisição até a inferência: o pool de inferência e o micro-batcher descartam, antes de
+rodar o modelo, o trabalho cujo prazo acabou na fila deles (504, motivo `expired`).
+
+Endpoints com modo degradado (o /recommendation, com as rotas populares pré-calculadas)
+recebem a requisição excedente marcada como degradada em vez de rejeitá-la; o endpoint
+consulta `degraded_reason()` e responde sem rodar o modelo.
+
+Implementado como middleware ASGI: a vaga é mantida até a resposta ser enviada por
+inteiro, inclusive nos endpoints de streaming.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from metrics import metric_family
+
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+DEGRADED_HEADER = "X-Degraded"
+
+# Peso de cada nova amostra na média móvel exponencial do tempo de atendimento
+SERVICE_TIME_ALPHA = 0.2
+
+# Motivo do modo degradado da requisição corrente (None: atendimento normal)
+_degraded_reason: ContextVar[Optional[str]] = ContextVar("ml_api_degraded_reason", default=None)
+# Prazo da requisição corrente, quando informado
+_deadline: ContextVar[Optional["RequestDeadline"]] = ContextVar("ml_api_request_deadline", default=None)
+
+def endpoint_key(path: str) -> str:
+    """
+    Nome do endpoint usado nas variáveis de ambiente e nas métricas: os dois primeiros
+    segmentos do caminho (/clusterization/customer/123 -> CLUSTERIZATION_CUSTOMER)
+    """
+    segments = [segment for segment in path.strip("/").split("/") if segment][:2]
+    return "_".join(segments).upper().replace("-", "_")
+
+def configured_admission(name: str) -> Dict[str, Any]:
+    """
+    Lê a configuração de admissão de um endpoint das variáveis de ambiente
+    ML_API_ADMISSION_<ENDPOINT>_* tem prioridade sobre ML_API_ADMISSION_*
+    MAX_CONCURRENCY=0 (padrão) não limita a concorrência; prazos continuam valendo
+    """
+    def setting(suffix: str, default: str) -> str:
+        return os.getenv(f"ML_API_ADMISSION_{name}_{suffix}") or os.getenv(f"ML_API_ADMISSION_{suffix}", default)
+
+    return {
+        "max_concurrency": max(0, int(setting("MAX_CONCURRENCY", "0"))),
+        "max_queue": max(0, int(setting("MAX_QUEUE", "64"))),
+        "degraded": setting("DEGRADED", "0") not in ("0", "false", "False")
+    }
+
+def configured_default_deadline() -> Optional[float]:
+    """Prazo padrão (s) para requisições sem o header; ML_API_DEFAULT_DEADLINE_MS=0 desliga"""
+    value = float(os.getenv("ML_API_DEFAULT_DEADLINE_MS", "0"))
+    return value / 1000 if value > 0 else None
+
+def degraded_reason() -> Optional[str]:
+    """Motivo pelo qual a requisição corrente deve ser atendida em modo degradado"""
+    return _degraded_reason.get()
+
+class DeadlineExceeded(Exception):
+    """Prazo da requisição esgotado antes da inferência: o trabalho foi descartado"""
+
+class RequestDeadline:
+    """
+    Prazo absoluto (time.perf_counter) de uma requisição admitida
+    `expired` marca que um trabalho dela foi descartado por falta de tempo; o middleware
+    troca a resposta do endpoint por 504
+    """
+    __slots__ = ("deadline", "expired")
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.expired = False
+
+    def remaining(self) -> float:
+        return self.deadline - time.perf_counter()
+
+    def check(self):
+        """Levanta DeadlineExceeded (e marca a requisição) se o prazo já passou"""
+        if self.remaining() <= 0:
+            self.expired = True
+            raise DeadlineExceeded("Prazo da requisição esgotado antes da inferência")
+
+def current_deadline() -> Optional[RequestDeadline]:
+    """Prazo da requisição corrente (None sem prazo)"""
+    return _deadline.get()
+
+@contextmanager
+def deadline_scope(deadline: Optional[float]):
+    """Define o prazo absoluto da requisição corrente (o que roda dentro do bloco o enxerga)"""
+    state = None if deadline is None else RequestDeadline(deadline)
+    token = _deadline.set(state)
+    try:
+        yield state
+    finally:
+        _deadline.reset(token)
+
+def check_deadline():
+    """Descarta o trabalho da requisição corrente se o prazo dela já passou (DeadlineExceeded)"""
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+class AdmissionRejected(Exception):
+    """Requisição recusada pelo controle de admissão"""
+
+    def __init__(self, reason: str, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def status_code(self) -> int:
+        # Prazo impossível de cumprir: 504; capacidade esgotada: 503
+        return 504 if self.reason == "deadline" else 503
+
+class AdmissionController:
+    """Limite de concorrência com fila FIFO limitada e estimativa de espera de um endpoint"""
+
+    def __init__(self, name: str, max_concurrency: int = 0, max_queue: int = 64, degraded: bool = False):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.degraded = degraded
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        # Média móvel do tempo de atendimento (s); 0 até a primeira requisição concluída
+        self.service_time = 0.0
+        self._admitted = 0
+        self._queued_total = 0
+        self._degraded = 0
+        # expired: admitida, mas descartada na fila de inferência por prazo esgotado
+        self._rejected = {"overloaded": 0, "deadline": 0, "expired": 0}
+
+    def _at_capacity(self) -> bool:
+        return self.max_concurrency > 0 and (self.in_flight >= self.max_concurrency or bool(self._waiters))
+
+    def estimated_wait(self) -> float:
+        """Espera estimada (s) de uma requisição que chegasse agora"""
+        if not self._at_capacity():
+            return 0.0
+        return (len(self._waiters) + 1) / self.max_concurrency * self.service_time
+
+    def _reject(self, reason: str, detail: str) -> AdmissionRejected:
+        self._rejected[reason] += 1
+        return AdmissionRejected(reason, detail, max(self.estimated_wait(), self.service_time))
+
+    def shed(self, deadline: Optional[float] = None) -> Optional[str]:
+        """
+        Motivo para atender em modo degradado sem ocupar vaga (None: seguir para a fila)
+        Só nos endpoints com modo degradado, nos casos em que a requisição seria rejeitada
+        """
+        if not self.degraded:
+            return None
+        reason = None
+        if deadline is not None and time.perf_counter() + self.estimated_wait() + self.service_time > deadline:
+            reason = "deadline"
+        elif self._at_capacity() and len(self._waiters) >= self.max_queue:
+            reason = "overloaded"
+        if reason is not None:
+            self._degraded += 1
+        return reason
+
+    async def acquire(self, deadline: Optional[float] = None):
+        """
+        Ocupa uma vaga do endpoint, aguardando na fila se necessário
+        Levanta AdmissionRejected quando a fila está cheia ou o prazo não será cumprido
+        """
+        now = time.perf_counter()
+        if deadline is not None and now + self.estimated_wait() + self.service_time > deadline:
+            raise self._reject("deadline", "A requisição não seria concluída dentro do prazo informado")
+
+        if not self._at_capacity():
+            self.in_flight += 1
+            self._admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("overloaded", f"Endpoint sobrecarregado: {self.max_concurrency} requisições em andamento e fila cheia")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._queued_total += 1
+        # Sem tempo para ser atendida depois de sair da fila: desiste antes
+        timeout = None if deadline is None else max(0.0, deadline - self.service_time - now)
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        except BaseException:
+            # Cancelada (cliente desconectou) depois de já ter recebido a vaga: devolve
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self._discard(waiter)
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self._discard(waiter)
+            raise self._reject("deadline", "Prazo da requisição esgotado na fila de admissão")
+        self._admitted += 1
+
+    def _discard(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def expire(self):
+        """Conta uma requisição admitida cujo trabalho foi descartado por prazo esgotado"""
+        self._rejected["expired"] += 1
+
+    def release(self, service_time: Optional[float] = None):
+        """Libera a vaga (passando-a direto ao próximo da fila) e registra o tempo de atendimento"""
+        if service_time is not None:
+            self.service_time += SERVICE_TIME_ALPHA * (service_time - self.service_time) if self.service_time else service_time
+        self.in_flight -= 1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "degraded_mode": self.degraded,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "admitted": self._admitted,
+            "queued": self._queued_total,
+            "degraded": self._degraded,
+            "rejected": dict(self._rejected),
+            "service_time_ms": round(self.service_time * 1000, 3),
+            "estimated_wait_ms": round(self.estimated_wait() * 1000, 3)
+        }
+
+class AdmissionMiddleware:
+    """Middleware ASGI que aplica o controle de admissão aos caminhos de `prefixes`"""
+
+    def __init__(self, app: ASGIApp, prefixes: Iterable[str] = (), degradable: Iterable[str] = (),
+                 controllers: Optional[Dict[str, AdmissionController]] = None):
+        """
+        `degradable`: endpoints (chaves de endpoint_key) que sabem responder em modo degradado
+        `controllers`: dicionário compartilhado com a aplicação (estatísticas no /health e /metrics)
+        """
+        self.app = app
+        self.prefixes = tuple(prefixes)
+        self.degradable = set(degradable)
+        self.controllers = controllers if controllers is not None else {}
+        self.default_deadline = configured_default_deadline()
+        # Endpoints das rotas registradas (montado na primeira requisição, com as rotas já definidas)
+        self._endpoints: Optional[frozenset] = None
+
+    def _registered_endpoints(self, scope: Scope) -> frozenset:
+        if self._endpoints is None:
+            routes = getattr(scope.get("app"), "routes", ())
+            self._endpoints = frozenset(
+                endpoint_key(route.path) for route in routes
+                if getattr(route, "path", "").startswith(self.prefixes)
+            )
+        return self._endpoints
+
+    def controller(self, scope: Scope) -> Optional[AdmissionController]:
+        """
+        Controlador do endpoint da requisição; None fora de `prefixes` e para caminhos que
+        não correspondem a uma rota registrada (um 404 não cria controlador nem métricas)
+        """
+        path = scope["path"]
+        if not path.startswith(self.prefixes):
+            return None
+        name = endpoint_key(path)
+        if name not in self._registered_endpoints(scope):
+            return None
+        controller = self.controllers.get(name)
+        if controller is None:
+            config = configured_admission(name)
+            config["degraded"] = config["degraded"] and name in self.degradable
+            controller = self.controllers[name] = AdmissionController(name, **config)
+        return controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        controller = self.controller(scope) if scope["type"] == "http" else None
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.perf_counter()
+        try:
+            budget = self._deadline_budget(scope)
+        except ValueError:
+            response = JSONResponse(status_code=400, content={"detail": f"Header {DEADLINE_HEADER} inválido: use milissegundos (número positivo)"})
+            await response(scope, receive, send)
+            return
+        deadline = None if budget is None else arrived + budget
+
+        reason = controller.shed(deadline)
+        if reason is not None:
+            # Atendida pelo próprio endpoint sem o modelo, fora do limite de concorrência
+            token = _degraded_reason.set(reason)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _degraded_reason.reset(token)
+            return
+
+        try:
+            await controller.acquire(deadline)
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=e.status_code,
+                content={"detail": str(e)},
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            with deadline_scope(deadline) as state:
+                replaced = False
+
+                async def send_or_expire(message):
+                    # Trabalho descartado por prazo: o endpoint responde com erro, o cliente recebe 504
+                    nonlocal replaced
+                    if replaced:
+                        return
+                    if message["type"] == "http.response.start" and state is not None and state.expired:
+                        replaced = True
+                        controller.expire()
+                        response = JSONResponse(status_code=504, content={"detail": "Prazo da requisição esgotado antes da inferência"})
+                        await response(scope, receive, send)
+                        return
+                    await send(message)
+
+                await self.app(scope, receive, send_or_expire)
+        finally:
+            controller.release(time.perf_counter() - started)
+
+    def _deadline_budget(self, scope: Scope) -> Optional[float]:
+        """Prazo (s) informado no header, ou o padrão configurado"""
+        header = DEADLINE_HEADER.lower().encode("latin-1")
+        for name, value in scope.get("headers", ()):
+            if name == header:
+                budget = float(value.decode("latin-1"))
+                if not math.isfinite(budget) or budget <= 0:
+                    raise ValueError(budget)
+                return budget / 1000
+        return self.default_deadline
+
+def admission_families(controllers: Dict[str, AdmissionController]) -> List[List[str]]:
+    """Famílias de métricas do controle de admissão para o /metrics"""
+    stats = {name: controller.stats() for name, controller in sorted(controllers.items())}
+    return [
+        metric_family("ml_api_admission_in_flight", "gauge", "Requisições admitidas em andamento por endpoint",
+                      [({"endpoint": name}, s["in_flight"]) for name, s in stats.items()]),
+        metric_family("ml_api_admission_queue_depth", "gauge", "Requisições aguardando admissão por endpoint",
+                      [({"endpoint": name}, s["queue_depth"]) for name, s in stats.items()]),
+        metric_family("ml_api_admission_rejected_total", "counter", "Requisições rejeitadas pelo controle de admissão",
+                      [({"endpoint": name, "reason": reason}, count)
+                       for name, s in stats.items() for reason, count in s["rejected"].items()]),
+        metric_family("ml_api_admission_degraded_total", "counter", "Requisições atendidas em modo degradado",
+                      [({"endpoint": name}, s["degraded"]) for name, s in stats.items()])
+    ]
@@ -0,0 +1,187 @@
+"""
+Entrada e saída em Apache Arrow para pontuação em massa
+
+Os endpoints /<modelo>/arrow recebem um stream Arrow IPC (ou bytes Parquet) com as
+mesmas colunas dos schemas pydantic e respondem com um stream Arrow IPC de predições,
+uma linha por registro de entrada. Colunas numéricas sem nulos viram arrays NumPy sem
+cópia; não há parsing de JSON nem validação pydantic por registro.
+
+pyarrow é opcional: sem ele os endpoints respondem 501 e o restante da API funciona.
+O import é feito na primeira requisição Arrow (evita ~0,15 s na inicialização de
+workers que nunca recebem Arrow).
+"""
+
+import os
+from typing import Any, Dict, Iterator, List, Tuple, Type
+
+import numpy as np
+
+from schema_fields import field_type
+
+# Módulos do pyarrow, preenchidos por _load_pyarrow()
+pa = pc = ipc = pq = None
+_pyarrow_missing = False
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+# Registros pontuados por vez: limita a memória intermediária de lotes muito grandes
+ARROW_CHUNK_ROWS = max(1, int(os.getenv("ML_API_ARROW_CHUNK_ROWS", "65536")))
+
+# Documentação do corpo binário no OpenAPI (o FastAPI não o infere de `Request`)
+ARROW_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            media_type: {"schema": {"type": "string", "format": "binary"}}
+            for media_type in (ARROW_STREAM_MEDIA_TYPE, PARQUET_MEDIA_TYPE)
+        }
+    }
+}
+
+class ArrowUnavailable(RuntimeError):
+    """pyarrow não está instalado"""
+
+class ArrowInputError(ValueError):
+    """Corpo que não é um stream Arrow/Parquet legível ou sem as colunas do schema"""
+
+def _load_pyarrow() -> bool:
+    """Importa o pyarrow na primeira chamada; False se ele não estiver instalado"""
+    global pa, pc, ipc, pq, _pyarrow_missing
+    if pa is None and not _pyarrow_missing:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:  # pragma: no cover - dependência opcional
+            _pyarrow_missing = True
+            return False
+        pc, ipc, pq = pyarrow.compute, pyarrow.ipc, pyarrow.parquet
+        pa = pyarrow
+    return pa is not None
+
+def arrow_available() -> bool:
+    return _load_pyarrow()
+
+def read_table(body: bytes) -> "pa.Table":
+    """
+    Lê o corpo da requisição como Parquet (assinatura PAR1), arquivo Arrow (ARROW1)
+    ou stream Arrow IPC. Os buffers do corpo são referenciados, não copiados
+    """
+    if not _load_pyarrow():
+        raise ArrowUnavailable("pyarrow não está instalado no servidor")
+    buffer = pa.py_buffer(body)
+    try:
+        if body[:4] == b"PAR1":
+            return pq.read_table(pa.BufferReader(buffer))
+        if body[:6] == b"ARROW1":
+            return ipc.open_file(buffer).read_all()
+        return ipc.open_stream(buffer).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise ArrowInputError(f"Corpo não é um stream Arrow IPC nem Parquet válido: {e}")
+
+def iter_chunks(table: "pa.Table", chunk_rows: int = ARROW_CHUNK_ROWS) -> Iterator[Tuple[int, "pa.Table"]]:
+    """Fatias (offset, tabela) de até `chunk_rows` registros, sem cópia"""
+    for offset in range(0, table.num_rows, chunk_rows):
+        yield offset, table.slice(offset, chunk_rows)
+
+def _numeric_column(column: "pa.ChunkedArray", annotation: type, optional: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    if pa.types.is_null(column.type):
+        # Coluna inteiramente nula (ex.: frequência opcional não informada)
+        values = np.full(len(column), np.nan)
+    elif pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_boolean(column.type):
+        # Sem nulos e em um único bloco: visão direta do buffer Arrow
+        values = column.to_numpy().astype(np.float64, copy=False)
+    else:
+        # Texto em campo numérico: conversão valor a valor, inválidos viram NaN
+        values = np.empty(len(column), dtype=np.float64)
+        for i, value in enumerate(column.to_pylist()):
+            try:
+                values[i] = float(value)
+            except (TypeError, ValueError):
+                values[i] = np.nan
+    invalid = ~np.isfinite(values)
+    if optional:
+        # Nulo em campo opcional fica NaN (preenchido no servidor), não é erro
+        invalid &= ~column.is_null().to_numpy(zero_copy_only=False)
+    if annotation is int:
+        invalid |= np.isfinite(values) & (values != np.floor(values))
+        values = np.where(invalid, 0, values)
+        if not optional:
+            values = values.astype(np.int64)
+    return values, invalid
+
+def _text_column(column: "pa.ChunkedArray") -> Tuple[np.ndarray, np.ndarray]:
+    if not (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+        # IDs numéricos (ex.: fk_contact int64) são aceitos como texto
+        column = pc.cast(column, pa.string())
+    invalid = column.is_null().to_numpy(zero_copy_only=False)
+    return column.to_numpy(zero_copy_only=False), invalid
+
+def table_columns(table: "pa.Table", record_schema: Type[Any]) -> Tuple[Dict[str, np.ndarray], Dict[int, str]]:
+    """
+    Converte as colunas da tabela para os tipos do schema unitário
+    Mesmo contrato de coerce_batch_columns: colunas NumPy + erros por registro
+    """
+    missing = [
+        name for name, field in record_schema.model_fields.items()
+        if field.is_required() and name not in table.column_names
+    ]
+    if missing:
+        raise ArrowInputError(f"Colunas ausentes: {', '.join(missing)}")
+
+    columns: Dict[str, np.ndarray] = {}
+    errors: Dict[int, str] = {}
+    for field_name, field in record_schema.model_fields.items():
+        if field_name not in table.column_names:
+            # Coluna opcional ausente: preenchida no servidor
+            continue
+        column = table.column(field_name)
+        annotation, optional = field_type(field)
+        if annotation in (int, float):
+            values, invalid = _numeric_column(column, annotation, optional)
+        else:
+            values, invalid = _text_column(column)
+        for i in np.flatnonzero(invalid):
+            errors.setdefault(int(i), f"Campo '{field_name}' inválido: {column[int(i)].as_py()!r}")
+        columns[field_name] = values
+    return columns, errors
+
+def _output_array(values: np.ndarray, rows: np.ndarray, size: int) -> "pa.Array":
+    """Coluna de saída com os valores nas linhas pontuadas e nulo nas demais"""
+    if len(rows) == size:
+        return pa.array(values)
+    if values.dtype == object:
+        full = np.full(size, None, dtype=object)
+        full[rows] = values
+        return pa.array(full, type=pa.string())
+    full = np.zeros(size, dtype=values.dtype)
+    full[rows] = values
+    mask = np.ones(size, dtype=bool)
+    mask[rows] = False
+    return pa.array(full, mask=mask)
+
+def record_batch(size: int, rows: np.ndarray, outputs: Dict[str, np.ndarray], errors: Dict[int, str]) -> "pa.RecordBatch":
+    """
+    Monta o lote de saída: uma coluna por saída do modelo + `error` (nulo quando o
+    registro foi pontuado)
+    """
+    arrays: List[Any] = [_output_array(values, rows, size) for values in outputs.values()]
+    error_column = np.full(size, None, dtype=object)
+    for index, detail in errors.items():
+        error_column[index] = detail
+    arrays.append(pa.array(error_column, type=pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, names=list(outputs) + ["error"])
+
+def write_stream(batches: Iterator["pa.RecordBatch"]) -> bytes:
+    """Serializa os lotes de saída em um único stream Arrow IPC"""
+    sink = pa.BufferOutputStream()
+    writer = None
+    for batch in batches:
+        if writer is None:
+            writer = ipc.new_stream(sink, batch.schema)
+        writer.write_batch(batch)
+    if writer is not None:
+        writer.close()
+    return sink.getvalue().to_pybytes()
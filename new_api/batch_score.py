@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Pontuação offline em lote com os mesmos artefatos e a mesma lógica de features da API
+
+Lê CSV ou Parquet em blocos, pontua os blocos em um pool de processos e grava as
+colunas esperadas por import_to_mysql/load_ml_datasets_to_mysql.py:
+
+- clusterization: entrada + cluster, data_clusterizacao, versao_modelo (ml_clusterization)
+- classification: entrada + probabilidade_compra, predicao_compra, potencial_recompra,
+  mes_ultima_compra, ano_ultima_compra, data_predicao, versao_modelo (ml_classification)
+- recommendation: nk_ota_localizer_id, fk_contact, date_purchase, route_departure,
+  predicted_route_1..k e prob_route_1..k (ml_recommendation)
+
+Na clusterização, uma entrada por compra (ex.: dataset de compras do notebook) é
+agregada por cliente numa primeira passada; uma entrada que já traz as 13 features
+agregadas é pontuada direto.
+
+Os modelos são carregados uma vez no processo pai e compartilhados com os workers
+(fork + memória compartilhada, como no prefork.py).
+
+Uso:
+    python batch_score.py classification dataset_recompra.csv dataset_recompra_completo.csv
+    python batch_score.py recommendation compras.parquet recomendacoes.parquet --top-k 5 --workers 4
+"""
+
+import argparse
+import gc
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import main as api
+from prefork import configured_server_workers, share_arrays
+
+# Colunas de identificação mantidas na saída da recomendação (schema de ml_recommendation)
+RECOMMENDATION_ID_COLUMNS = ["nk_ota_localizer_id", "fk_contact", "date_purchase", "route_departure"]
+
+# Faixas de potencial_recompra (mesmo pd.cut do notebook de classificação)
+PURCHASE_POTENTIAL_BINS = [0, 0.1, 0.3, 0.6, 1.0]
+PURCHASE_POTENTIAL_LABELS = ["Baixo", "Médio", "Alto", "Muito Alto"]
+
+# Cluster por cliente da primeira passada (entrada por compra). Global para chegar aos
+# workers pelo fork, sem ser serializado a cada bloco
+customer_clusters: Optional[pd.Series] = None
+
+# Versões gravadas quando o artefato não informa a sua
+DEFAULT_MODEL_VERSIONS = {
+    "clusterization": "KMeans_v1.0",
+    "classification": "RandomForest_v1.0",
+    "recommendation": "XGBoost_v1.0",
+}
+
+# ============================================================================
+# LEITURA E ESCRITA
+# ============================================================================
+
+def is_parquet(path: str) -> bool:
+    return path.lower().endswith((".parquet", ".pq"))
+
+def read_chunks(path: str, chunk_size: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Blocos de até `chunk_size` linhas de um CSV ou Parquet"""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+
+def input_columns(path: str) -> List[str]:
+    """Colunas do arquivo de entrada, sem ler os dados"""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).schema_arrow.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+class ChunkWriter:
+    """Grava os blocos pontuados em ordem, em CSV (com cabeçalho uma vez) ou Parquet"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._parquet_writer = None
+        self._header_written = False
+
+    def write(self, frame: pd.DataFrame):
+        if is_parquet(self.path):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+        else:
+            frame.to_csv(self.path, mode="a" if self._header_written else "w",
+                         header=not self._header_written, index=False)
+            self._header_written = True
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+# ============================================================================
+# AGREGAÇÃO POR CLIENTE (CLUSTERIZAÇÃO A PARTIR DE COMPRAS)
+# ============================================================================
+
+PURCHASE_COLUMNS = [
+    "fk_contact", "gmv_success", "total_tickets_quantity_success", "is_round_trip",
+    "is_weekend", "day_of_week", "hour", "month", "departure_company_freq"
+]
+
+def partial_customer_aggregates(chunk: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Somas parciais por cliente de um bloco de compras (combináveis entre blocos)
+    e contagens de dia da semana/mês para a moda
+    """
+    frame = chunk[PURCHASE_COLUMNS].copy()
+    frame["gmv_sq"] = frame["gmv_success"] ** 2
+    frame["tickets_sq"] = frame["total_tickets_quantity_success"] ** 2
+    sums = frame.groupby("fk_contact").agg(
+        count=("gmv_success", "size"),
+        gmv_sum=("gmv_success", "sum"),
+        gmv_sq=("gmv_sq", "sum"),
+        tickets_sum=("total_tickets_quantity_success", "sum"),
+        tickets_sq=("tickets_sq", "sum"),
+        round_trip_sum=("is_round_trip", "sum"),
+        weekend_sum=("is_weekend", "sum"),
+        hour_sum=("hour", "sum"),
+        company_freq_sum=("departure_company_freq", "sum"),
+    )
+    modes = pd.concat([
+        frame.groupby(["fk_contact", "day_of_week"]).size().rename("count").reset_index()
+             .rename(columns={"day_of_week": "value"}).assign(field="day_of_week"),
+        frame.groupby(["fk_contact", "month"]).size().rename("count").reset_index()
+             .rename(columns={"month": "value"}).assign(field="month"),
+    ])
+    return sums, modes
+
+def _sample_std(total: pd.Series, squares: pd.Series, count: pd.Series) -> pd.Series:
+    variance = (squares - total ** 2 / count) / (count - 1)
+    # Cliente com uma compra: std indefinido -> 0, como o fillna(0) do notebook
+    return np.sqrt(variance.clip(lower=0)).where(count > 1, 0.0)
+
+def _mode(counts: pd.DataFrame, field: str) -> pd.Series:
+    """Valor mais frequente por cliente; empate -> menor valor (como Series.mode()[0])"""
+    subset = counts[counts["field"] == field].groupby(["fk_contact", "value"])["count"].sum().reset_index()
+    subset = subset.sort_values(["fk_contact", "count", "value"], ascending=[True, False, True])
+    return subset.drop_duplicates("fk_contact").set_index("fk_contact")["value"]
+
+def customer_features(path: str, chunk_size: int) -> pd.DataFrame:
+    """
+    Primeira passada: as 13 features de clusterização por cliente (mesmas agregações do
+    notebook de clusterização), acumuladas bloco a bloco
+    """
+    partial_sums, partial_modes = [], []
+    for chunk in read_chunks(path, chunk_size, PURCHASE_COLUMNS):
+        sums, modes = partial_customer_aggregates(chunk)
+        partial_sums.append(sums)
+        partial_modes.append(modes)
+        # Consolida periodicamente para manter a memória proporcional ao número de clientes
+        if len(partial_sums) >= 16:
+            partial_sums = [pd.concat(partial_sums).groupby(level=0).sum()]
+            partial_modes = [pd.concat(partial_modes).groupby(["fk_contact", "value", "field"], as_index=False)["count"].sum()]
+
+    sums = pd.concat(partial_sums).groupby(level=0).sum()
+    modes = pd.concat(partial_modes)
+    count = sums["count"]
+    return pd.DataFrame({
+        "gmv_mean": sums["gmv_sum"] / count,
+        "gmv_total": sums["gmv_sum"],
+        "purchase_count": count,
+        "gmv_std": _sample_std(sums["gmv_sum"], sums["gmv_sq"], count),
+        "tickets_mean": sums["tickets_sum"] / count,
+        "tickets_total": sums["tickets_sum"],
+        "tickets_std": _sample_std(sums["tickets_sum"], sums["tickets_sq"], count),
+        "round_trip_rate": sums["round_trip_sum"] / count,
+        "weekend_rate": sums["weekend_sum"] / count,
+        "preferred_day": _mode(modes, "day_of_week"),
+        "avg_hour": sums["hour_sum"] / count,
+        "preferred_month": _mode(modes, "month"),
+        "avg_company_freq": sums["company_freq_sum"] / count,
+    })[api.CLUSTERIZATION_FEATURES]
+
+# ============================================================================
+# PONTUAÇÃO DE UM BLOCO (EXECUTADA NOS WORKERS)
+# ============================================================================
+
+def chunk_columns(frame: pd.DataFrame, names: List[str], fill_numeric: bool) -> Dict[str, np.ndarray]:
+    """Colunas NumPy de um bloco; valores ausentes numéricos viram 0 (fillna do notebook)"""
+    columns = {}
+    for name in names:
+        values = frame[name]
+        if fill_numeric and pd.api.types.is_numeric_dtype(values):
+            values = values.fillna(0)
+        columns[name] = values.to_numpy()
+    return columns
+
+def model_version_label(model_type: str, model_data: Dict[str, Any]) -> str:
+    version = model_data.get("model_version") if isinstance(model_data, dict) else None
+    return version or DEFAULT_MODEL_VERSIONS[model_type]
+
+def score_chunk(model_type: str, frame: pd.DataFrame, version: Optional[str], top_k: int) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """Pontua um bloco e devolve as colunas de saída e o tempo (s) de cada etapa"""
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    model_data = api.load_model(model_type, version)
+    rows = np.arange(len(frame))
+
+    if model_type == "clusterization":
+        if customer_clusters is not None:
+            # Entrada por compra: cluster já calculado por cliente na primeira passada
+            output = frame.copy()
+            output["cluster"] = frame["fk_contact"].map(customer_clusters).to_numpy()
+            timings["prepare"] = time.perf_counter() - started
+        else:
+            columns = chunk_columns(frame, api.CLUSTERIZATION_FEATURES, fill_numeric=True)
+            timings["prepare"] = time.perf_counter() - started
+            started = time.perf_counter()
+            scored = api.score_cluster_columns(model_data, columns, rows, top_k)
+            timings["score"] = time.perf_counter() - started
+            output = frame.copy()
+            output["cluster"] = scored["cluster"]
+        started = time.perf_counter()
+        output["data_clusterizacao"] = datetime.now()
+        output["versao_modelo"] = model_version_label(model_type, model_data)
+
+    elif model_type == "classification":
+        columns = chunk_columns(frame, model_data["feature_columns"], fill_numeric=True)
+        timings["prepare"] = time.perf_counter() - started
+        started = time.perf_counter()
+        scored = api.score_purchase_columns(model_data, columns, rows, top_k)
+        timings["score"] = time.perf_counter() - started
+        started = time.perf_counter()
+        output = frame.copy()
+        output["probabilidade_compra"] = scored["probability"]
+        output["predicao_compra"] = scored["will_purchase"].astype(np.int8)
+        output["potencial_recompra"] = pd.cut(output["probabilidade_compra"],
+                                              bins=PURCHASE_POTENTIAL_BINS, labels=PURCHASE_POTENTIAL_LABELS)
+        if "data_ultima_compra" in output.columns:
+            last_purchase = pd.to_datetime(output["data_ultima_compra"], errors="coerce")
+            output["mes_ultima_compra"] = last_purchase.dt.month
+            output["ano_ultima_compra"] = last_purchase.dt.year
+        output["data_predicao"] = datetime.now()
+        output["versao_modelo"] = model_version_label(model_type, model_data)
+
+    else:
+        # Frequências ausentes do dataset são preenchidas pelas tabelas da versão
+        fields = [name for name in api.RecommendationInput.model_fields if name in frame.columns]
+        columns = chunk_columns(frame, fields, fill_numeric=False)
+        # Metadata do dataset (quando presente) entra no plano de features no lugar dos padrões
+        for name in ("data_clusterizacao", "versao_modelo"):
+            if name in frame.columns:
+                columns[name] = frame[name].to_numpy()
+        timings["prepare"] = time.perf_counter() - started
+        started = time.perf_counter()
+        scored = api.score_routes_columns(model_data, columns, rows, top_k)
+        timings["score"] = time.perf_counter() - started
+        started = time.perf_counter()
+        output = frame[[name for name in RECOMMENDATION_ID_COLUMNS if name in frame.columns]].copy()
+        for rank in range(1, top_k + 1):
+            output[f"predicted_route_{rank}"] = scored.get(f"route_{rank}")
+        for rank in range(1, top_k + 1):
+            output[f"prob_route_{rank}"] = scored.get(f"probability_{rank}")
+
+    timings["postprocess"] = time.perf_counter() - started
+    return output, timings
+
+# ============================================================================
+# EXECUÇÃO
+# ============================================================================
+
+def required_columns(model_type: str, version: Optional[str]) -> List[str]:
+    if model_type == "clusterization":
+        return api.CLUSTERIZATION_FEATURES
+    if model_type == "classification":
+        return list(api.load_model("classification", version)["feature_columns"])
+    # Campos *_freq só são obrigatórios quando a versão não tem tabelas de frequência
+    plan = api.load_model("recommendation", version)["feature_plan"]
+    return [
+        name for name, field in api.RecommendationInput.model_fields.items()
+        if field.is_required() or name in plan.required_frequencies
+    ]
+
+def preload_shared_model(model_type: str, version: Optional[str]) -> Dict[str, int]:
+    """
+    Carrega o modelo no processo pai antes do fork dos workers (sem inferência:
+    pools de threads e OpenMP não sobrevivem ao fork)
+    """
+    bundle = api.model_registry.get(model_type, version)
+    shared = share_arrays(bundle)
+    gc.collect()
+    gc.freeze()
+    return shared
+
+def scored_chunks(model_type: str, path: str, chunk_size: int, workers: int, version: Optional[str],
+                  top_k: int, stage_seconds: Dict[str, float]) -> Iterator[pd.DataFrame]:
+    """
+    Blocos pontuados, na ordem de entrada. No máximo 2 blocos por worker ficam em
+    andamento, limitando a memória independentemente do tamanho do arquivo
+    """
+    def reading():
+        chunks = read_chunks(path, chunk_size)
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            stage_seconds["read"] += time.perf_counter() - started
+            if chunk is None:
+                return
+            yield chunk
+
+    def collect(result):
+        output, timings = result
+        for stage_name, seconds in timings.items():
+            stage_seconds[stage_name] += seconds
+        return output
+
+    if workers <= 1:
+        for chunk in reading():
+            yield collect(score_chunk(model_type, chunk, version, top_k))
+        return
+
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = deque()
+        for chunk in reading():
+            pending.append(pool.submit(score_chunk, model_type, chunk, version, top_k))
+            if len(pending) >= workers * 2:
+                yield collect(pending.popleft().result())
+        while pending:
+            yield collect(pending.popleft().result())
+
+def report(stage_seconds: Dict[str, float], rows: int, elapsed: float, workers: int):
+    """Vazão por etapa (etapas dos workers somam o tempo de todos os processos)"""
+    print("-" * 70)
+    for stage_name, seconds in stage_seconds.items():
+        if seconds <= 0:
+            continue
+        print(f"{stage_name:12} | {seconds:9.2f} s | {rows / seconds:14,.0f} linhas/s")
+    print("-" * 70)
+    print(f"{'total':12} | {elapsed:9.2f} s | {rows / elapsed:14,.0f} linhas/s ({workers} workers)")
+
+def main():
+    global customer_clusters
+    parser = argparse.ArgumentParser(description="Pontuação offline em lote (CSV/Parquet)")
+    parser.add_argument("model_type", choices=list(api.MODEL_TYPES))
+    parser.add_argument("input", help="Arquivo de entrada (.csv ou .parquet)")
+    parser.add_argument("output", help="Arquivo de saída (.csv ou .parquet)")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Linhas por bloco")
+    parser.add_argument("--workers", type=int, default=configured_server_workers(), help="Processos de pontuação")
+    parser.add_argument("--model-version", default=None, help="Versão em artefacts/ (padrão: ML_API_MODEL_VERSION)")
+    parser.add_argument("--top-k", type=int, default=5, help="Rotas por registro na recomendação")
+    args = parser.parse_args()
+
+    version = api.model_registry.resolve(args.model_version)
+    print(f"🚀 Pontuação em lote: {args.model_type} (versão {version}) com {args.workers} workers")
+    stage_seconds = {"aggregate": 0.0, "read": 0.0, "prepare": 0.0, "score": 0.0, "postprocess": 0.0, "write": 0.0}
+    started = time.perf_counter()
+
+    shared = preload_shared_model(args.model_type, version)
+    print(f"✓ Modelo carregado ({shared['arrays']} arrays compartilhados com os workers)")
+
+    columns = input_columns(args.input)
+    if args.model_type == "clusterization" and not set(api.CLUSTERIZATION_FEATURES) <= set(columns):
+        # Entrada por compra: agrega por cliente e pontua uma vez por cliente
+        missing = [name for name in PURCHASE_COLUMNS if name not in columns]
+        if missing:
+            parser.error(f"Entrada sem as features de clusterização nem as colunas de compra: {', '.join(missing)}")
+        aggregate_started = time.perf_counter()
+        features = customer_features(args.input, args.chunk_size)
+        stage_seconds["aggregate"] = time.perf_counter() - aggregate_started
+        score_started = time.perf_counter()
+        model_data = api.load_model("clusterization", version)
+        customers = api.score_cluster_columns(
+            model_data, {name: features[name].to_numpy() for name in api.CLUSTERIZATION_FEATURES},
+            np.arange(len(features)), args.top_k
+        )
+        customer_clusters = pd.Series(customers["cluster"], index=features.index)
+        stage_seconds["score"] = time.perf_counter() - score_started
+        print(f"✓ {len(customer_clusters):,} clientes agregados e pontuados")
+    else:
+        missing = [name for name in required_columns(args.model_type, version) if name not in columns]
+        if missing:
+            parser.error(f"Colunas ausentes na entrada: {', '.join(missing)}")
+
+    writer = ChunkWriter(args.output)
+    rows = 0
+    try:
+        for output in scored_chunks(args.model_type, args.input, args.chunk_size, args.workers,
+                                    version, args.top_k, stage_seconds):
+            write_started = time.perf_counter()
+            writer.write(output)
+            stage_seconds["write"] += time.perf_counter() - write_started
+            rows += len(output)
+            print(f"\r  {rows:,} linhas pontuadas", end="", flush=True)
+    finally:
+        writer.close()
+    print()
+
+    print(f"✅ {rows:,} linhas gravadas em {args.output}")
+    report(stage_seconds, rows, time.perf_counter() - started, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga da API (HTTP de ponta a ponta)
+
+Dispara requisições com payloads sintéticos realistas contra os endpoints de predição
+e mede vazão e latência (p50/p95/p99) com N requisições simultâneas. Dois transportes:
+
+- asgi: chama a aplicação FastAPI dentro do processo, pelo protocolo ASGI (sem rede),
+  incluindo o lifespan (pré-carga dos modelos). Mede o custo da API em si.
+- uvicorn: sobe um servidor uvicorn local em um subprocesso (ou usa `--url`) e usa um
+  cliente HTTP/1.1 assíncrono com keep-alive. Inclui o custo de rede e do servidor.
+
+Os resultados são gravados em JSON e podem ser comparados com um baseline salvo: com
+`--max-regression` o comando termina com erro se o p95 de algum cenário piorar além do
+limite (uso em CI).
+
+Uso:
+    python benchmark_api.py --transport asgi --concurrency 16 --duration 10 --output atual.json
+    python benchmark_api.py --transport uvicorn --baseline atual.json --max-regression 15
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import main as api
+from benchmark_models import synthetic_clusterization_rows
+
+# Registros por requisição nos cenários /batch
+DEFAULT_BATCH_RECORDS = 100
+
+# ============================================================================
+# PAYLOADS SINTÉTICOS
+# ============================================================================
+# Valores amostrados dos próprios modelos carregados (centroides do K-Means e
+# vocabulários dos encoders), para exercitar os mesmos caminhos do tráfego real.
+
+def vocabulary(lookups: Dict[str, Any], column: str, fallback: str) -> List[str]:
+    """Valores vistos no treinamento para uma coluna categórica (ou o exemplo do schema)"""
+    lookup = lookups.get(column)
+    values = list(lookup.table) if lookup is not None else []
+    return values or [fallback]
+
+def clusterization_payloads(size: int, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    model_data = api.load_model("clusterization")
+    rows = synthetic_clusterization_rows(model_data, size)
+    payloads = []
+    for row in rows:
+        record = dict(zip(api.CLUSTERIZATION_FEATURES, (float(value) for value in row)))
+        for name in ("gmv_mean", "gmv_total", "gmv_std", "tickets_mean", "tickets_std", "avg_company_freq"):
+            record[name] = round(max(record[name], 0.0), 2)
+        for name in ("round_trip_rate", "weekend_rate"):
+            record[name] = round(min(max(record[name], 0.0), 1.0), 4)
+        record["avg_hour"] = round(min(max(record["avg_hour"], 0.0), 23.0), 2)
+        record["purchase_count"] = max(1, int(round(record["purchase_count"])))
+        record["tickets_total"] = max(1, int(round(record["tickets_total"])))
+        record["preferred_day"] = int(np.clip(round(record["preferred_day"]), 0, 6))
+        record["preferred_month"] = int(np.clip(round(record["preferred_month"]), 1, 12))
+        payloads.append(record)
+    return payloads
+
+def classification_payloads(size: int, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    lookups = api.load_model("classification").get("category_lookups", {})
+    example = api.schema_example(api.ClassificationInput).dict()
+    origins = vocabulary(lookups, "origem_ultima", example["origem_ultima"])
+    destinations = vocabulary(lookups, "destino_ultima", example["destino_ultima"])
+    companies = vocabulary(lookups, "empresa_ultima", example["empresa_ultima"])
+
+    payloads = []
+    for _ in range(size):
+        purchases = int(rng.integers(1, 30))
+        gmv = rng.lognormal(4.5, 0.5, purchases)
+        tickets = rng.integers(1, 4, purchases)
+        hours = rng.integers(0, 24, purchases)
+        payloads.append({
+            "gmv_ultima_compra": round(float(gmv[-1]), 2),
+            "tickets_ultima_compra": int(tickets[-1]),
+            "origem_ultima": str(rng.choice(origins)),
+            "destino_ultima": str(rng.choice(destinations)),
+            "empresa_ultima": str(rng.choice(companies)),
+            "dias_desde_ultima_compra": int(rng.integers(0, 720)),
+            "total_compras": purchases,
+            "dias_unicos_compra": int(rng.integers(1, purchases + 1)),
+            "gmv_total": round(float(gmv.sum()), 2),
+            "gmv_medio": round(float(gmv.mean()), 2),
+            "gmv_std": round(float(gmv.std(ddof=1)) if purchases > 1 else 0.0, 2),
+            "gmv_min": round(float(gmv.min()), 2),
+            "gmv_max": round(float(gmv.max()), 2),
+            "tickets_total": int(tickets.sum()),
+            "tickets_medio": round(float(tickets.mean()), 2),
+            "tickets_max": int(tickets.max()),
+            "mes_preferido": int(rng.integers(1, 13)),
+            "dia_semana_preferido": int(rng.integers(0, 7)),
+            "hora_media": round(float(hours.mean()), 2),
+            "hora_std": round(float(hours.std(ddof=1)) if purchases > 1 else 0.0, 2),
+            "origens_unicas": int(rng.integers(1, purchases + 1)),
+            "destinos_unicos": int(rng.integers(1, purchases + 1)),
+            "empresas_unicas": int(rng.integers(1, min(purchases, 5) + 1)),
+            "intervalo_medio_dias": round(float(rng.uniform(1, 365)), 1) if purchases > 1 else 0.0,
+            "regularidade": round(float(rng.uniform(0, 1)), 4)
+        })
+    return payloads
+
+def recommendation_payloads(size: int, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    models = api.load_model("recommendation")
+    lookups = models["feature_lookups"]
+    example = api.schema_example(api.RecommendationInput).dict()
+    routes = [route for route in vocabulary(lookups, "route_departure", example["route_departure"]) if "_to_" in route]
+    routes = routes or [f"{example['place_origin_departure']}_to_{example['place_destination_departure']}"]
+    companies = vocabulary(lookups, "fk_departure_ota_bus_company", example["fk_departure_ota_bus_company"])
+    n_clusters = int(api.load_model("clusterization").get("n_clusters", 1))
+    first_day = date(2018, 1, 1)
+
+    payloads = []
+    for _ in range(size):
+        route = str(rng.choice(routes))
+        origin, destination = route.split("_to_", 1)
+        round_trip = int(rng.random() < 0.3)
+        record = dict(example)
+        record.update({
+            "fk_contact": f"{int(rng.integers(0, 2**63)):x}",
+            "date_purchase": (first_day + timedelta(days=int(rng.integers(0, 730)))).isoformat(),
+            "time_purchase": f"{int(rng.integers(0, 24)):02d}:{int(rng.integers(0, 60)):02d}:{int(rng.integers(0, 60)):02d}",
+            "place_origin_departure": origin,
+            "place_destination_departure": destination,
+            "place_origin_return": destination if round_trip else "0",
+            "place_destination_return": origin if round_trip else "0",
+            "fk_departure_ota_bus_company": str(rng.choice(companies)),
+            "fk_return_ota_bus_company": str(rng.choice(companies)) if round_trip else "1",
+            "gmv_success": round(float(rng.lognormal(4.5, 0.5)), 2),
+            "total_tickets_quantity_success": int(rng.integers(1, 4)),
+            "route_departure": route,
+            "route_return": f"{destination}_to_{origin}" if round_trip else "0_to_0",
+            "is_round_trip": round_trip,
+            "cluster": int(rng.integers(0, n_clusters))
+        })
+        payloads.append(record)
+    return payloads
+
+PAYLOAD_FACTORIES: Dict[str, Callable[[int, np.random.Generator], List[Dict[str, Any]]]] = {
+    "clusterization": clusterization_payloads,
+    "classification": classification_payloads,
+    "recommendation": recommendation_payloads,
+}
+
+def columnar(records: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Layout colunar dos endpoints /batch"""
+    return {name: [record[name] for record in records] for name in records[0]}
+
+def build_scenarios(names: List[str], pool_size: int, batch_records: int, seed: int) -> Dict[str, Tuple[str, str, List[bytes]]]:
+    """
+    Cenário -> (método, caminho, corpos pré-serializados)
+    `<modelo>` usa o endpoint unitário; `<modelo>_batch`, o /batch com `batch_records` registros
+    """
+    rng = np.random.default_rng(seed)
+    scenarios = {}
+    for name in names:
+        if name == "health":
+            scenarios[name] = ("GET", "/health", [b""])
+            continue
+        model_type, _, variant = name.partition("_")
+        if model_type not in PAYLOAD_FACTORIES or variant not in ("", "batch"):
+            raise ValueError(f"Cenário desconhecido: {name}")
+        records = PAYLOAD_FACTORIES[model_type](pool_size if not variant else pool_size * batch_records, rng)
+        if variant == "batch":
+            bodies = [json.dumps(columnar(records[i:i + batch_records])).encode()
+                      for i in range(0, len(records), batch_records)]
+            scenarios[name] = ("POST", f"/{model_type}/batch", bodies)
+        else:
+            scenarios[name] = ("POST", f"/{model_type}", [json.dumps(record).encode() for record in records])
+    return scenarios
+
+# ============================================================================
+# TRANSPORTES
+# ============================================================================
+
+class ASGIClient:
+    """Chama a aplicação ASGI diretamente, sem rede nem cliente HTTP"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body: bytes) -> int:
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"benchmark"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+        }
+        finished = asyncio.Event()
+        status = 0
+        sent_body = False
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Corpo já entregue: a "conexão" só termina depois da resposta
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished.set()
+
+        await self.app(scope, receive, send)
+        finished.set()
+        return status
+
+    async def close(self):
+        pass
+
+class HTTPClient:
+    """
+    Cliente HTTP/1.1 mínimo sobre asyncio: uma conexão keep-alive por requisição
+    simultânea, corpo lido por Content-Length ou chunked
+    """
+
+    def __init__(self, url: str):
+        address = url.split("://", 1)[-1].rstrip("/")
+        host, _, port = address.partition(":")
+        self.host = host
+        self.port = int(port or 80)
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def _connection(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        if self._idle:
+            return self._idle.pop()
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method: str, path: str, body: bytes) -> int:
+        reader, writer = await self._connection()
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+        try:
+            writer.write(head.encode("latin-1") + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if "content-length" in headers:
+                await reader.readexactly(int(headers["content-length"]))
+            elif headers.get("transfer-encoding") == "chunked":
+                while True:
+                    size = int((await reader.readline()).strip(), 16)
+                    await reader.readexactly(size + 2)
+                    if size == 0:
+                        break
+        except Exception:
+            writer.close()
+            raise
+        if headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+        return status
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+def start_uvicorn(port: int, workers: int) -> subprocess.Popen:
+    """Sobe `uvicorn main:app` em um subprocesso, no diretório atual (onde estão os artefatos)"""
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", os.path.dirname(os.path.abspath(__file__)),
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    return subprocess.Popen(command)
+
+async def wait_ready(client: HTTPClient, timeout: float = 120.0):
+    """Aguarda o /ready responder 200 (modelos carregados e aquecidos)"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if await client.request("GET", "/ready", b"") == 200:
+                return
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            client._idle.clear()
+        await asyncio.sleep(0.25)
+    raise TimeoutError(f"Servidor não ficou pronto em {timeout:.0f}s")
+
+# ============================================================================
+# EXECUÇÃO E RELATÓRIO
+# ============================================================================
+
+async def run_scenario(client, method: str, path: str, bodies: List[bytes],
+                       concurrency: int, duration: float, warmup: float) -> Dict[str, Any]:
+    """
+    Carga em malha fechada: `concurrency` clientes, cada um dispara a próxima requisição
+    assim que recebe a anterior. Só as requisições após o aquecimento entram nas medidas
+    """
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def user(offset: int):
+        nonlocal errors
+        index = offset
+        while True:
+            sent = time.perf_counter()
+            if sent >= stop_at:
+                return
+            try:
+                status = await client.request(method, path, bodies[index % len(bodies)])
+            except Exception:
+                status = 0
+            finished = time.perf_counter()
+            index += concurrency
+            if sent >= measure_from:
+                latencies.append(finished - sent)
+                statuses[status] = statuses.get(status, 0) + 1
+                errors += int(not 200 <= status < 300)
+
+    await asyncio.gather(*(user(offset) for offset in range(concurrency)))
+    samples = np.array(latencies) * 1000
+    measured = time.perf_counter() - measure_from
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "status": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(len(samples) / measured, 2) if measured > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(float(samples.mean()), 3),
+            "p50": round(float(np.percentile(samples, 50)), 3),
+            "p95": round(float(np.percentile(samples, 95)), 3),
+            "p99": round(float(np.percentile(samples, 99)), 3),
+            "max": round(float(samples.max()), 3)
+        } if len(samples) else None
+    }
+
+def environment_metadata(args: argparse.Namespace) -> Dict[str, Any]:
+    """Contexto da execução gravado junto com os resultados"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "transport": args.transport,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "warmup_s": args.warmup,
+        "batch_records": args.batch_records,
+        "model_version": api.model_registry.active_version,
+        # Configuração da API que afeta o desempenho (pools, micro-batching, cache, backends...)
+        "config": {name: value for name, value in sorted(os.environ.items()) if name.startswith("ML_API_")}
+    }
+
+def print_results(results: Dict[str, Dict[str, Any]]):
+    print(f"{'cenário':24} | {'req':>7} | {'erros':>5} | {'req/s':>9} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    print("-" * 86)
+    for name, stats in results.items():
+        latency = stats["latency_ms"] or {"p50": float("nan"), "p95": float("nan"), "p99": float("nan")}
+        print(f"{name:24} | {stats['requests']:7d} | {stats['errors']:5d} | {stats['throughput_rps']:9.1f} | "
+              f"{latency['p50']:8.2f} | {latency['p95']:8.2f} | {latency['p99']:8.2f}")
+
+def compare_with_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], max_regression: Optional[float]) -> bool:
+    """
+    Imprime a variação de cada cenário em relação ao baseline
+    Retorna False quando algum p95 piorou mais que `max_regression` (%)
+    """
+    ok = True
+    print(f"\nComparação com o baseline ({baseline['metadata'].get('timestamp')}, "
+          f"commit {baseline['metadata'].get('git_commit')})")
+    print(f"{'cenário':24} | {'req/s':>9} | {'p50':>8} | {'p95':>8} | {'p99':>8}")
+    print("-" * 70)
+
+    def change(current: float, previous: float) -> float:
+        return (current - previous) / previous * 100 if previous else 0.0
+
+    for name, stats in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None or not previous.get("latency_ms") or not stats["latency_ms"]:
+            print(f"{name:24} | sem dados comparáveis no baseline")
+            continue
+        deltas = {key: change(stats["latency_ms"][key], previous["latency_ms"][key]) for key in ("p50", "p95", "p99")}
+        throughput = change(stats["throughput_rps"], previous["throughput_rps"])
+        regressed = max_regression is not None and deltas["p95"] > max_regression
+        ok &= not regressed
+        print(f"{name:24} | {throughput:+8.1f}% | {deltas['p50']:+7.1f}% | {deltas['p95']:+7.1f}% | "
+              f"{deltas['p99']:+7.1f}%{'  ❌ regressão' if regressed else ''}")
+    return ok
+
+async def run(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    scenarios = build_scenarios(args.scenarios, args.payloads, args.batch_records, args.seed)
+    server = None
+
+    if args.transport == "asgi":
+        client = ASGIClient(api.app)
+        lifespan = api.app.router.lifespan_context(api.app)
+        await lifespan.__aenter__()
+        # Mesma condição de início do tráfego real: modelos carregados e aquecidos
+        while api.PRELOAD_MODELS and not api.model_registry.ready():
+            await asyncio.sleep(0.1)
+    else:
+        if not args.url:
+            server = start_uvicorn(args.port, args.workers)
+        client = HTTPClient(args.url or f"http://127.0.0.1:{args.port}")
+        lifespan = None
+        await wait_ready(client)
+
+    results = {}
+    try:
+        for name, (method, path, bodies) in scenarios.items():
+            print(f"▶ {name}: {method} {path} ({args.concurrency} simultâneas, {args.duration:.0f}s)")
+            results[name] = await run_scenario(client, method, path, bodies,
+                                               args.concurrency, args.duration, args.warmup)
+    finally:
+        await client.close()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga da API (vazão e p50/p95/p99)")
+    parser.add_argument("--transport", choices=("asgi", "uvicorn"), default="asgi",
+                        help="asgi: aplicação no próprio processo; uvicorn: servidor HTTP local")
+    parser.add_argument("--url", help="Servidor já em execução (transporte uvicorn), ex.: http://127.0.0.1:3021")
+    parser.add_argument("--port", type=int, default=3099, help="Porta do uvicorn iniciado pelo benchmark")
+    parser.add_argument("--workers", type=int, default=1, help="Workers do uvicorn iniciado pelo benchmark")
+    parser.add_argument("--scenarios", nargs="+",
+                        default=["clusterization", "classification", "recommendation", "recommendation_batch"],
+                        help="Cenários: <modelo>, <modelo>_batch ou health")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requisições simultâneas")
+    parser.add_argument("--duration", type=float, default=10.0, help="Duração medida (s) de cada cenário")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Aquecimento (s) não medido de cada cenário")
+    parser.add_argument("--batch-records", type=int, default=DEFAULT_BATCH_RECORDS, help="Registros por requisição /batch")
+    parser.add_argument("--payloads", type=int, default=256, help="Payloads distintos por cenário")
+    parser.add_argument("--seed", type=int, default=7, help="Semente dos payloads sintéticos")
+    parser.add_argument("--output", help="Arquivo JSON para gravar os resultados")
+    parser.add_argument("--baseline", help="Resultados JSON anteriores para comparação")
+    parser.add_argument("--max-regression", type=float,
+                        help="Piora máxima (%%) aceita no p95 em relação ao baseline; acima disso, código de saída 1")
+    args = parser.parse_args()
+
+    print(f"🚀 Benchmark da API ({args.transport})")
+    print("=" * 86)
+    results = asyncio.run(run(args))
+    print()
+    print_results(results)
+
+    report = {"metadata": environment_metadata(args), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados salvos em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare_with_baseline(results, baseline, args.max_regression):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
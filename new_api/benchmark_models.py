@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark de latência dos caminhos de inferência dos modelos
+
+Compara, dentro do processo (sem HTTP), o caminho original baseado em sklearn/pandas
+com os caminhos otimizados da API e verifica que os resultados são equivalentes:
+K-Means fundido e ensembles de árvores compilados (RandomForest e XGBoost).
+
+Uso:
+    python benchmark_models.py [--repeat 2000] [--batch-size 1000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from main import (
+    CLUSTERIZATION_FEATURES,
+    load_model,
+    score_clusterization_fused,
+    score_clusterization_sklearn,
+)
+from tree_compiler import compile_and_verify, native_predict_proba, probe_matrix
+
+def time_call(func, repeat: int) -> float:
+    """Executa a função `repeat` vezes e retorna a latência média em microssegundos"""
+    func()  # aquecimento
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def synthetic_clusterization_rows(model_data, size: int) -> np.ndarray:
+    """Gera registros realistas amostrando em torno dos centroides do K-Means"""
+    rng = np.random.default_rng(7)
+    centers = np.asarray(model_data["model"].cluster_centers_)
+    picks = rng.integers(0, len(centers), size)
+    scaled = centers[picks] + rng.normal(0, 0.5, (size, len(CLUSTERIZATION_FEATURES)))
+    return model_data["scaler"].inverse_transform(scaled)
+
+def report(name: str, baseline_us: float, optimized_us: float):
+    """Imprime uma linha de comparação"""
+    print(f"{name:32} | original: {baseline_us:10.1f} µs | otimizado: {optimized_us:10.1f} µs | "
+          f"ganho: {baseline_us / optimized_us:6.1f}x")
+
+def benchmark_clusterization(repeat: int, batch_size: int):
+    """Compara o K-Means do sklearn com o K-Means fundido (scaler + centroides)"""
+    model_data = load_model("clusterization")
+    fused = model_data.get("fused_kmeans")
+    if fused is None:
+        print("⚠️  K-Means fundido indisponível (validação na carga falhou)")
+        return
+
+    batch = synthetic_clusterization_rows(model_data, batch_size)
+    single = batch[:1]
+
+    # Verificação de equivalência antes de medir
+    expected_clusters, expected_confidences = score_clusterization_sklearn(model_data, batch)
+    clusters, confidences = score_clusterization_fused(fused, batch)
+    assert np.array_equal(clusters, expected_clusters), "clusters divergentes"
+    assert np.allclose(confidences, expected_confidences), "confiança divergente"
+    print(f"✅ Clusterização: {batch_size} registros idênticos ao sklearn "
+          f"(erro máx. confiança: {np.abs(confidences - expected_confidences).max():.2e})")
+
+    report(
+        "clusterization (1 registro)",
+        time_call(lambda: score_clusterization_sklearn(model_data, single), repeat),
+        time_call(lambda: score_clusterization_fused(fused, single), repeat)
+    )
+    batch_repeat = max(1, repeat // 100)
+    report(
+        f"clusterization ({batch_size} registros)",
+        time_call(lambda: score_clusterization_sklearn(model_data, batch), batch_repeat),
+        time_call(lambda: score_clusterization_fused(fused, batch), batch_repeat)
+    )
+
+def benchmark_tree_ensemble(model_type: str, repeat: int, batch_size: int):
+    """Compara o predict_proba nativo com o ensemble compilado em arrays"""
+    bundle = load_model(model_type)
+    model = bundle["model"]
+    forest = compile_and_verify(model)
+    if forest is None:
+        print(f"⚠️  {model_type}: ensemble compilado indisponível (não suportado ou divergente)")
+        return
+
+    # Registros que exercitam os limiares reais das árvores
+    batch = probe_matrix(forest, batch_size, seed=7)
+    expected = native_predict_proba(model, batch)
+    compiled = forest.predict_proba(batch)
+    error = np.abs(compiled - expected).max()
+    assert error <= 1e-5, f"{model_type}: probabilidades divergentes ({error:.2e})"
+    print(f"✅ {model_type}: {batch_size} registros equivalentes ao nativo "
+          f"({forest.n_trees} árvores, {forest.n_nodes} nós, erro máx.: {error:.2e})")
+
+    # Ponto de virada: acima dele o nativo (multithread) volta a ser mais rápido (backend auto)
+    for size in sorted({1, 16, 64, 256, batch_size}):
+        rows = batch[:size]
+        size_repeat = max(1, repeat // size)
+        report(
+            f"{model_type} ({size} registros)",
+            time_call(lambda: native_predict_proba(model, rows), size_repeat),
+            time_call(lambda: forest.predict_proba(rows), size_repeat)
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos caminhos de inferência")
+    parser.add_argument("--repeat", type=int, default=2000, help="Repetições por medição")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Tamanho do lote")
+    args = parser.parse_args()
+
+    print("🚀 Benchmark de inferência (em processo, sem HTTP)")
+    print("=" * 70)
+    benchmark_clusterization(args.repeat, args.batch_size)
+    print("-" * 70)
+    benchmark_tree_ensemble("classification", args.repeat, args.batch_size)
+    print("-" * 70)
+    benchmark_tree_ensemble("recommendation", args.repeat, args.batch_size)
+
+if __name__ == "__main__":
+    main()
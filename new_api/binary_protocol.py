@@ -0,0 +1,422 @@
+"""
+Protocolo binário de pontuação em socket Unix
+
+Listener secundário e opcional (ML_API_UDS_PATH) para serviços no mesmo host: sem
+HTTP, JSON nem pydantic por registro. Cada requisição é um frame com cabeçalho fixo
+seguido de N registros de layout fixo; a resposta traz N resultados de layout fixo.
+Os registros viram colunas NumPy sem parsing (np.frombuffer) e são pontuados pelas
+mesmas funções, modelos e encoders dos endpoints /arrow, no pool de inferência do modelo.
+
+Frames (little-endian):
+
+    requisição: magic "MLB1" | modelo u8 | top_k u8 | flags u16 (0) | request_id u32
+                | deadline_ms u32 (0 = sem prazo) | registros u32 | bytes u32 | registros...
+    resposta:   magic "MLR1" | modelo u8 | status u8 | flags u16 (0) | request_id u32
+                | registros u32 | bytes u32 | resultados... (ou mensagem UTF-8 se status != 0)
+
+Modelos: 1 clusterization, 2 classification, 3 recommendation; 0 devolve em JSON os
+layouts de registro e de resultado de cada modelo (`describe`).
+
+Layout do registro: os campos do schema unitário, na ordem do schema. Numéricos em
+float64 (NaN = nulo nos campos opcionais, ex.: frequências); texto em UTF-8 com tamanho
+fixo completado com bytes nulos (ML_API_UDS_TEXT_BYTES, padrão 64 = um hash SHA-256 em
+hexadecimal; o dobro + 4 nos campos route_*, "<origem>_to_<destino>").
+
+Cada resultado começa com `ok` (u8): 0 indica registro inválido (demais campos zerados).
+Cada conexão atende um frame por vez, em ordem; para paralelismo, abra várias conexões.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+import numpy as np
+
+from admission import AdmissionController, AdmissionRejected, DeadlineExceeded, configured_admission, deadline_scope
+from metrics import REQUEST_DURATION
+from schema_fields import field_type
+
+logger = logging.getLogger(__name__)
+
+REQUEST_MAGIC = b"MLB1"
+RESPONSE_MAGIC = b"MLR1"
+REQUEST_HEADER = struct.Struct("<4sBBHIIII")
+RESPONSE_HEADER = struct.Struct("<4sBBHIII")
+
+DESCRIBE = 0
+MODEL_CODES = {1: "clusterization", 2: "classification", 3: "recommendation"}
+
+STATUS_OK = 0
+STATUS_BAD_REQUEST = 1
+STATUS_ERROR = 2
+STATUS_OVERLOADED = 3
+STATUS_DEADLINE = 4
+# Status equivalente em HTTP (métricas com os mesmos rótulos dos endpoints)
+HTTP_STATUS = {STATUS_OK: 200, STATUS_BAD_REQUEST: 400, STATUS_ERROR: 500, STATUS_OVERLOADED: 503, STATUS_DEADLINE: 504}
+
+# Categoria de risco da classificação como código
+RISK_CODES = {"Baixo": 0, "Médio": 1, "Alto": 2}
+
+TEXT_BYTES = max(1, int(os.getenv("ML_API_UDS_TEXT_BYTES", "64")))
+
+class ProtocolError(ValueError):
+    """Frame malformado ou incompatível com o layout do modelo"""
+
+def configured_socket_path() -> Optional[str]:
+    """Caminho do socket Unix (ML_API_UDS_PATH); sem ele o listener não sobe"""
+    return os.getenv("ML_API_UDS_PATH") or None
+
+# ============================================================================
+# LAYOUTS
+# ============================================================================
+
+def _text_bytes(field_name: str) -> int:
+    return 2 * TEXT_BYTES + 4 if field_name.startswith("route_") else TEXT_BYTES
+
+def record_dtype(record_schema: Type[Any]) -> np.dtype:
+    """Layout de um registro de entrada a partir do schema unitário (sem alinhamento)"""
+    fields = []
+    for field_name, field in record_schema.model_fields.items():
+        annotation, _ = field_type(field)
+        fields.append((field_name, "<f8" if annotation in (int, float) else f"S{_text_bytes(field_name)}"))
+    return np.dtype(fields)
+
+def result_dtype(model_type: str, top_k: int) -> np.dtype:
+    """Layout de um resultado; o do /recommendation depende do top_k"""
+    if model_type == "clusterization":
+        return np.dtype([("ok", "u1"), ("cluster", "<i4"), ("confidence", "<f8")])
+    if model_type == "classification":
+        return np.dtype([("ok", "u1"), ("will_purchase", "u1"), ("probability", "<f8"), ("risk_category", "u1")])
+    fields = [("ok", "u1"), ("user_cluster", "<i4")]
+    for rank in range(1, top_k + 1):
+        fields += [(f"route_{rank}", f"S{_text_bytes('route_')}"), (f"probability_{rank}", "<f8")]
+    return np.dtype(fields)
+
+def _describe_dtype(dtype: np.dtype) -> Dict[str, Any]:
+    return {"itemsize": dtype.itemsize, "fields": [[name, dtype.fields[name][0].str, dtype.fields[name][1]] for name in dtype.names]}
+
+# ============================================================================
+# CODIFICAÇÃO
+# ============================================================================
+
+def record_columns(records: np.ndarray, record_schema: Type[Any]) -> Tuple[Dict[str, np.ndarray], Dict[int, str]]:
+    """
+    Converte os registros binários para as colunas do schema unitário
+    Mesmo contrato de coerce_batch_columns: colunas NumPy + erros por registro
+    """
+    columns: Dict[str, np.ndarray] = {}
+    errors: Dict[int, str] = {}
+    for field_name, field in record_schema.model_fields.items():
+        annotation, optional = field_type(field)
+        raw = records[field_name]
+        if annotation in (int, float):
+            values = raw.astype(np.float64)
+            invalid = ~np.isfinite(values)
+            if optional:
+                # NaN em campo opcional é nulo (preenchido no servidor), não é erro
+                invalid &= ~np.isnan(values)
+            if annotation is int:
+                invalid |= np.isfinite(values) & (values != np.floor(values))
+                values = np.where(invalid, 0, values)
+                if not optional:
+                    values = values.astype(np.int64)
+        else:
+            invalid = np.zeros(len(raw), dtype=bool)
+            try:
+                values = np.char.decode(raw, "utf-8").astype(object)
+            except UnicodeDecodeError:
+                # Caminho lento apenas quando algum valor não é UTF-8 válido
+                values = np.empty(len(raw), dtype=object)
+                for i, value in enumerate(raw):
+                    try:
+                        values[i] = value.decode("utf-8")
+                    except UnicodeDecodeError:
+                        values[i] = ""
+                        invalid[i] = True
+        for i in np.flatnonzero(invalid):
+            errors.setdefault(int(i), f"Campo '{field_name}' inválido: {raw[i]!r}")
+        columns[field_name] = values
+    return columns, errors
+
+def encode_results(model_type: str, top_k: int, size: int, rows: np.ndarray, outputs: Dict[str, np.ndarray]) -> bytes:
+    """Resultados de layout fixo: as saídas nas linhas pontuadas, `ok` = 0 nas demais"""
+    results = np.zeros(size, dtype=result_dtype(model_type, top_k))
+    results["ok"][rows] = 1
+    for name, values in outputs.items():
+        if name == "risk_category":
+            values = np.array([RISK_CODES[value] for value in values], dtype=np.uint8)
+        elif values.dtype == object:
+            values = np.char.encode(values.astype(str), "utf-8")
+        results[name][rows] = values
+    return results.tobytes()
+
+# ============================================================================
+# LISTENER
+# ============================================================================
+
+def bind_unix_socket(path: str) -> socket.socket:
+    """
+    Cria o socket de escuta (também usado pelo prefork.py antes do fork)
+    Remove um arquivo de socket abandonado; recusa subir se outro processo o atende
+    """
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise OSError(f"{path} existe e não é um socket")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+        else:
+            raise OSError(f"Socket {path} já está em uso por outro processo")
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    # Sem autenticação no protocolo: acesso controlado pela permissão do arquivo
+    os.chmod(path, 0o660)
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+# Pontua os registros de um frame: (modelo, registros, top_k) -> resultados codificados
+ScoreFrame = Callable[[str, np.ndarray, int], Awaitable[bytes]]
+
+class BinaryScoringServer:
+    """Listener do protocolo binário: validação dos frames, admissão e despacho"""
+
+    def __init__(self, record_dtypes: Dict[str, np.dtype], score: ScoreFrame, default_top_k: int, max_top_k: int,
+                 max_records: int, controllers: Optional[Dict[str, AdmissionController]] = None):
+        """
+        `record_dtypes`: layout de entrada por modelo
+        `controllers`: dicionário do controle de admissão da aplicação; cada modelo tem
+        o seu limite (ML_API_ADMISSION_UDS_<MODELO>_*) e aparece no /health e /metrics
+        """
+        self.record_dtypes = record_dtypes
+        self.score = score
+        self.default_top_k = default_top_k
+        self.max_top_k = max_top_k
+        self.max_records = max_records
+        self.controllers = controllers if controllers is not None else {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.path: Optional[str] = None
+        self._owns_path = False
+        self.max_frame_bytes = max_records * max(dtype.itemsize for dtype in record_dtypes.values())
+        self.connections = 0
+        self.frames = 0
+
+    async def start(self, path: Optional[str] = None, sock: Optional[socket.socket] = None):
+        """Escuta em `path` (criando o socket) ou em um socket herdado do prefork.py"""
+        if sock is None:
+            sock = bind_unix_socket(path)
+            self._owns_path = True
+        self.path = sock.getsockname()
+        self.server = await asyncio.start_unix_server(self._handle_connection, sock=sock)
+        logger.info(f"Protocolo binário escutando em {self.path}")
+
+    async def close(self):
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        if self._owns_path and self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def describe(self) -> Dict[str, Any]:
+        """Layouts dos frames, registros e resultados (resposta do modelo 0)"""
+        return {
+            "request_header": REQUEST_HEADER.format,
+            "response_header": RESPONSE_HEADER.format,
+            "models": {code: model_type for code, model_type in MODEL_CODES.items()},
+            "status": {"ok": STATUS_OK, "bad_request": STATUS_BAD_REQUEST, "error": STATUS_ERROR,
+                       "overloaded": STATUS_OVERLOADED, "deadline": STATUS_DEADLINE},
+            "default_top_k": self.default_top_k,
+            "max_top_k": self.max_top_k,
+            "max_records": self.max_records,
+            "records": {model_type: _describe_dtype(dtype) for model_type, dtype in self.record_dtypes.items()},
+            "results": {
+                model_type: _describe_dtype(result_dtype(model_type, self.default_top_k))
+                for model_type in self.record_dtypes
+            },
+            "risk_categories": RISK_CODES
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "connections": self.connections, "frames": self.frames}
+
+    def _controller(self, model_type: str) -> AdmissionController:
+        name = f"UDS_{model_type.upper()}"
+        controller = self.controllers.get(name)
+        if controller is None:
+            config = configured_admission(name)
+            config["degraded"] = False
+            controller = self.controllers[name] = AdmissionController(name, **config)
+        return controller
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(REQUEST_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                magic, model_code, top_k, _, request_id, deadline_ms, size, length = REQUEST_HEADER.unpack(header)
+                # Sem o magic (ou com um tamanho absurdo) não há como achar o próximo frame: encerra a conexão
+                error = None
+                if magic != REQUEST_MAGIC:
+                    error = "Frame sem o magic MLB1"
+                elif length > self.max_frame_bytes:
+                    error = f"Frame de {length} bytes excede o máximo de {self.max_frame_bytes} bytes"
+                if error is not None:
+                    writer.write(self._frame(model_code, STATUS_BAD_REQUEST, request_id, 0, error.encode()))
+                    await writer.drain()
+                    break
+                payload = await reader.readexactly(length) if length else b""
+                writer.write(await self._process(model_code, top_k, request_id, deadline_ms, size, payload))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _process(self, model_code: int, top_k: int, request_id: int, deadline_ms: int, size: int, payload: bytes) -> bytes:
+        started = time.perf_counter()
+        if model_code == DESCRIBE:
+            return self._frame(model_code, STATUS_OK, request_id, 0, json.dumps(self.describe()).encode())
+        model_type = MODEL_CODES.get(model_code, "unknown")
+        status, body = STATUS_OK, b""
+        try:
+            top_k = self._validate(model_type, top_k, size, payload)
+            records = np.frombuffer(payload, dtype=self.record_dtypes[model_type])
+            body = await self._score_admitted(model_type, records, top_k,
+                                              started + deadline_ms / 1000 if deadline_ms else None)
+        except ProtocolError as e:
+            status, body = STATUS_BAD_REQUEST, str(e).encode()
+        except AdmissionRejected as e:
+            status = STATUS_DEADLINE if e.reason == "deadline" else STATUS_OVERLOADED
+            body = str(e).encode()
+        except DeadlineExceeded as e:
+            status, body = STATUS_DEADLINE, str(e).encode()
+        except Exception as e:
+            logger.error(f"Erro no protocolo binário ({model_type}): {e}")
+            status, body = STATUS_ERROR, f"Erro na predição: {e}".encode()
+        self.frames += 1
+        REQUEST_DURATION.observe(time.perf_counter() - started, f"uds:{model_type}", "UDS", HTTP_STATUS[status])
+        return self._frame(model_code, status, request_id, size if status == STATUS_OK else 0, body)
+
+    def _validate(self, model_type: str, top_k: int, size: int, payload: bytes) -> int:
+        if model_type not in self.record_dtypes:
+            raise ProtocolError(f"Modelo desconhecido (use {', '.join(f'{c}={m}' for c, m in MODEL_CODES.items())})")
+        if size == 0:
+            raise ProtocolError("O frame deve conter ao menos um registro")
+        if size > self.max_records:
+            raise ProtocolError(f"O frame excede o tamanho máximo de {self.max_records} registros")
+        itemsize = self.record_dtypes[model_type].itemsize
+        if len(payload) != size * itemsize:
+            raise ProtocolError(f"Tamanho do frame incompatível: {size} registros de {itemsize} bytes, recebidos {len(payload)} bytes")
+        if model_type != "recommendation":
+            return 0
+        top_k = top_k or self.default_top_k
+        if top_k > self.max_top_k:
+            raise ProtocolError(f"top_k máximo: {self.max_top_k}")
+        return top_k
+
+    async def _score_admitted(self, model_type: str, records: np.ndarray, top_k: int, deadline: Optional[float]) -> bytes:
+        controller = self._controller(model_type)
+        await controller.acquire(deadline)
+        started = time.perf_counter()
+        try:
+            # O pool de inferência descarta o frame se o prazo acabar na fila dele
+            with deadline_scope(deadline):
+                try:
+                    return await self.score(model_type, records, top_k)
+                except DeadlineExceeded:
+                    controller.expire()
+                    raise
+        finally:
+            controller.release(time.perf_counter() - started)
+
+    @staticmethod
+    def _frame(model_code: int, status: int, request_id: int, size: int, body: bytes) -> bytes:
+        return RESPONSE_HEADER.pack(RESPONSE_MAGIC, model_code, status, 0, request_id, size, len(body)) + body
+
+# ============================================================================
+# CLIENTE
+# ============================================================================
+
+class BinaryScoringClient:
+    """
+    Cliente síncrono de referência (testes, benchmark e serviços Python)
+    Os layouts vêm do próprio servidor (describe), então acompanham o schema
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self._request_id = 0
+        self.layout = json.loads(self._call(DESCRIBE, 0, 0, 0, b"")[1])
+        self.codes = {model_type: int(code) for code, model_type in self.layout["models"].items()}
+
+    def close(self):
+        self.sock.close()
+
+    def _read(self, length: int) -> bytes:
+        chunks = []
+        while length:
+            chunk = self.sock.recv(min(length, 1 << 20))
+            if not chunk:
+                raise ConnectionError("Conexão encerrada pelo servidor")
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b"".join(chunks)
+
+    def _call(self, model_code: int, top_k: int, deadline_ms: int, size: int, payload: bytes) -> Tuple[int, bytes]:
+        self._request_id += 1
+        self.sock.sendall(REQUEST_HEADER.pack(REQUEST_MAGIC, model_code, top_k, 0, self._request_id,
+                                              deadline_ms, size, len(payload)) + payload)
+        _, _, status, _, request_id, _, length = RESPONSE_HEADER.unpack(self._read(RESPONSE_HEADER.size))
+        return status, self._read(length)
+
+    @staticmethod
+    def _dtype(layout: Dict[str, Any]) -> np.dtype:
+        return np.dtype({"names": [field[0] for field in layout["fields"]],
+                         "formats": [field[1] for field in layout["fields"]],
+                         "offsets": [field[2] for field in layout["fields"]],
+                         "itemsize": layout["itemsize"]})
+
+    def pack(self, model_type: str, records: list) -> np.ndarray:
+        """Registros (dicts com os campos do schema; None = nulo) no layout do modelo"""
+        dtype = self._dtype(self.layout["records"][model_type])
+        packed = np.zeros(len(records), dtype=dtype)
+        for name in dtype.names:
+            values = [record.get(name) for record in records]
+            field_dtype = dtype.fields[name][0]
+            if field_dtype.kind == "S":
+                encoded = [str(value).encode("utf-8") for value in values]
+                if any(len(value) > field_dtype.itemsize for value in encoded):
+                    raise ValueError(f"Campo '{name}' excede {field_dtype.itemsize} bytes")
+                packed[name] = encoded
+            else:
+                packed[name] = [np.nan if value is None else value for value in values]
+        return packed
+
+    def score(self, model_type: str, records: np.ndarray, top_k: int = 0, deadline_ms: int = 0) -> np.ndarray:
+        """Pontua registros já no layout (ver `pack`); levanta RuntimeError se status != 0"""
+        status, body = self._call(self.codes[model_type], top_k, deadline_ms, len(records), records.tobytes())
+        if status != STATUS_OK:
+            raise RuntimeError(f"status {status}: {body.decode('utf-8', 'replace')}")
+        layout = self.layout["results"][model_type]
+        if model_type == "recommendation" and top_k and top_k != self.layout["default_top_k"]:
+            dtype = result_dtype(model_type, top_k)
+        else:
+            dtype = self._dtype(layout)
+        return np.frombuffer(body, dtype=dtype)
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Agregações incrementais por cliente a partir de eventos de compra
+
+Cada compra (uma linha no formato do df_t.csv) atualiza em O(1) o estado do cliente:
+médias e variâncias por Welford, mínimos/máximos, contadores fixos para as modas (mês e
+dia da semana) e conjuntos pequenos para as contagens distintas. As 25 features de
+classificação e as 13 de clusterização são derivadas do estado na leitura, com os mesmos
+resultados dos groupby dos notebooks, sem recalcular o histórico inteiro.
+
+Os eventos devem chegar em ordem cronológica por cliente (como na ingestão diária). Um
+evento atrasado atualiza todas as features, exceto o desvio padrão dos intervalos entre
+compras (`regularidade`), que o trata como o intervalo mais recente; esses eventos são
+contados em `late_events`.
+
+Um cliente cujo primeiro evento chega quando ele já tem histórico no feature store (via
+`has_history` na ingestão) fica marcado como parcial: o estado dele não cobre as compras
+anteriores, então as suas features continuam vindo do store até a próxima construção
+completa, e ele não entra nas tabelas publicadas.
+
+O estado pode ser salvo e retomado (pickle) e publicado como uma nova geração do
+feature_store.py, o que atualiza os endpoints /<modelo>/customer/{fk_contact} de todos
+os workers. A publicação parte da geração atual: só os clientes completos do estado são
+substituídos; os demais (e os parciais) seguem com as linhas do store:
+
+    python customer_aggregates.py compras_do_dia.csv --state aggregates.pkl --publish
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import pickle
+import threading
+from collections import Counter
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# pandas só é usado para publicar o estado e na CLI; a ingestão pela API não o importa
+if TYPE_CHECKING:
+    import pandas as pd
+
+import feature_store
+
+# ============================================================================
+# ESTADO POR CLIENTE
+# ============================================================================
+
+def _round2(value: float) -> float:
+    """Arredondamento do `.round(2)` do pandas (difere do round() do Python em x.xx5)"""
+    return float(np.round(value, 2))
+
+class RunningMoments:
+    """Média e variância amostral por Welford (numericamente estável, O(1) por valor)"""
+    __slots__ = ("count", "total", "compensation", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.compensation = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        # Soma compensada (Kahan), a mesma do groupby().mean() do pandas
+        corrected = value - self.compensation
+        total = self.total + corrected
+        self.compensation = (total - self.total) - corrected
+        self.total = total
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def average(self) -> float:
+        """Média como soma / contagem: o mesmo valor (até o último bit) do mean() do pandas"""
+        return self.total / self.count if self.count else 0.0
+
+    def std(self) -> float:
+        """Desvio padrão amostral (ddof=1, como o pandas); 0 com menos de dois valores"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+class CustomerAggregate:
+    """Estado agregado de um cliente"""
+    __slots__ = (
+        "purchases", "gmv", "gmv_min", "gmv_max", "tickets", "tickets_max",
+        "hours", "round_trips", "weekends", "months", "weekdays", "days", "origins", "destinations",
+        "companies", "intervals", "first_date", "last_date", "last_time", "last_purchase"
+    )
+
+    def __init__(self):
+        self.purchases = 0
+        self.gmv = RunningMoments()
+        self.gmv_min = math.inf
+        self.gmv_max = -math.inf
+        self.tickets = RunningMoments()
+        self.tickets_max = 0
+        self.hours = RunningMoments()
+        self.round_trips = 0
+        self.weekends = 0
+        self.months = [0] * 12
+        self.weekdays = [0] * 7
+        self.days = set()
+        self.origins = set()
+        self.destinations = set()
+        self.companies = Counter()
+        self.intervals = RunningMoments()
+        self.first_date: Optional[date] = None
+        self.last_date: Optional[date] = None
+        self.last_time = ""
+        self.last_purchase: Tuple[float, int, str, str, str] = (0.0, 0, "", "", "")
+
+    def add(self, purchase: Dict[str, Any]) -> bool:
+        """Aplica uma compra já normalizada; retorna False se ela chegou fora de ordem"""
+        purchase_date = purchase["date"]
+        gmv = purchase["gmv"]
+        tickets = purchase["tickets"]
+        in_order = self.last_date is None or (purchase_date, purchase["time"]) >= (self.last_date, self.last_time)
+
+        self.purchases += 1
+        self.gmv.add(gmv)
+        self.gmv_min = min(self.gmv_min, gmv)
+        self.gmv_max = max(self.gmv_max, gmv)
+        self.tickets.add(tickets)
+        self.tickets_max = max(self.tickets_max, tickets)
+        if purchase["hour"] is not None:
+            self.hours.add(purchase["hour"])
+        self.round_trips += purchase["round_trip"]
+        weekday = purchase_date.weekday()
+        self.weekends += weekday >= 5
+        self.months[purchase_date.month - 1] += 1
+        self.weekdays[weekday] += 1
+        self.days.add(purchase_date)
+        self.origins.add(purchase["origin"])
+        self.destinations.add(purchase["destination"])
+        self.companies[purchase["company"]] += 1
+
+        if self.last_date is not None:
+            # Intervalo em relação à compra anterior (exato quando os eventos estão em ordem)
+            self.intervals.add(abs((purchase_date - self.last_date).days))
+        self.first_date = purchase_date if self.first_date is None else min(self.first_date, purchase_date)
+        if in_order:
+            self.last_date = purchase_date
+            self.last_time = purchase["time"]
+            self.last_purchase = (gmv, tickets, purchase["origin"], purchase["destination"], purchase["company"])
+        return in_order
+
+    def interval_mean(self) -> float:
+        """Média dos intervalos entre compras ordenadas = (última - primeira) / (n - 1)"""
+        if self.purchases < 2:
+            return 0.0
+        return (self.last_date - self.first_date).days / (self.purchases - 1)
+
+    def classification_features(self, reference_date: date) -> Dict[str, Any]:
+        """Features do notebook de classificação (mesmos arredondamentos)"""
+        gmv, tickets, origin, destination, company = self.last_purchase
+        return {
+            "gmv_ultima_compra": gmv,
+            "tickets_ultima_compra": tickets,
+            "origem_ultima": origin,
+            "destino_ultima": destination,
+            "empresa_ultima": company,
+            "dias_desde_ultima_compra": (reference_date - self.last_date).days,
+            "total_compras": self.purchases,
+            "dias_unicos_compra": len(self.days),
+            "gmv_total": _round2(self.gmv.total),
+            "gmv_medio": _round2(self.gmv.average()),
+            "gmv_std": _round2(self.gmv.std()),
+            "gmv_min": _round2(self.gmv_min),
+            "gmv_max": _round2(self.gmv_max),
+            "tickets_total": int(self.tickets.total),
+            "tickets_medio": _round2(self.tickets.average()),
+            "tickets_max": self.tickets_max,
+            # Moda com empate resolvido pelo menor valor, como `x.mode().iloc[0]`
+            "mes_preferido": self.months.index(max(self.months)) + 1,
+            "dia_semana_preferido": self.weekdays.index(max(self.weekdays)),
+            "hora_media": _round2(self.hours.average()),
+            "hora_std": _round2(self.hours.std()),
+            "origens_unicas": len(self.origins),
+            "destinos_unicos": len(self.destinations),
+            "empresas_unicas": len(self.companies),
+            "intervalo_medio_dias": _round2(self.interval_mean()),
+            "regularidade": _round2(self.intervals.std()),
+        }
+
+    def clusterization_features(self, company_counts: Counter) -> Dict[str, Any]:
+        """
+        Features do notebook de clusterização
+        `avg_company_freq` usa a frequência atual de cada empresa em todas as compras
+        (frequency encoding do notebook), calculada na leitura
+        """
+        company_freq = sum(company_counts[company] * count for company, count in self.companies.items())
+        return {
+            "gmv_mean": self.gmv.average(),
+            "gmv_total": self.gmv.total,
+            "purchase_count": self.purchases,
+            "gmv_std": self.gmv.std(),
+            "tickets_mean": self.tickets.average(),
+            "tickets_total": int(self.tickets.total),
+            "tickets_std": self.tickets.std(),
+            "round_trip_rate": self.round_trips / self.purchases,
+            "weekend_rate": self.weekends / self.purchases,
+            "preferred_day": self.weekdays.index(max(self.weekdays)),
+            "avg_hour": self.hours.average(),
+            "preferred_month": self.months.index(max(self.months)) + 1,
+            "avg_company_freq": company_freq / self.purchases,
+        }
+
+# ============================================================================
+# EVENTOS
+# ============================================================================
+
+def _is_missing(value: Any) -> bool:
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+def _hour(time_purchase: str) -> Optional[int]:
+    """Hora de 'HH:MM:SS'; None quando inválida (o notebook usa errors='coerce')"""
+    try:
+        return datetime.strptime(time_purchase, "%H:%M:%S").hour
+    except ValueError:
+        return None
+
+def normalize_purchase(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte uma linha do df_t.csv no evento usado pelo estado (ValueError se inválida)"""
+    for field in ("fk_contact", "date_purchase", "gmv_success", "total_tickets_quantity_success"):
+        if _is_missing(record.get(field)):
+            raise ValueError(f"Campo '{field}' ausente")
+    time_purchase = "" if _is_missing(record.get("time_purchase")) else str(record["time_purchase"])
+    return {
+        "fk_contact": str(record["fk_contact"]),
+        "date": datetime.fromisoformat(str(record["date_purchase"])[:10]).date(),
+        "time": time_purchase,
+        "hour": _hour(time_purchase),
+        "gmv": float(record["gmv_success"]),
+        "tickets": int(record["total_tickets_quantity_success"]),
+        "origin": str(record.get("place_origin_departure")),
+        "destination": str(record.get("place_destination_departure")),
+        "company": str(record.get("fk_departure_ota_bus_company")),
+        "round_trip": 0 if _is_missing(record.get("place_origin_return")) else 1,
+    }
+
+# ============================================================================
+# AGREGADOR
+# ============================================================================
+
+class CustomerAggregator:
+    """Estados de todos os clientes, atualizados por eventos de compra"""
+
+    def __init__(self):
+        self._customers: Dict[str, CustomerAggregate] = {}
+        # Clientes cujo estado começou no meio do histórico (compras anteriores fora dele)
+        self._partial: Set[str] = set()
+        self._company_counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._events = 0
+        self._late_events = 0
+        self._updated_at: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self._customers)
+
+    def ingest(self, records: Iterable[Dict[str, Any]],
+               has_history: Optional[Callable[[str], bool]] = None) -> Tuple[int, List[Tuple[int, str]]]:
+        """
+        Aplica as compras; retorna (aceitas, [(índice, erro)]) sem interromper o lote
+        `has_history(fk_contact)` indica se um cliente novo no estado já tem compras
+        anteriores em outra fonte (o feature store); nesse caso ele fica parcial
+        """
+        accepted = 0
+        errors = []
+        with self._lock:
+            for index, record in enumerate(records):
+                try:
+                    purchase = normalize_purchase(record)
+                except (TypeError, ValueError) as e:
+                    errors.append((index, str(e)))
+                    continue
+                customer = self._customers.get(purchase["fk_contact"])
+                if customer is None:
+                    customer = self._customers[purchase["fk_contact"]] = CustomerAggregate()
+                    if has_history is not None and has_history(purchase["fk_contact"]):
+                        self._partial.add(purchase["fk_contact"])
+                if not customer.add(purchase):
+                    self._late_events += 1
+                self._company_counts[purchase["company"]] += 1
+                accepted += 1
+            self._events += accepted
+            if accepted:
+                self._updated_at = datetime.now().isoformat()
+        return accepted, errors
+
+    def features(self, table_name: str, key: str, reference_date: Optional[date] = None) -> Optional[Dict[str, Any]]:
+        """Features atuais do cliente no formato do schema de entrada, ou None (inclusive se parcial)"""
+        with self._lock:
+            customer = self._customers.get(key)
+            if customer is None or key in self._partial:
+                return None
+            if table_name == "classification":
+                return customer.classification_features(reference_date or date.today())
+            return customer.clusterization_features(self._company_counts)
+
+    def tables(self, reference_date: Optional[date] = None) -> Dict[str, pd.DataFrame]:
+        """Tabelas por cliente para publicar uma geração do feature store (sem os parciais)"""
+        import pandas as pd
+        reference_date = reference_date or date.today()
+        with self._lock:
+            keys = [key for key in self._customers if key not in self._partial]
+            classification = [self._customers[key].classification_features(reference_date) for key in keys]
+            clusterization = [self._customers[key].clusterization_features(self._company_counts) for key in keys]
+        return {
+            "classification": pd.DataFrame(classification, index=keys, columns=feature_store.CLASSIFICATION_COLUMNS),
+            "clusterization": pd.DataFrame(clusterization, index=keys, columns=feature_store.CLUSTERIZATION_COLUMNS)
+        }
+
+    def partial_customers(self) -> Set[str]:
+        with self._lock:
+            return set(self._partial)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "customers": len(self._customers),
+            "partial_customers": len(self._partial),
+            "events": self._events,
+            "late_events": self._late_events,
+            "updated_at": self._updated_at
+        }
+
+    def save(self, path: str):
+        """Grava o estado (arquivo temporário + os.replace: nunca deixa um estado parcial)"""
+        with self._lock:
+            payload = pickle.dumps({
+                "customers": self._customers,
+                "partial": self._partial,
+                "company_counts": self._company_counts,
+                "events": self._events,
+                "late_events": self._late_events,
+                "updated_at": self._updated_at
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CustomerAggregator":
+        aggregator = cls()
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        aggregator._customers = state["customers"]
+        aggregator._partial = state.get("partial", set())
+        aggregator._company_counts = state["company_counts"]
+        aggregator._events = state["events"]
+        aggregator._late_events = state["late_events"]
+        aggregator._updated_at = state["updated_at"]
+        return aggregator
+
+# ============================================================================
+# PUBLICAÇÃO
+# ============================================================================
+
+def publish(aggregator: CustomerAggregator, store_path: str, reference_date: date, keep: int = 2) -> str:
+    """
+    Publica o estado como uma nova geração do feature store, sobre a geração atual
+    Clientes fora do estado e os parciais seguem com as linhas da geração atual; a
+    recência dos que não compraram desde então avança até a nova data de referência
+    """
+    import pandas as pd
+    tables = aggregator.tables(reference_date)
+    store = feature_store.FeatureStore(store_path)
+    store.refresh()
+    current = store.current
+    if current is not None:
+        partial = aggregator.partial_customers()
+        elapsed = (reference_date - date.fromisoformat(current.manifest["reference_date"])).days
+        for table_name, table in tables.items():
+            if table_name not in current.tables:
+                continue
+            stored = current.frame(table_name)
+            stored = stored[~stored.index.isin(table.index)]
+            if table_name == "classification":
+                idle = ~stored.index.isin(list(partial))
+                stored.loc[idle, "dias_desde_ultima_compra"] += elapsed
+            tables[table_name] = pd.concat([table, stored])
+    os.makedirs(store_path, exist_ok=True)
+    return feature_store.write_generation(store_path, tables, pd.Timestamp(reference_date), keep=keep)
+
+# ============================================================================
+# INGESTÃO EM LOTE (CLI)
+# ============================================================================
+
+def main():
+    import pandas as pd
+    parser = argparse.ArgumentParser(description="Aplica compras novas às agregações por cliente")
+    parser.add_argument("purchases", help="Compras novas no formato do df_t.csv (.csv ou .parquet)")
+    parser.add_argument("--state", default="customer_aggregates.pkl", help="Estado salvo (criado se não existir)")
+    parser.add_argument("--publish", action="store_true", help="Publica uma nova geração do feature store")
+    parser.add_argument("--store", default=feature_store.configured_store_path(), help="Pasta do feature store")
+    parser.add_argument("--reference-date", default=None,
+                        help="Data de referência da recência na publicação (padrão: hoje)")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Linhas lidas por vez (CSV)")
+    args = parser.parse_args()
+
+    aggregator = CustomerAggregator.load(args.state) if os.path.exists(args.state) else CustomerAggregator()
+    print(f"✓ Estado com {len(aggregator):,} clientes ({args.state})")
+
+    # Clientes já presentes no store: o estado não tem o histórico deles (ficam parciais)
+    store = feature_store.FeatureStore(args.store)
+    store.refresh()
+    current = store.current
+    if current is not None:
+        print(f"✓ Geração {current.manifest['generation']} com {current.manifest['rows']:,} clientes ({args.store})")
+
+    def has_history(fk_contact: str) -> bool:
+        return current is not None and current.row(fk_contact) is not None
+
+    if args.purchases.endswith(".parquet"):
+        chunks = [pd.read_parquet(args.purchases)]
+    else:
+        chunks = pd.read_csv(args.purchases, chunksize=args.chunk_size, dtype={"fk_contact": str})
+    accepted = rejected = 0
+    for chunk in chunks:
+        # Ordem cronológica dentro do arquivo (os intervalos dependem dela)
+        chunk = chunk.sort_values(["date_purchase", "time_purchase"], kind="stable")
+        count, errors = aggregator.ingest(chunk.to_dict("records"), has_history)
+        accepted += count
+        rejected += len(errors)
+    aggregator.save(args.state)
+    print(f"✓ {accepted:,} compras aplicadas, {rejected:,} rejeitadas; {len(aggregator):,} clientes")
+
+    if args.publish:
+        partial = aggregator.stats()["partial_customers"]
+        if partial:
+            print(f"⚠️ {partial:,} clientes com histórico parcial seguem com as features da geração atual "
+                  f"(reprocesse o histórico completo com feature_store.py para atualizá-los)")
+        reference_date = date.fromisoformat(args.reference_date) if args.reference_date else date.today()
+        generation = publish(aggregator, args.store, reference_date)
+        print(f"✅ Geração {generation} publicada em {args.store}")
+
+if __name__ == "__main__":
+    main()
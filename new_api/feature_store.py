@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Feature store local por cliente (fk_contact)
+
+Guarda, por cliente, as 25 features do modelo de classificação e as 13 do modelo de
+clusterização, calculadas a partir do histórico de compras (formato do df_t.csv) com
+as mesmas agregações dos notebooks. Os endpoints /<modelo>/customer/{fk_contact}
+pontuam um cliente só com o seu identificador.
+
+Formato em disco (uma geração por construção, arquivos .npy abertos com mmap):
+
+    feature_store/
+    ├── CURRENT                  # nome da geração ativa (trocado com os.replace)
+    └── 20250101T120000/
+        ├── manifest.json        # colunas, tipos, vocabulários, data de referência
+        ├── keys.npy             # fk_contact de cada linha (bytes de largura fixa)
+        ├── hashes.npy           # hash de 64 bits de cada fk_contact
+        ├── index.npy            # tabela hash (endereçamento aberto) -> linha
+        ├── classification.npy   # matriz float64 linhas x features
+        └── clusterization.npy
+
+As features de um cliente ficam contíguas em uma linha da matriz: uma consulta é um
+hash, uma ou duas sondagens na tabela e a leitura de uma linha (alguns microssegundos).
+Nada é carregado para a memória do processo; as páginas vêm do page cache e são
+compartilhadas entre os workers do prefork.py.
+
+Atualização em massa: o build grava uma nova geração e só então troca o CURRENT; os
+processos da API verificam o CURRENT periodicamente (ML_API_FEATURE_STORE_REFRESH_INTERVAL)
+e trocam a referência de forma atômica. Consultas em andamento terminam na geração antiga.
+
+Uso:
+    python feature_store.py files/df_t.csv --reference-date 2024-03-01
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# pandas só é usado na construção do store (CLI); a API apenas lê os arquivos .npy
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+EMPTY_SLOT = -1
+
+# Colunas do df_t.csv usadas nas agregações
+PURCHASE_COLUMNS = [
+    "fk_contact", "date_purchase", "time_purchase", "gmv_success", "total_tickets_quantity_success",
+    "place_origin_departure", "place_destination_departure", "place_origin_return",
+    "fk_departure_ota_bus_company"
+]
+
+# Mesma ordem dos schemas de entrada da API
+CLASSIFICATION_COLUMNS = [
+    "gmv_ultima_compra", "tickets_ultima_compra", "origem_ultima", "destino_ultima", "empresa_ultima",
+    "dias_desde_ultima_compra", "total_compras", "dias_unicos_compra", "gmv_total", "gmv_medio",
+    "gmv_std", "gmv_min", "gmv_max", "tickets_total", "tickets_medio", "tickets_max", "mes_preferido",
+    "dia_semana_preferido", "hora_media", "hora_std", "origens_unicas", "destinos_unicos",
+    "empresas_unicas", "intervalo_medio_dias", "regularidade"
+]
+CLUSTERIZATION_COLUMNS = [
+    "gmv_mean", "gmv_total", "purchase_count", "gmv_std", "tickets_mean", "tickets_total", "tickets_std",
+    "round_trip_rate", "weekend_rate", "preferred_day", "avg_hour", "preferred_month", "avg_company_freq"
+]
+
+def configured_store_path() -> str:
+    """Pasta do store: ML_API_FEATURE_STORE_PATH ou artefacts/feature_store (local ou Docker)"""
+    base_path = "artefacts" if os.path.exists("artefacts") else "../artefacts"
+    return os.getenv("ML_API_FEATURE_STORE_PATH", os.path.join(base_path, "feature_store"))
+
+def key_hash(key: str) -> int:
+    """Hash estável entre processos (o hash() do Python muda a cada execução)"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+# ============================================================================
+# AGREGAÇÕES (MESMA LÓGICA DOS NOTEBOOKS)
+# ============================================================================
+
+def _mode(frame: pd.DataFrame, column: str) -> pd.Series:
+    """Moda por cliente; no empate, o menor valor (como `x.mode().iloc[0]`)"""
+    counts = frame.groupby(["fk_contact", column]).size().reset_index(name="n")
+    counts = counts.sort_values(["fk_contact", "n", column], ascending=[True, False, True])
+    return counts.drop_duplicates("fk_contact").set_index("fk_contact")[column]
+
+def prepare_purchases(df: pd.DataFrame) -> pd.DataFrame:
+    """Tipos e colunas derivadas do df_t.csv usados pelos dois notebooks"""
+    import pandas as pd
+    df = df[[column for column in PURCHASE_COLUMNS if column in df.columns]].copy()
+    df["fk_contact"] = df["fk_contact"].astype(str)
+    df["date_purchase"] = pd.to_datetime(df["date_purchase"])
+    time_purchase = df["time_purchase"].astype(str)
+    # Clusterização: hora via to_datetime (inválidas viram NaN e saem da média)
+    df["hour"] = pd.to_datetime(time_purchase, format="%H:%M:%S", errors="coerce").dt.hour
+    # Classificação: hora pelos dois primeiros caracteres
+    df["hora"] = pd.to_numeric(time_purchase.str[:2], errors="coerce")
+    df["day_of_week"] = df["date_purchase"].dt.dayofweek
+    df["month"] = df["date_purchase"].dt.month
+    df["is_weekend"] = df["day_of_week"].isin([5, 6]).astype(int)
+    df["is_round_trip"] = (~df["place_origin_return"].isna()).astype(int) if "place_origin_return" in df else 0
+    df["departure_company_freq"] = df["fk_departure_ota_bus_company"].map(
+        df["fk_departure_ota_bus_company"].value_counts()
+    )
+    # Ordem cronológica por cliente: define a "última compra" e os intervalos
+    return df.sort_values(["fk_contact", "date_purchase", "time_purchase"], kind="stable")
+
+def clusterization_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Agregações por cliente do notebook de clusterização (uma linha por fk_contact)"""
+    import pandas as pd
+    grouped = df.groupby("fk_contact")
+    features = pd.DataFrame({
+        "gmv_mean": grouped["gmv_success"].mean(),
+        "gmv_total": grouped["gmv_success"].sum(),
+        "purchase_count": grouped["gmv_success"].count(),
+        "gmv_std": grouped["gmv_success"].std().fillna(0),
+        "tickets_mean": grouped["total_tickets_quantity_success"].mean(),
+        "tickets_total": grouped["total_tickets_quantity_success"].sum(),
+        "tickets_std": grouped["total_tickets_quantity_success"].std().fillna(0),
+        "round_trip_rate": grouped["is_round_trip"].mean(),
+        "weekend_rate": grouped["is_weekend"].mean(),
+        "preferred_day": _mode(df, "day_of_week"),
+        "avg_hour": grouped["hour"].mean(),
+        "preferred_month": _mode(df, "month"),
+        "avg_company_freq": grouped["departure_company_freq"].mean(),
+    })
+    return features[CLUSTERIZATION_COLUMNS].fillna(0)
+
+def classification_features(df: pd.DataFrame, reference_date: pd.Timestamp) -> pd.DataFrame:
+    """
+    Features do notebook de classificação com `reference_date` no papel da data de corte
+    Só entram compras anteriores à data de referência
+    """
+    import pandas as pd
+    df = df[df["date_purchase"] < reference_date]
+    grouped = df.groupby("fk_contact")
+    last = grouped.last()
+    dates = df["date_purchase"]
+    # Intervalos (dias) entre compras consecutivas do mesmo cliente
+    same_customer = df["fk_contact"].eq(df["fk_contact"].shift())
+    intervals = dates.diff().dt.days.where(same_customer)
+    interval_groups = intervals.groupby(df["fk_contact"])
+
+    features = pd.DataFrame({
+        "gmv_ultima_compra": last["gmv_success"],
+        "tickets_ultima_compra": last["total_tickets_quantity_success"],
+        "origem_ultima": last["place_origin_departure"].astype(str),
+        "destino_ultima": last["place_destination_departure"].astype(str),
+        "empresa_ultima": last["fk_departure_ota_bus_company"].astype(str),
+        "dias_desde_ultima_compra": (reference_date - grouped["date_purchase"].max()).dt.days,
+        "total_compras": grouped["date_purchase"].count(),
+        "dias_unicos_compra": grouped["date_purchase"].nunique(),
+        "gmv_total": grouped["gmv_success"].sum().round(2),
+        "gmv_medio": grouped["gmv_success"].mean().round(2),
+        "gmv_std": grouped["gmv_success"].std().round(2),
+        "gmv_min": grouped["gmv_success"].min().round(2),
+        "gmv_max": grouped["gmv_success"].max().round(2),
+        "tickets_total": grouped["total_tickets_quantity_success"].sum(),
+        "tickets_medio": grouped["total_tickets_quantity_success"].mean().round(2),
+        "tickets_max": grouped["total_tickets_quantity_success"].max(),
+        "mes_preferido": _mode(df, "month"),
+        "dia_semana_preferido": _mode(df, "day_of_week"),
+        "hora_media": grouped["hora"].mean().round(2),
+        "hora_std": grouped["hora"].std().round(2),
+        "origens_unicas": grouped["place_origin_departure"].nunique(),
+        "destinos_unicos": grouped["place_destination_departure"].nunique(),
+        "empresas_unicas": grouped["fk_departure_ota_bus_company"].nunique(),
+        "intervalo_medio_dias": interval_groups.mean().round(2),
+        "regularidade": interval_groups.std().round(2),
+    })
+    return features[CLASSIFICATION_COLUMNS].fillna(0)
+
+# ============================================================================
+# ESCRITA
+# ============================================================================
+
+def build_index(hashes: np.ndarray) -> np.ndarray:
+    """Tabela hash com sondagem linear, ocupação máxima de 50%"""
+    slots = 1 << max(4, int(2 * len(hashes) - 1).bit_length())
+    mask = slots - 1
+    index = np.full(slots, EMPTY_SLOT, dtype=np.int64)
+    for row, value in enumerate(hashes.tolist()):
+        slot = value & mask
+        while index[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & mask
+        index[slot] = row
+    return index
+
+def _encode_table(frame: pd.DataFrame, keys: List[str]) -> Dict[str, Any]:
+    """
+    Matriz float64 na ordem de `keys` + descrição das colunas (textos viram códigos de
+    um vocabulário). Os tipos vêm da tabela original, antes do reindex introduzir NaN
+    """
+    import pandas as pd
+    kinds = {name: "text" if dtype == object else "int" if pd.api.types.is_integer_dtype(dtype) else "float"
+             for name, dtype in frame.dtypes.items()}
+    frame = frame.reindex(keys)
+    matrix = np.empty((len(frame), len(frame.columns)), dtype=np.float64)
+    columns = []
+    for position, name in enumerate(frame.columns):
+        values = frame[name]
+        if kinds[name] == "text":
+            codes, vocabulary = pd.factorize(values, sort=True)
+            matrix[:, position] = codes
+            columns.append({"name": name, "kind": "text", "vocabulary": vocabulary.tolist()})
+        else:
+            matrix[:, position] = values.to_numpy(dtype=np.float64)
+            columns.append({"name": name, "kind": kinds[name]})
+    return {"matrix": matrix, "columns": columns}
+
+def write_generation(store_path: str, tables: Dict[str, pd.DataFrame], reference_date: pd.Timestamp,
+                     keep: int = 2) -> str:
+    """
+    Grava uma nova geração e a torna ativa (CURRENT)
+    Clientes ausentes em uma tabela ficam com a linha marcada em `present`
+    """
+    import pandas as pd
+    keys = sorted(set().union(*(table.index for table in tables.values())))
+    generation = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    path = os.path.join(store_path, generation)
+    os.makedirs(path)
+
+    encoded_keys = np.array([key.encode("utf-8") for key in keys], dtype=bytes)
+    hashes = np.array([key_hash(key) for key in keys], dtype=np.uint64)
+    np.save(os.path.join(path, "keys.npy"), encoded_keys)
+    np.save(os.path.join(path, "hashes.npy"), hashes)
+    np.save(os.path.join(path, "index.npy"), build_index(hashes))
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "generation": generation,
+        "built_at": datetime.now().isoformat(),
+        "reference_date": reference_date.strftime("%Y-%m-%d"),
+        "rows": len(keys),
+        "tables": {}
+    }
+    for table_name, frame in tables.items():
+        present = pd.Series(True, index=frame.index).reindex(keys, fill_value=False).to_numpy()
+        encoded = _encode_table(frame, keys)
+        np.save(os.path.join(path, f"{table_name}.npy"), encoded["matrix"])
+        np.save(os.path.join(path, f"{table_name}_present.npy"), present)
+        manifest["tables"][table_name] = {"columns": encoded["columns"], "customers": int(present.sum())}
+
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # Troca atômica da geração ativa
+    current_tmp = os.path.join(store_path, CURRENT_FILE + ".tmp")
+    with open(current_tmp, "w") as f:
+        f.write(generation)
+    os.replace(current_tmp, os.path.join(store_path, CURRENT_FILE))
+
+    # Gerações antigas: processos que ainda as mapeiam continuam lendo (o unlink não
+    # invalida um mmap aberto)
+    generations = sorted(name for name in os.listdir(store_path) if os.path.isdir(os.path.join(store_path, name)))
+    for old in generations[:-max(1, keep)]:
+        shutil.rmtree(os.path.join(store_path, old), ignore_errors=True)
+    return generation
+
+# ============================================================================
+# LEITURA
+# ============================================================================
+
+class FeatureStoreGeneration:
+    """Uma geração do store aberta com mmap (somente leitura)"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Formato de feature store não suportado: {self.manifest.get('format')}")
+        self.path = path
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        self.hashes = np.load(os.path.join(path, "hashes.npy"), mmap_mode="r")
+        self.index = np.load(os.path.join(path, "index.npy"), mmap_mode="r")
+        self.mask = len(self.index) - 1
+        self.tables = {}
+        for table_name, table in self.manifest["tables"].items():
+            self.tables[table_name] = {
+                "matrix": np.load(os.path.join(path, f"{table_name}.npy"), mmap_mode="r"),
+                "present": np.load(os.path.join(path, f"{table_name}_present.npy"), mmap_mode="r"),
+                "columns": [(column["name"], column["kind"], column.get("vocabulary")) for column in table["columns"]]
+            }
+
+    def row(self, key: str) -> Optional[int]:
+        """Linha do cliente, ou None se ele não está no store"""
+        value = key_hash(key)
+        encoded = key.encode("utf-8")
+        slot = value & self.mask
+        while True:
+            row = int(self.index[slot])
+            if row == EMPTY_SLOT:
+                return None
+            if int(self.hashes[row]) == value and self.keys[row] == encoded:
+                return row
+            slot = (slot + 1) & self.mask
+
+    def features(self, table_name: str, key: str) -> Optional[Dict[str, Any]]:
+        """Features do cliente em uma tabela, já nos tipos dos schemas de entrada"""
+        table = self.tables[table_name]
+        row = self.row(key)
+        if row is None or not table["present"][row]:
+            return None
+        values = table["matrix"][row].tolist()
+        record = {}
+        for (name, kind, vocabulary), value in zip(table["columns"], values):
+            if kind == "text":
+                record[name] = vocabulary[int(value)]
+            elif kind == "int":
+                record[name] = int(value)
+            else:
+                record[name] = value
+        return record
+
+    def frame(self, table_name: str) -> pd.DataFrame:
+        """Tabela inteira de volta como DataFrame por fk_contact (só os clientes presentes)"""
+        import pandas as pd
+        table = self.tables[table_name]
+        present = np.asarray(table["present"], dtype=bool)
+        matrix = np.asarray(table["matrix"])[present]
+        keys = [key.decode("utf-8") for key in np.asarray(self.keys)[present]]
+        data = {}
+        for position, (name, kind, vocabulary) in enumerate(table["columns"]):
+            values = matrix[:, position]
+            if kind == "text":
+                data[name] = np.asarray(vocabulary, dtype=object)[values.astype(np.int64)]
+            elif kind == "int":
+                data[name] = values.astype(np.int64)
+            else:
+                data[name] = values
+        return pd.DataFrame(data, index=pd.Index(keys, name="fk_contact"), columns=[column[0] for column in table["columns"]])
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "generation": self.manifest["generation"],
+            "built_at": self.manifest["built_at"],
+            "reference_date": self.manifest["reference_date"],
+            "customers": self.manifest["rows"],
+            "tables": {name: table["customers"] for name, table in self.manifest["tables"].items()}
+        }
+
+class FeatureStore:
+    """Geração ativa do store com troca atômica quando o CURRENT muda"""
+
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        self._current: Optional[FeatureStoreGeneration] = None
+        self._refresh_lock = threading.Lock()
+        self._error: Optional[str] = None
+        self._lookups = 0
+        self._misses = 0
+
+    @property
+    def current(self) -> Optional[FeatureStoreGeneration]:
+        return self._current
+
+    def active_generation(self) -> Optional[str]:
+        """Geração apontada pelo CURRENT no disco"""
+        try:
+            with open(os.path.join(self.store_path, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def refresh(self) -> bool:
+        """Abre a geração do CURRENT se ela mudou; retorna True quando houve troca"""
+        with self._refresh_lock:
+            generation = self.active_generation()
+            current = self._current
+            if generation is None or (current is not None and current.manifest["generation"] == generation):
+                return False
+            started = time.perf_counter()
+            try:
+                opened = FeatureStoreGeneration(os.path.join(self.store_path, generation))
+            except Exception as e:
+                self._error = f"{generation}: {e}"
+                logger.error(f"Erro ao abrir a geração {generation} do feature store: {e}")
+                return False
+            # Troca de referência: consultas em andamento terminam na geração anterior
+            self._current = opened
+            self._error = None
+            logger.info(f"Feature store: geração {generation} ativa com {opened.manifest['rows']:,} clientes "
+                        f"({(time.perf_counter() - started) * 1000:.1f} ms)")
+            return True
+
+    def features(self, table_name: str, key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Features do cliente (ou None) e a geração consultada"""
+        current = self._current
+        if current is None:
+            raise LookupError("Feature store indisponível")
+        self._lookups += 1
+        record = current.features(table_name, key)
+        if record is None:
+            self._misses += 1
+        return record, current.manifest["generation"]
+
+    def describe(self) -> Dict[str, Any]:
+        current = self._current
+        return {
+            "path": self.store_path,
+            "loaded": current is not None,
+            "error": self._error,
+            "lookups": self._lookups,
+            "misses": self._misses,
+            **(current.describe() if current is not None else {})
+        }
+
+# ============================================================================
+# CONSTRUÇÃO (CLI)
+# ============================================================================
+
+def read_purchases(path: str) -> pd.DataFrame:
+    import pandas as pd
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, usecols=lambda column: column in PURCHASE_COLUMNS, dtype={"fk_contact": str})
+
+def build_tables(purchases: pd.DataFrame, reference_date: pd.Timestamp) -> Dict[str, pd.DataFrame]:
+    df = prepare_purchases(purchases)
+    return {
+        "classification": classification_features(df, reference_date),
+        "clusterization": clusterization_features(df)
+    }
+
+def main():
+    import pandas as pd
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Constrói uma nova geração do feature store por cliente")
+    parser.add_argument("purchases", help="Histórico de compras no formato do df_t.csv (.csv ou .parquet)")
+    parser.add_argument("--store", default=configured_store_path(), help="Pasta do feature store")
+    parser.add_argument("--reference-date", default=None,
+                        help="Data de corte das features de classificação (padrão: hoje)")
+    parser.add_argument("--keep", type=int, default=2, help="Gerações mantidas no disco")
+    args = parser.parse_args()
+
+    reference_date = pd.Timestamp(args.reference_date or datetime.now().strftime("%Y-%m-%d"))
+    started = time.perf_counter()
+    purchases = read_purchases(args.purchases)
+    print(f"✓ {len(purchases):,} compras lidas de {args.purchases}")
+    tables = build_tables(purchases, reference_date)
+    print(f"✓ Features calculadas: {len(tables['classification']):,} clientes (classificação), "
+          f"{len(tables['clusterization']):,} (clusterização)")
+    os.makedirs(args.store, exist_ok=True)
+    generation = write_generation(args.store, tables, reference_date, keep=args.keep)
+    print(f"✅ Geração {generation} ativa em {args.store} ({time.perf_counter() - started:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Executores de inferência da API
+
+Cada modelo roda em um pool de threads próprio e limitado, fora do event loop do
+asyncio. Assim uma chamada lenta ao XGBoost (predict_proba multiclasse) não bloqueia
+as demais requisições do worker, incluindo /health.
+
+Threads são suficientes aqui: sklearn e XGBoost liberam o GIL durante o cálculo
+pesado, e os modelos já carregados são compartilhados sem serialização.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import numpy as np
+
+from admission import check_deadline
+from metrics import observe_stage
+
+# Número de amostras recentes mantidas para os percentis de espera/execução
+STATS_WINDOW = 1024
+
+def configured_workers(model_type: str, default: int = 2) -> int:
+    """
+    Lê o tamanho do pool de um modelo das variáveis de ambiente
+    ML_API_INFERENCE_WORKERS_<MODELO> tem prioridade sobre ML_API_INFERENCE_WORKERS
+    """
+    value = os.getenv(f"ML_API_INFERENCE_WORKERS_{model_type.upper()}") or os.getenv("ML_API_INFERENCE_WORKERS")
+    return max(1, int(value)) if value else default
+
+class InferenceExecutor:
+    """Pool de threads limitado para um modelo, com estatísticas de fila"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"inference-{name}")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_times = deque(maxlen=STATS_WINDOW)
+        self._run_times = deque(maxlen=STATS_WINDOW)
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Executa `func(*args)` no pool e aguarda o resultado sem bloquear o event loop"""
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_times.append(started - submitted)
+            observe_stage("queue", started - submitted)
+            failed = False
+            try:
+                # Prazo da requisição esgotado na fila do pool: descarta sem rodar o modelo
+                check_deadline()
+                return func(*args)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._failed += int(failed)
+                    self._run_times.append(time.perf_counter() - started)
+
+        # Copia o contexto: as etapas medidas na thread contam para a requisição de origem
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, contextvars.copy_context().run, task)
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidade de fila e tempos de espera/execução (ms) das chamadas recentes"""
+        with self._lock:
+            waits = np.array(self._wait_times) * 1000
+            runs = np.array(self._run_times) * 1000
+            stats = {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "max_queue_depth": self._max_queued,
+                "completed": self._completed,
+                "failed": self._failed
+            }
+
+        for label, samples in (("wait_ms", waits), ("run_ms", runs)):
+            if len(samples):
+                stats[label] = {
+                    "mean": round(float(samples.mean()), 3),
+                    "p50": round(float(np.percentile(samples, 50)), 3),
+                    "p95": round(float(np.percentile(samples, 95)), 3),
+                    "max": round(float(samples.max()), 3)
+                }
+            else:
+                stats[label] = None
+        return stats
+
+    def shutdown(self):
+        """Finaliza o pool aguardando as inferências em andamento"""
+        self._pool.shutdown(wait=True)
@@ -8,44 +8,188 @@ Desenvolvido por: Desenvolvedor Python Sênior
 Data: 2025
 """
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+# Relatório de inicialização (GET /startup): importado antes de tudo para medir os demais imports
+from startup import startup_report
+startup_report.install()
+
+from fastapi import BackgroundTasks, Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.requests import ClientDisconnect
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field, create_model, model_validator
+from typing import List, Dict, Any, Optional, Tuple, Type
 import pickle
-import pandas as pd
 import numpy as np
 import os
 import json
+import secrets
+import asyncio
+import threading
+import functools
+import math
+import time
+import warnings
 from datetime import datetime
 import logging
 
+from inference_executor import InferenceExecutor, configured_workers
+from micro_batcher import MicroBatcher, configured_micro_batching
+from model_registry import MODEL_TYPES, ModelRegistry, UnknownModelVersion, artefacts_status
+from prefork import process_memory
+from prediction_cache import PredictionCache, cache_key, configured_prediction_cache
+from metrics import TimedRoute, add_request_observer, metric_family, render_metrics, stage
+from tree_compiler import TreeBackend, configured_tree_backend
+from feature_store import FeatureStore, configured_store_path
+from customer_aggregates import CustomerAggregator
+from admission import DEGRADED_HEADER, AdmissionMiddleware, admission_families, deadline_scope, degraded_reason
+from profiler import DEFAULT_INTERVAL, ProfilerControl, collapsed, top_functions
+from memory_inspector import AllocationTracker, GCMonitor, bundle_memory
+from schema_fields import field_type
+import arrow_io
+import binary_protocol
+import ndjson_stream
+
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A inferência não usa pandas: as matrizes já chegam aos modelos na ordem de colunas do
+# treinamento, então o aviso do sklearn sobre a ausência dos nomes não se aplica
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Ciclo de vida da aplicação (as funções usadas estão definidas mais abaixo)
+    A pré-carga roda em segundo plano: /health responde desde o início e /ready
+    só fica verdadeiro quando os três modelos estão carregados e aquecidos
+    """
+    background_tasks = []
+    if PRELOAD_MODELS:
+        background_tasks.append(asyncio.create_task(preload_models()))
+    if MODEL_WATCH_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(watch_model_versions()))
+    # Abrir o feature store só mapeia os arquivos (não lê as features para a memória)
+    feature_store.refresh()
+    if FEATURE_STORE_REFRESH_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(watch_feature_store()))
+    # Listener secundário do protocolo binário (ML_API_UDS_PATH ou socket herdado do prefork.py)
+    if UDS_SOCKET_PATH or binary_listener_socket is not None:
+        try:
+            await binary_server.start(UDS_SOCKET_PATH, binary_listener_socket)
+        except OSError as e:
+            logger.error(f"Protocolo binário indisponível: {e}")
+
+    startup_report.milestone("serving")
+    if not PRELOAD_MODELS:
+        # Sem pré-carga não há marco models_ready: a medição de imports termina aqui
+        startup_report.uninstall()
+    yield
+
+    await binary_server.close()
+
+    for task in background_tasks:
+        task.cancel()
+    profiler_control.stop()
+    # Com vários workers o estado é só leitura (nenhum deles pode sobrescrever o arquivo)
+    if CUSTOMER_AGGREGATES_PATH and SERVER_WORKERS == 1 and len(customer_aggregator):
+        customer_aggregator.save(CUSTOMER_AGGREGATES_PATH)
+        logger.info(f"Agregações por cliente salvas em {CUSTOMER_AGGREGATES_PATH}")
+    # Finaliza os pools de inferência aguardando as predições em andamento
+    if recommendation_batcher is not None:
+        recommendation_batcher.close()
+    for executor in inference_executors.values():
+        executor.shutdown()
+
 # Inicialização da aplicação FastAPI
 app = FastAPI(
     title="ML Models API",
     description="API para servir modelos de Machine Learning: Clusterização, Classificação e Recomendação",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+# Todas as rotas medem latência por etapa (/metrics e header Server-Timing)
+app.router.route_class = TimedRoute
+
+# Controle de admissão dos endpoints de predição: concorrência por endpoint, prazo do
+# cliente (X-Request-Deadline-Ms) e modo degradado do /recommendation (admission.py)
+admission_controllers: Dict[str, Any] = {}
+app.add_middleware(
+    AdmissionMiddleware,
+    prefixes=("/clusterization", "/classification", "/recommendation"),
+    degradable={"RECOMMENDATION"},
+    controllers=admission_controllers
 )
 
-# Caminhos para os modelos versionados
-MODEL_VERSION = "v1"
+# Versão dos modelos ativa na inicialização (as versões ficam em artefacts/<versão>/)
+MODEL_VERSION = os.getenv("ML_API_MODEL_VERSION", "v1")
 # Ajustar caminhos para funcionar tanto local quanto no Docker
 BASE_PATH = "artefacts" if os.path.exists("artefacts") else "../artefacts"
-MODEL_PATHS = {
-    "clusterization": f"{BASE_PATH}/{MODEL_VERSION}/clusterization/modelo_clusterizacao.pkl",
-    "classification": f"{BASE_PATH}/{MODEL_VERSION}/classification/modelo_recompra_30dias.pkl",
-    "recommendation": {
-        "model": f"{BASE_PATH}/{MODEL_VERSION}/recommendation/modelo_recomendacao.pkl",
-        "label_encoder": f"{BASE_PATH}/{MODEL_VERSION}/recommendation/label_encoder.pkl",
-        "feature_encoders": f"{BASE_PATH}/{MODEL_VERSION}/recommendation/feature_encoders.pkl"
-    }
+
+# Versões mantidas em memória (a ativa + as usadas mais recentemente, para rollback rápido e versões fixadas)
+MODEL_KEEP_VERSIONS = int(os.getenv("ML_API_MODEL_KEEP_VERSIONS", "2"))
+# Intervalo (s) para verificar novas versões em artefacts/ e ativá-las; 0 desliga
+MODEL_WATCH_INTERVAL = float(os.getenv("ML_API_MODEL_WATCH_INTERVAL", "0"))
+# Pré-carga + warm-up dos modelos na inicialização (ML_API_PRELOAD_MODELS=0 volta ao lazy loading)
+PRELOAD_MODELS = os.getenv("ML_API_PRELOAD_MODELS", "1") not in ("0", "false", "False")
+# Início rápido: com prefork.py, cada worker aceita conexões logo após o fork e carrega os
+# modelos em segundo plano (sem a carga no processo pai e sem o compartilhamento copy-on-write)
+FAST_START = os.getenv("ML_API_FAST_START", "0") not in ("0", "false", "False")
+# Token exigido nos endpoints administrativos (/models/reload) quando definido
+# Os endpoints de diagnóstico (/debug/*) só existem com o token configurado
+ADMIN_TOKEN = os.getenv("ML_API_ADMIN_TOKEN")
+# Intervalo (s) para verificar uma nova geração do feature store por cliente; 0 desliga
+FEATURE_STORE_REFRESH_INTERVAL = float(os.getenv("ML_API_FEATURE_STORE_REFRESH_INTERVAL", "60"))
+# Estado das agregações incrementais por cliente (carregado na inicialização, salvo no desligamento)
+CUSTOMER_AGGREGATES_PATH = os.getenv("ML_API_CUSTOMER_AGGREGATES_PATH")
+# Workers servindo a aplicação (o prefork.py define antes do fork). Com mais de um, cada
+# worker teria o seu próprio estado incremental: a ingestão por HTTP é recusada e o estado
+# fica com a CLI (customer_aggregates.py --publish), que publica pelo feature store
+SERVER_WORKERS = 1
+
+# Pools de inferência por modelo - o trabalho de CPU roda fora do event loop
+# Tamanho configurável via ML_API_INFERENCE_WORKERS[_<MODELO>]
+inference_executors = {
+    model_type: InferenceExecutor(model_type, configured_workers(model_type))
+    for model_type in ("clusterization", "classification", "recommendation")
 }
 
-# Cache para modelos carregados - evita recarregar modelos pesados a cada requisição
-model_cache = {}
+# Tamanho máximo de um lote nos endpoints /batch (protege memória do worker)
+MAX_BATCH_SIZE = int(os.getenv("ML_API_MAX_BATCH_SIZE", "10000"))
+
+# Profiler por amostragem sob demanda (/debug/profile); duração máxima de uma captura (s)
+profiler_control = ProfilerControl()
+add_request_observer(profiler_control.observe)
+MAX_PROFILE_SECONDS = float(os.getenv("ML_API_MAX_PROFILE_SECONDS", "120"))
+
+# Inspeção de memória (/debug/memory): coletas do GC desde a inicialização e tracemalloc sob demanda
+gc_monitor = GCMonitor()
+gc_monitor.install()
+allocation_tracker = AllocationTracker()
+
+# Quantidade de rotas recomendadas (top-k) - 5 reproduz o formato da tabela ml_recommendation
+DEFAULT_TOP_K = int(os.getenv("ML_API_RECOMMENDATION_TOP_K", "3"))
+MAX_TOP_K = 10
+
+# Ordem das features esperada pelo K-Means (mesma ordem do treinamento)
+CLUSTERIZATION_FEATURES = [
+    "gmv_mean", "gmv_total", "purchase_count", "gmv_std",
+    "tickets_mean", "tickets_total", "tickets_std",
+    "round_trip_rate", "weekend_rate", "preferred_day",
+    "avg_hour", "preferred_month", "avg_company_freq"
+]
+
+# Ordem das features esperada pelo XGBoost (mesma ordem do treinamento)
+RECOMMENDATION_FEATURES = [
+    'fk_contact', 'date_purchase', 'time_purchase', 'place_origin_departure',
+    'place_destination_departure', 'place_origin_return', 'place_destination_return',
+    'fk_departure_ota_bus_company', 'fk_return_ota_bus_company', 'gmv_success',
+    'total_tickets_quantity_success', 'day_of_week', 'month', 'quarter',
+    'is_weekend', 'hour', 'period_of_day', 'route_departure', 'route_return',
+    'is_round_trip', 'departure_company_freq', 'return_company_freq',
+    'origin_dept_freq', 'dest_dept_freq', 'route_departure_freq', 'cluster',
+    'data_clusterizacao', 'versao_modelo'
+]
 
 # ============================================================================
 # MODELOS DE ENTRADA (PYDANTIC SCHEMAS)
@@ -161,11 +305,12 @@ class RecommendationInput(BaseModel):
     route_departure: str = Field(..., description="Rota de ida")
     route_return: str = Field(..., description="Rota de volta")
     is_round_trip: int = Field(..., description="Viagem de ida e volta (0 ou 1)")
-    departure_company_freq: int = Field(..., description="Frequência da empresa")
-    return_company_freq: int = Field(..., description="Frequência da empresa retorno")
-    origin_dept_freq: int = Field(..., description="Frequência da origem")
-    dest_dept_freq: int = Field(..., description="Frequência do destino")
-    route_departure_freq: int = Field(..., description="Frequência da rota")
+    # Frequências opcionais: ausentes (null), são preenchidas pelas tabelas de frequência da versão
+    departure_company_freq: Optional[int] = Field(None, description="Frequência da empresa")
+    return_company_freq: Optional[int] = Field(None, description="Frequência da empresa retorno")
+    origin_dept_freq: Optional[int] = Field(None, description="Frequência da origem")
+    dest_dept_freq: Optional[int] = Field(None, description="Frequência do destino")
+    route_departure_freq: Optional[int] = Field(None, description="Frequência da rota")
     cluster: int = Field(..., description="Cluster do cliente")
 
     class Config:
@@ -194,6 +339,88 @@ class RecommendationInput(BaseModel):
             }
         }
 
+class ColumnarBatchInput(BaseModel):
+    """
+    Base dos schemas de entrada em lote (layout colunar)
+    Cada campo é uma lista com um valor por registro; todas devem ter o mesmo tamanho.
+    Os valores não são tipados aqui para que um registro inválido não derrube o lote
+    inteiro - a conversão de tipos é feita por coluna e os erros reportados por registro.
+    """
+
+    @model_validator(mode="after")
+    def check_column_lengths(self):
+        lengths = {len(values) for values in self.__dict__.values() if values is not None}
+        if len(lengths) != 1:
+            raise ValueError("Todas as colunas do lote devem ter o mesmo número de registros")
+        size = lengths.pop()
+        if size == 0:
+            raise ValueError("O lote deve conter ao menos um registro")
+        if size > MAX_BATCH_SIZE:
+            raise ValueError(f"O lote excede o tamanho máximo de {MAX_BATCH_SIZE} registros")
+        return self
+
+    def __len__(self) -> int:
+        return len(next(values for values in self.__dict__.values() if values is not None))
+
+def columnar_schema(name: str, record_schema: Type[BaseModel]) -> Type[BaseModel]:
+    """
+    Gera o schema colunar de lote a partir do schema de registro único
+    Mantém os dois sincronizados: um campo novo no schema unitário aparece no lote
+    """
+    fields = {
+        field_name: (List[Any], Field(..., description=f"{field.description} (um valor por registro)"))
+        if field.is_required() else
+        (Optional[List[Any]], Field(None, description=f"{field.description} (um valor por registro, opcional)"))
+        for field_name, field in record_schema.model_fields.items()
+    }
+    example = record_schema.model_config.get("json_schema_extra", {}).get("example", {})
+    batch_schema = create_model(
+        name,
+        __base__=ColumnarBatchInput,
+        __cls_kwargs__={
+            "json_schema_extra": {"example": {key: [value, value] for key, value in example.items()}}
+        },
+        **fields
+    )
+    batch_schema.__doc__ = f"Schema de entrada em lote (colunar) para {record_schema.__name__}"
+    return batch_schema
+
+ClusterizationBatchInput = columnar_schema("ClusterizationBatchInput", ClusterizationInput)
+ClassificationBatchInput = columnar_schema("ClassificationBatchInput", ClassificationInput)
+RecommendationBatchInput = columnar_schema("RecommendationBatchInput", RecommendationInput)
+
+class PurchaseEventsInput(BaseModel):
+    """
+    Compras novas para as agregações incrementais (uma linha do df_t.csv por evento)
+    Os eventos não são tipados aqui: um evento inválido é reportado sem derrubar os demais
+    """
+    events: List[Dict[str, Any]] = Field(..., description="Compras em ordem cronológica")
+
+    @model_validator(mode="after")
+    def check_size(self):
+        if not self.events:
+            raise ValueError("O lote deve conter ao menos um evento")
+        if len(self.events) > MAX_BATCH_SIZE:
+            raise ValueError(f"O lote excede o tamanho máximo de {MAX_BATCH_SIZE} eventos")
+        return self
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "events": [{
+                    "fk_contact": "37228485e0",
+                    "date_purchase": "2024-03-02",
+                    "time_purchase": "15:07:57",
+                    "place_origin_departure": "origem_hash_123",
+                    "place_destination_departure": "destino_hash_456",
+                    "place_origin_return": None,
+                    "fk_departure_ota_bus_company": "empresa_hash_789",
+                    "gmv_success": 155.97,
+                    "total_tickets_quantity_success": 1
+                }]
+            }
+        }
+
 # ============================================================================
 # MODELOS DE SAÍDA (PYDANTIC SCHEMAS)
 # ============================================================================
@@ -213,50 +440,516 @@ class ClassificationOutput(BaseModel):
 class RecommendationOutput(BaseModel):
     """Schema de saída para o modelo de recomendação"""
     top_3_routes: List[Dict[str, Any]] = Field(..., description="Top 3 rotas recomendadas")
+    top_routes: Optional[List[Dict[str, Any]]] = Field(None, description="Top k rotas quando top_k diferente de 3")
     user_cluster: int = Field(..., description="Cluster do usuário")
 
+class CustomerClusterizationOutput(ClusterizationOutput):
+    """Saída da clusterização de um cliente a partir do feature store"""
+    fk_contact: str = Field(..., description="Cliente pontuado")
+    feature_store_generation: str = Field(..., description="Geração do feature store consultada ('incremental' quando vem das agregações incrementais)")
+
+class CustomerClassificationOutput(ClassificationOutput):
+    """Saída da classificação de um cliente a partir do feature store"""
+    fk_contact: str = Field(..., description="Cliente pontuado")
+    feature_store_generation: str = Field(..., description="Geração do feature store consultada ('incremental' quando vem das agregações incrementais)")
+
+class BatchItemError(BaseModel):
+    """Erro associado a um registro específico de um lote"""
+    index: int = Field(..., description="Posição do registro no lote")
+    detail: str = Field(..., description="Descrição do erro")
+
+class PurchaseEventsOutput(BaseModel):
+    """Resultado da ingestão de compras nas agregações incrementais"""
+    accepted: int = Field(..., description="Eventos aplicados")
+    customers: int = Field(..., description="Clientes com agregações em memória")
+    errors: List[BatchItemError] = Field(..., description="Erros por evento")
+
+class ClusterizationBatchOutput(BaseModel):
+    """Schema de saída em lote para o modelo de clusterização"""
+    count: int = Field(..., description="Número de registros recebidos")
+    results: List[Optional[ClusterizationOutput]] = Field(..., description="Resultado por registro (null em caso de erro)")
+    errors: List[BatchItemError] = Field(..., description="Erros por registro")
+
+class ClassificationBatchOutput(BaseModel):
+    """Schema de saída em lote para o modelo de classificação"""
+    count: int = Field(..., description="Número de registros recebidos")
+    results: List[Optional[ClassificationOutput]] = Field(..., description="Resultado por registro (null em caso de erro)")
+    errors: List[BatchItemError] = Field(..., description="Erros por registro")
+
+class RecommendationBatchOutput(BaseModel):
+    """Schema de saída em lote para o modelo de recomendação"""
+    count: int = Field(..., description="Número de registros recebidos")
+    results: List[Optional[RecommendationOutput]] = Field(..., description="Resultado por registro (null em caso de erro)")
+    errors: List[BatchItemError] = Field(..., description="Erros por registro")
+
 # ============================================================================
 # FUNÇÕES AUXILIARES
 # ============================================================================
 
-def load_model(model_type: str):
+def load_model(model_type: str, version: Optional[str] = None):
     """
-    Carrega um modelo do cache ou do disco
+    Carrega um modelo do registro de versões (a versão ativa por padrão)
     Implementa lazy loading - só carrega quando necessário
     """
-    if model_type in model_cache:
-        return model_cache[model_type]
-    
     try:
-        if model_type == "clusterization":
-            with open(MODEL_PATHS["clusterization"], 'rb') as f:
-                model_data = pickle.load(f)
-            model_cache[model_type] = model_data
-            
-        elif model_type == "classification":
-            with open(MODEL_PATHS["classification"], 'rb') as f:
-                model_data = pickle.load(f)
-            model_cache[model_type] = model_data
-            
-        elif model_type == "recommendation":
-            models = {}
-            # Carregar modelo principal
-            with open(MODEL_PATHS["recommendation"]["model"], 'rb') as f:
-                models["model"] = pickle.load(f)
-            # Carregar label encoder
-            with open(MODEL_PATHS["recommendation"]["label_encoder"], 'rb') as f:
-                models["label_encoder"] = pickle.load(f)
-            # Carregar feature encoders
-            with open(MODEL_PATHS["recommendation"]["feature_encoders"], 'rb') as f:
-                models["feature_encoders"] = pickle.load(f)
-            model_cache[model_type] = models
-            
-        return model_cache[model_type]
-        
+        return model_registry.get(model_type, version)
     except Exception as e:
         logger.error(f"Erro ao carregar modelo {model_type}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro ao carregar modelo {model_type}")
 
+# Serializa o unpickling: a primeira leitura importa sklearn/xgboost, e imports
+# simultâneos do mesmo pacote em threads diferentes falham com import circular
+_unpickle_lock = threading.Lock()
+
+def artefact_name(path: str) -> str:
+    """Nome do artefato no relatório de inicialização (<versão>/<arquivo>)"""
+    return os.path.relpath(path, BASE_PATH)
+
+def load_pickle(path: str) -> Any:
+    """Lê um artefato pickle (um por vez; o restante da carga segue em paralelo)"""
+    with _unpickle_lock, open(path, 'rb') as f, startup_report.artefact(artefact_name(path)):
+        return pickle.load(f)
+
+def load_model_from_disk(model_type: str, paths: Dict[str, Any]):
+    """Lê os artefatos de um modelo e pré-compila as estruturas de inferência"""
+    if model_type == "clusterization":
+        model_data = load_pickle(paths["clusterization"])
+        # Pré-compilar scaler + centroides para o caminho de inferência sem pandas
+        model_data["fused_kmeans"] = compile_kmeans(model_data)
+        return model_data
+
+    elif model_type == "classification":
+        model_data = load_pickle(paths["classification"])
+        # Compilar encoders em tabelas hash (evita busca linear em classes_ por requisição)
+        model_data["category_lookups"] = compile_category_lookups(model_data.get("label_encoders", {}))
+        # Backend da RandomForest: nativo ou árvores compiladas em arrays (ML_API_TREE_BACKEND_CLASSIFICATION)
+        model_data["tree_backend"] = TreeBackend(model_data["model"], **configured_tree_backend("classification"))
+        return model_data
+
+    elif model_type == "recommendation":
+        models = {}
+        # Carregar modelo principal
+        models["model"] = load_pickle(paths["recommendation"]["model"])
+        # Carregar label encoder
+        models["label_encoder"] = load_pickle(paths["recommendation"]["label_encoder"])
+        # Carregar feature encoders
+        models["feature_encoders"] = load_pickle(paths["recommendation"]["feature_encoders"])
+        models["feature_lookups"] = compile_category_lookups(models["feature_encoders"])
+        models["route_names"] = compile_route_names(models["label_encoder"], models["feature_encoders"])
+        # Tabelas de frequency encoding (opcionais): preenchem os campos *_freq ausentes
+        models["frequency_lookups"] = load_frequency_lookups(paths["recommendation"]["frequency_maps"])
+        # Plano de montagem das features (ordem do treinamento -> campo e codificação)
+        models["feature_plan"] = RecommendationFeaturePlan(
+            getattr(models["model"], "feature_names_in_", RECOMMENDATION_FEATURES),
+            models["feature_lookups"],
+            models["frequency_lookups"]
+        )
+        # Backend do XGBoost: nativo ou árvores compiladas em arrays (ML_API_TREE_BACKEND_RECOMMENDATION)
+        models["tree_backend"] = TreeBackend(models["model"], **configured_tree_backend("recommendation"))
+        # Rotas populares por cluster/origem (opcional): resposta do modo degradado
+        models["popular_routes"] = load_popular_routes(paths["recommendation"]["popular_routes"])
+        return models
+
+    raise ValueError(f"Tipo de modelo desconhecido: {model_type}")
+
+def compile_kmeans(model_data: Dict[str, Any]) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Incorpora o StandardScaler nos centroides do K-Means
+    
+    Como z = (x - mean) / scale, a distância ao centroide c no espaço normalizado é
+    ||x * (1 / scale) - (mean / scale + c)||. Com os pesos e os centroides deslocados
+    calculados aqui, cluster e confiança saem de um único cálculo de distâncias em NumPy.
+    Retorna None se o resultado não bater com o sklearn (a API usa o caminho original).
+    """
+    try:
+        scaler = model_data["scaler"]
+        centers = np.asarray(model_data["model"].cluster_centers_, dtype=np.float64)
+        n_features = centers.shape[1]
+
+        mean = scaler.mean_ if getattr(scaler, "mean_", None) is not None else np.zeros(n_features)
+        scale = scaler.scale_ if getattr(scaler, "scale_", None) is not None else np.ones(n_features)
+        weights = 1.0 / np.asarray(scale, dtype=np.float64)
+        fused = {
+            "weights": weights,
+            "centers": centers + np.asarray(mean, dtype=np.float64) * weights
+        }
+
+        # Validação na carga: pontos aleatórios em torno dos centroides originais
+        rng = np.random.default_rng(42)
+        probe_scaled = np.repeat(centers, 20, axis=0) + rng.normal(0, 1, (len(centers) * 20, n_features))
+        probe = scaler.inverse_transform(probe_scaled)
+        expected_clusters, expected_confidences = score_clusterization_sklearn(model_data, probe)
+        clusters, confidences = score_clusterization_fused(fused, probe)
+        if not (np.array_equal(clusters, expected_clusters) and np.allclose(confidences, expected_confidences)):
+            logger.warning("K-Means fundido divergiu do sklearn; usando caminho original")
+            return None
+        return fused
+
+    except Exception as e:
+        logger.warning(f"Não foi possível compilar o K-Means fundido: {e}")
+        return None
+
+class CategoryLookup:
+    """
+    Tabela hash valor -> código compilada a partir de um LabelEncoder treinado
+    
+    Substitui `valor in encoder.classes_` (varredura linear) + `encoder.transform`
+    por uma consulta O(1). Valores não vistos no treinamento recebem o código padrão.
+    """
+    __slots__ = ("table", "default")
+
+    def __init__(self, encoder, default: int = 0):
+        classes = getattr(encoder, "classes_", None)
+        classes = [] if classes is None else classes
+        self.table: Dict[str, int] = {str(value): code for code, value in enumerate(classes)}
+        self.default = default
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def encode(self, value: Any) -> int:
+        """Codifica um único valor"""
+        return self.table.get(str(value), self.default)
+
+    def encode_many(self, values) -> np.ndarray:
+        """Codifica uma coluna inteira (variante vetorizada para lotes)"""
+        get = self.table.get
+        default = self.default
+        return np.fromiter((get(str(value), default) for value in values), dtype=np.int64, count=len(values))
+
+def compile_category_lookups(encoders: Dict[str, Any]) -> Dict[str, CategoryLookup]:
+    """
+    Compila todos os encoders de um modelo em tabelas de consulta na carga
+    """
+    lookups = {}
+    for col, encoder in encoders.items():
+        try:
+            lookups[col] = CategoryLookup(encoder)
+        except Exception as e:
+            # Encoder sem classes utilizáveis: todos os valores caem no padrão 0
+            logger.warning(f"Erro ao compilar encoder {col}: {e}. Usando valor padrão.")
+            lookups[col] = CategoryLookup(None)
+    return lookups
+
+def compile_route_names(label_encoder, feature_encoders: Dict[str, Any]) -> List[str]:
+    """
+    Decodifica uma única vez a tabela índice da classe -> rota original
+    
+    As classes do modelo são códigos da rota alvo (next_route_departure) gerados pelo
+    encoder de features; o mesmo encoder usado no export em lote do notebook de
+    recomendação é usado aqui (route_departure quando ele não estiver disponível).
+    """
+    route_encoder = feature_encoders.get("next_route_departure", feature_encoders.get("route_departure"))
+    route_classes = getattr(route_encoder, "classes_", None)
+    route_classes = [] if route_classes is None else route_classes
+
+    route_names = []
+    for route_encoded in label_encoder.classes_:
+        try:
+            code = int(route_encoded)
+        except (TypeError, ValueError):
+            code = -1
+        # Código fora do encoder: mantém o valor codificado, como antes
+        route_names.append(str(route_classes[code]) if 0 <= code < len(route_classes) else str(route_encoded))
+    return route_names
+
+class FrequencyLookup(CategoryLookup):
+    """
+    Tabela valor -> frequência no dataset de treino (frequency encoding do notebook de
+    clusterização). Valores não vistos no treinamento têm frequência 0.
+    """
+    __slots__ = ("missing_value",)
+
+    def __init__(self, counts: Dict[str, int], missing_value: Optional[str] = None):
+        self.table = {str(value): int(count) for value, count in counts.items()}
+        self.default = 0
+        # Valor usado no treinamento para ausentes (ex.: fillna('NO_RETURN') na empresa de retorno)
+        self.missing_value = missing_value
+
+    def _key(self, value: Any) -> str:
+        if self.missing_value is not None and (value is None or value == ""):
+            return self.missing_value
+        return str(value)
+
+    def encode(self, value: Any) -> int:
+        return self.table.get(self._key(value), self.default)
+
+    def encode_many(self, values) -> np.ndarray:
+        get = self.table.get
+        default = self.default
+        return np.fromiter((get(self._key(value), default) for value in values), dtype=np.int64, count=len(values))
+
+# Feature de frequência -> campo de origem (mesmas colunas do frequency_encoding do notebook)
+FREQUENCY_FEATURES = {
+    'departure_company_freq': 'fk_departure_ota_bus_company',
+    'return_company_freq': 'fk_return_ota_bus_company',
+    'origin_dept_freq': 'place_origin_departure',
+    'dest_dept_freq': 'place_destination_departure',
+    'route_departure_freq': 'route_departure',
+}
+# Preenchimento de ausentes aplicado antes da contagem no notebook
+FREQUENCY_MISSING_VALUES = {'return_company_freq': 'NO_RETURN'}
+
+def load_frequency_lookups(path: str) -> Dict[str, FrequencyLookup]:
+    """
+    Tabelas de frequência exportadas pelo notebook de clusterização (frequency_maps.json)
+    Artefato opcional: sem ele os campos *_freq continuam obrigatórios na entrada
+    """
+    if not os.path.exists(path):
+        logger.warning(f"{path} não encontrado: campos *_freq da recomendação devem ser informados")
+        return {}
+    with open(path) as f, startup_report.artefact(artefact_name(path)):
+        maps = json.load(f)["maps"]
+    return {
+        feature: FrequencyLookup(maps[feature], FREQUENCY_MISSING_VALUES.get(feature))
+        for feature in FREQUENCY_FEATURES if feature in maps
+    }
+
+class PopularRoutes:
+    """
+    Rotas mais escolhidas como próxima viagem por (cluster, origem), por cluster e no
+    geral, pré-calculadas no notebook de recomendação. Respondem o /recommendation em
+    modo degradado sem rodar o XGBoost
+    """
+    __slots__ = ("by_cluster_origin", "by_cluster", "overall")
+
+    def __init__(self, routes: Dict[str, Any]):
+        self.by_cluster_origin = {
+            (int(cluster), str(origin)): [(str(route), float(share)) for route, share in ranking]
+            for cluster, origins in routes.get("by_cluster_origin", {}).items()
+            for origin, ranking in origins.items()
+        }
+        self.by_cluster = {
+            int(cluster): [(str(route), float(share)) for route, share in ranking]
+            for cluster, ranking in routes.get("by_cluster", {}).items()
+        }
+        self.overall = [(str(route), float(share)) for route, share in routes.get("overall", [])]
+
+    def __len__(self) -> int:
+        return len(self.by_cluster_origin)
+
+    def top(self, cluster: int, origin: str, k: int) -> List[Tuple[str, float]]:
+        """
+        Top k rotas do par (cluster, origem); completadas com as do cluster e as gerais
+        quando o par tem menos de k rotas (ou não foi visto no treinamento)
+        """
+        ranking: List[Tuple[str, float]] = []
+        seen = set()
+        for candidates in (self.by_cluster_origin.get((cluster, origin), ()),
+                           self.by_cluster.get(cluster, ()),
+                           self.overall):
+            for route, share in candidates:
+                if route not in seen:
+                    seen.add(route)
+                    ranking.append((route, share))
+                    if len(ranking) == k:
+                        return ranking
+        return ranking
+
+def load_popular_routes(path: str) -> Optional[PopularRoutes]:
+    """
+    Rotas populares exportadas pelo notebook de recomendação (popular_routes.json)
+    Artefato opcional: sem ele o /recommendation não tem modo degradado
+    """
+    if not os.path.exists(path):
+        logger.warning(f"{path} não encontrado: /recommendation sem modo degradado")
+        return None
+    with open(path) as f, startup_report.artefact(artefact_name(path)):
+        popular = PopularRoutes(json.load(f)["routes"])
+    if not (popular.overall or popular.by_cluster or popular.by_cluster_origin):
+        # Exportado sem rankings: responderia 200 sem rotas, melhor não ter modo degradado (503)
+        logger.warning(f"{path} sem rotas: /recommendation sem modo degradado")
+        return None
+    return popular
+
+def popular_routes_output(popular: PopularRoutes, input_data: "RecommendationInput", top_k: int) -> "RecommendationOutput":
+    """Resposta do /recommendation no modo degradado (participação da rota como probabilidade)"""
+    routes = [
+        {"rank": rank + 1, "route": route, "probability": share, "confidence": share * 100}
+        for rank, (route, share) in enumerate(popular.top(input_data.cluster, input_data.place_origin_departure, top_k))
+    ]
+    return RecommendationOutput(
+        top_3_routes=routes[:3],
+        top_routes=routes if top_k != 3 else None,
+        user_cluster=input_data.cluster
+    )
+
+class MissingFeatureError(ValueError):
+    """Feature ausente na entrada que a versão do modelo não consegue preencher"""
+
+# Features temporais derivadas de date_purchase/time_purchase, na ordem de process_datetime_features
+DATETIME_FEATURES = ('day_of_week', 'month', 'quarter', 'is_weekend', 'hour', 'period_of_day')
+
+# Valores padrão das features de metadata ausentes na entrada da API
+RECOMMENDATION_METADATA_DEFAULTS = {
+    'data_clusterizacao': lambda: datetime.now().strftime('%Y-%m-%d'),
+    'versao_modelo': lambda: 'XGBoost_v1.0'
+}
+
+# Maior valor representável na matriz de features (float32)
+FLOAT32_MAX = float(np.finfo(np.float32).max)
+
+def coerce_integer(value: Any) -> int:
+    """
+    Equivalente escalar de pd.to_numeric(errors='coerce').fillna(0).astype(int)
+    Mesma conversão usada no treinamento para os campos numéricos lidos como texto.
+    Valores fora do alcance de float32 (ex.: "12e50") viram 0, como os não finitos:
+    na matriz do modelo eles virariam inf.
+    """
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return int(number) if math.isfinite(number) and abs(number) <= FLOAT32_MAX else 0
+
+class RecommendationFeaturePlan:
+    """
+    Montagem da matriz de features do XGBoost compilada uma vez por versão do modelo
+
+    Cada coluna, na ordem do treinamento, vira um passo com o campo de origem e a sua
+    codificação: tabela do encoder, valor numérico, conversão para inteiro ou feature
+    temporal. Os registros são escritos direto numa matriz float32 (o tipo usado
+    internamente pelas árvores), sem DataFrame e sem hash() - a codificação é a mesma
+    em todos os processos.
+    """
+    LOOKUP, NUMBER, INTEGER, DATETIME, FREQUENCY = range(5)
+
+    def __init__(self, feature_names: List[str], feature_lookups: Dict[str, CategoryLookup],
+                 frequency_lookups: Optional[Dict[str, FrequencyLookup]] = None):
+        self.feature_names = list(feature_names)
+        frequency_lookups = frequency_lookups or {}
+        numeric_fields = {
+            name for name, field in RecommendationInput.model_fields.items() if field_type(field)[0] in (int, float)
+        }
+        self.steps = []
+        # Frequências que a versão não sabe preencher: obrigatórias na entrada
+        self.required_frequencies = [
+            feature for feature in self.feature_names
+            if feature in FREQUENCY_FEATURES and feature not in frequency_lookups
+        ]
+        for position, feature in enumerate(self.feature_names):
+            if feature in FREQUENCY_FEATURES:
+                # Valor informado na entrada ou, se ausente, frequência do campo de origem
+                arg = (FREQUENCY_FEATURES[feature], frequency_lookups.get(feature))
+                self.steps.append((position, feature, self.FREQUENCY, arg))
+            elif feature in DATETIME_FEATURES:
+                # Derivada de data/hora; passa pelo encoder se o treinamento a codificou (period_of_day)
+                arg = (DATETIME_FEATURES.index(feature), feature_lookups.get(feature))
+                self.steps.append((position, feature, self.DATETIME, arg))
+            elif feature in feature_lookups:
+                self.steps.append((position, feature, self.LOOKUP, feature_lookups[feature]))
+            elif feature in numeric_fields:
+                self.steps.append((position, feature, self.NUMBER, None))
+            else:
+                # Texto sem encoder (fk_contact, *_return, metadata): numérico ou 0
+                self.steps.append((position, feature, self.INTEGER, None))
+
+    def _defaults(self) -> Dict[str, Any]:
+        return {name: default() for name, default in RECOMMENDATION_METADATA_DEFAULTS.items()}
+
+    def _row(self, record: Dict[str, Any], defaults: Dict[str, Any]) -> List[float]:
+        temporal = datetime_feature_values(record["date_purchase"], record["time_purchase"])
+        row = [0.0] * len(self.feature_names)
+        for position, feature, kind, arg in self.steps:
+            if kind == self.DATETIME:
+                index, lookup = arg
+                row[position] = temporal[index] if lookup is None else lookup.encode(temporal[index])
+                continue
+            value = record.get(feature, defaults.get(feature, 0))
+            if kind == self.FREQUENCY:
+                source, lookup = arg
+                if value is None:
+                    if lookup is None:
+                        raise MissingFeatureError(f"Campo '{feature}' obrigatório nesta versão do modelo")
+                    value = lookup.encode(record.get(source))
+                row[position] = value
+            elif kind == self.LOOKUP:
+                row[position] = arg.encode(value)
+            elif kind == self.NUMBER:
+                row[position] = value
+            else:
+                row[position] = coerce_integer(value)
+        return row
+
+    def encode_records(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        """Matriz (n, features) a partir de registros (dicts com os campos de RecommendationInput)"""
+        defaults = self._defaults()
+        X = np.empty((len(records), len(self.feature_names)), dtype=np.float32)
+        for index, record in enumerate(records):
+            X[index] = self._row(record, defaults)
+        return X
+
+    def encode_columns(self, columns: Dict[str, np.ndarray], rows: np.ndarray) -> np.ndarray:
+        """Matriz (n, features) a partir das colunas de um lote, apenas nas linhas `rows`"""
+        defaults = self._defaults()
+        X = np.zeros((len(rows), len(self.feature_names)), dtype=np.float32)
+        if not len(rows):
+            return X
+        temporal = np.array([
+            datetime_feature_values(date_str, time_str)
+            for date_str, time_str in zip(columns["date_purchase"][rows], columns["time_purchase"][rows])
+        ], dtype=np.int64)
+        for position, feature, kind, arg in self.steps:
+            if kind == self.DATETIME:
+                index, lookup = arg
+                X[:, position] = temporal[:, index] if lookup is None else lookup.encode_many(temporal[:, index])
+                continue
+            if kind == self.FREQUENCY:
+                X[:, position] = self._frequency_column(feature, arg, columns, rows)
+                continue
+            if feature in columns:
+                values = columns[feature][rows]
+            else:
+                values = [defaults.get(feature, 0)] * len(rows)
+            if kind == self.LOOKUP:
+                X[:, position] = arg.encode_many(values)
+            elif kind == self.NUMBER:
+                X[:, position] = values
+            else:
+                # float64 intermediário: IDs numéricos longos não cabem em int64; coerce_integer já
+                # limita ao alcance de float32 (mesma conversão do caminho unitário)
+                X[:, position] = np.fromiter((coerce_integer(value) for value in values), dtype=np.float64, count=len(rows))
+        return X
+
+    @staticmethod
+    def _frequency_column(feature: str, arg: Tuple[str, Optional[FrequencyLookup]],
+                          columns: Dict[str, np.ndarray], rows: np.ndarray) -> np.ndarray:
+        """Frequências informadas no lote; as ausentes (NaN ou coluna omitida) vêm da tabela"""
+        source, lookup = arg
+        if feature in columns:
+            values = np.asarray(columns[feature][rows], dtype=np.float64)
+        else:
+            values = np.full(len(rows), np.nan)
+        missing = np.isnan(values)
+        if missing.any():
+            if lookup is None:
+                raise MissingFeatureError(f"Campo '{feature}' obrigatório nesta versão do modelo")
+            values[missing] = lookup.encode_many(np.asarray(columns[source])[rows][missing])
+        return values
+
+    def frequency_errors(self, columns: Dict[str, Any], size: int) -> Dict[int, str]:
+        """Registros sem uma frequência que esta versão não consegue preencher"""
+        errors: Dict[int, str] = {}
+        for feature in self.required_frequencies:
+            values = columns.get(feature)
+            for index in range(size):
+                value = None if values is None else values[index]
+                if value is None or (isinstance(value, float) and math.isnan(value)):
+                    errors.setdefault(index, f"Campo '{feature}' obrigatório nesta versão do modelo")
+        return errors
+
+    def describe(self) -> Dict[str, Any]:
+        kinds = {self.LOOKUP: "lookup", self.NUMBER: "number", self.INTEGER: "integer", self.DATETIME: "datetime",
+                 self.FREQUENCY: "frequency"}
+        counts = {name: 0 for name in kinds.values()}
+        frequency_maps = {}
+        for _, feature, kind, arg in self.steps:
+            counts[kinds[kind]] += 1
+            if kind == self.FREQUENCY:
+                # Tamanho da tabela de frequência (None: campo obrigatório na entrada)
+                frequency_maps[feature] = None if arg[1] is None else len(arg[1])
+        return {"features": len(self.steps), **counts, "frequency_maps": frequency_maps}
+
 def create_cluster_profile(cluster_id: int) -> Dict[str, Any]:
     """
     Cria o perfil de um cluster baseado nos dados conhecidos
@@ -350,6 +1043,680 @@ def process_datetime_features(date_str: str, time_str: str) -> Dict[str, Any]:
             "period_of_day": 1  # afternoon
         }
 
+@functools.lru_cache(maxsize=8192)
+def datetime_feature_values(date_str: str, time_str: str) -> Tuple[int, ...]:
+    """
+    Features temporais na ordem de DATETIME_FEATURES
+    Em cache: as compras de um mesmo dia/horário se repetem muito entre as requisições
+    """
+    features = process_datetime_features(date_str, time_str)
+    return tuple(features[name] for name in DATETIME_FEATURES)
+
+# ============================================================================
+# FUNÇÕES DE INFERÊNCIA (VETORIZADAS)
+# ============================================================================
+# Os endpoints unitários e os endpoints /batch compartilham as mesmas funções:
+# um registro único é apenas um lote de tamanho 1.
+
+def classify_risk(probability: float) -> str:
+    """
+    Determina a categoria de risco baseada na probabilidade de recompra
+    Thresholds definidos para ações de marketing diferenciadas
+    """
+    if probability >= 0.6:
+        return "Alto"    # Cliente muito provável de comprar - ofertas premium
+    elif probability >= 0.3:
+        return "Médio"   # Cliente moderado - campanhas direcionadas
+    return "Baixo"       # Cliente improvável - campanhas de reativação
+
+def coerce_batch_columns(batch: ColumnarBatchInput, record_schema: Type[BaseModel]) -> Tuple[Dict[str, np.ndarray], Dict[int, str]]:
+    """
+    Converte as colunas de um lote para os tipos do schema unitário
+    Retorna as colunas convertidas e os erros encontrados, indexados pelo registro
+    """
+    columns: Dict[str, np.ndarray] = {}
+    errors: Dict[int, str] = {}
+
+    for field_name, field in record_schema.model_fields.items():
+        values = getattr(batch, field_name)
+        annotation, optional = field_type(field)
+        if values is None:
+            # Coluna opcional ausente: preenchida no servidor
+            continue
+
+        if annotation in (int, float):
+            malformed = np.zeros(len(values), dtype=bool)
+            try:
+                column = np.asarray(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                # Caminho lento apenas quando a coluna tem algum valor não numérico
+                column = np.empty(len(values), dtype=np.float64)
+                for i, value in enumerate(values):
+                    try:
+                        column[i] = float(value)
+                    except (TypeError, ValueError):
+                        column[i] = np.nan
+                        malformed[i] = value is not None
+            invalid = ~np.isfinite(column)
+            if optional:
+                # null em campo opcional fica NaN (preenchido no servidor), não é erro
+                invalid &= ~np.isnan(column) | malformed
+            if annotation is int:
+                invalid |= np.isfinite(column) & (column != np.floor(column))
+                column = np.where(invalid, 0, column)
+                if not optional:
+                    column = column.astype(np.int64)
+        else:
+            column = np.array(values, dtype=object)
+            invalid = np.array([not isinstance(value, str) for value in values], dtype=bool)
+
+        for i in np.flatnonzero(invalid):
+            errors.setdefault(int(i), f"Campo '{field_name}' inválido: {values[i]!r}")
+        columns[field_name] = column
+
+    return columns, errors
+
+def batch_errors(errors: Dict[int, str]) -> List[BatchItemError]:
+    """Converte o dicionário de erros por registro para o schema de saída"""
+    return [BatchItemError(index=index, detail=detail) for index, detail in sorted(errors.items())]
+
+def valid_batch_rows(size: int, errors: Dict[int, str]) -> np.ndarray:
+    """Índices dos registros do lote que não apresentaram erro"""
+    mask = np.ones(size, dtype=bool)
+    mask[list(errors)] = False
+    return np.flatnonzero(mask)
+
+def score_clusterization(model_data: Dict[str, Any], X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pontua uma matriz (n, 13) de features de clusterização
+    Retorna o cluster previsto e a confiança de cada registro
+    """
+    fused = model_data.get("fused_kmeans")
+    if fused is not None:
+        return score_clusterization_fused(fused, X)
+    return score_clusterization_sklearn(model_data, X)
+
+def score_clusterization_fused(fused: Dict[str, np.ndarray], X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Caminho rápido: scaler incorporado aos centroides, sem pandas e sem sklearn
+    Uma única matriz de distâncias (n, k) fornece cluster e confiança
+    """
+    diff = (X * fused["weights"])[:, np.newaxis, :] - fused["centers"][np.newaxis, :, :]
+    distances = np.sqrt(np.einsum("nkf,nkf->nk", diff, diff))
+    clusters = distances.argmin(axis=1)
+    # Menor distância ao centroide = maior confiança na classificação
+    confidences = 1.0 / (1.0 + distances[np.arange(len(clusters)), clusters])
+    return clusters, confidences
+
+def score_clusterization_sklearn(model_data: Dict[str, Any], X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Caminho de referência com scaler.transform, predict e transform do sklearn
+    """
+    model = model_data["model"]
+    scaler = model_data["scaler"]
+
+    # Normalizar features - K-Means é sensível à escala das variáveis
+    features_scaled = scaler.transform(X)
+
+    # Fazer predição do cluster
+    clusters = model.predict(features_scaled)
+
+    # Calcular distâncias para medir confiança
+    # Menor distância ao centroide = maior confiança na classificação
+    distances = model.transform(features_scaled)
+    confidences = 1.0 / (1.0 + distances.min(axis=1))
+    return clusters, confidences
+
+def build_classification_matrix(model_data: Dict[str, Any], columns: Dict[str, Any]) -> np.ndarray:
+    """
+    Monta a matriz de features do modelo de classificação a partir de colunas
+    Aplica os label encoders nas variáveis categóricas (origem, destino, empresa)
+    As colunas seguem a ordem de feature_columns (a do treinamento), sem DataFrame
+    """
+    feature_columns = model_data["feature_columns"]
+    category_lookups = model_data["category_lookups"]
+    size = len(next(iter(columns.values())))
+
+    data = {}
+    for col in feature_columns:
+        if col not in columns:
+            # Garantir que todas as features estão presentes
+            data[col] = np.zeros(size, dtype=np.int64)
+        elif col in category_lookups:
+            # Tratamento defensivo para valores não vistos durante treinamento
+            data[col] = category_lookups[col].encode_many(columns[col])
+        else:
+            data[col] = np.asarray(columns[col])
+
+    return np.column_stack([data[col] for col in feature_columns]).astype(np.float64)
+
+def select_top_k(probabilities: np.ndarray, k: int) -> np.ndarray:
+    """
+    Índices das k maiores probabilidades de cada linha, em ordem decrescente
+    Usa seleção parcial (argpartition) em vez de ordenar todas as rotas
+    """
+    probabilities = np.atleast_2d(probabilities)
+    n_classes = probabilities.shape[1]
+    k = min(k, n_classes)
+    if k < n_classes:
+        top = np.argpartition(probabilities, n_classes - k, axis=1)[:, -k:]
+    else:
+        top = np.broadcast_to(np.arange(n_classes), probabilities.shape)
+    # Ordenar apenas os k selecionados
+    order = np.argsort(-np.take_along_axis(probabilities, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+def build_recommendation_outputs(models: Dict[str, Any],
+                                 probabilities: np.ndarray,
+                                 clusters: List[int],
+                                 top_ks: List[int]) -> List[RecommendationOutput]:
+    """
+    Converte a matriz de probabilidades (registros x rotas) nas respostas da API
+    As rotas vêm da tabela índice -> rota decodificada uma única vez na carga
+    """
+    route_names = models["route_names"]
+    top_indices = select_top_k(probabilities, max(top_ks))
+
+    outputs = []
+    for row, (cluster, top_k) in enumerate(zip(clusters, top_ks)):
+        routes = []
+        for rank, idx in enumerate(top_indices[row, :top_k]):
+            probability = probabilities[row, idx]
+            routes.append({
+                "rank": rank + 1,
+                "route": route_names[idx],
+                "probability": float(probability),
+                "confidence": float(probability * 100)
+            })
+        outputs.append(RecommendationOutput(
+            top_3_routes=routes[:3],
+            top_routes=routes if top_k != 3 else None,
+            user_cluster=int(cluster)
+        ))
+    return outputs
+
+# ============================================================================
+# PREDIÇÕES (EXECUTADAS NOS POOLS DE INFERÊNCIA)
+# ============================================================================
+# Funções síncronas com todo o trabalho de CPU de cada endpoint. Os endpoints
+# async apenas as despacham para o executor do modelo correspondente.
+
+def predict_cluster_sync(input_data: ClusterizationInput, version: Optional[str] = None) -> ClusterizationOutput:
+    """Predição de cluster para um único cliente"""
+    # Carregar modelo
+    model_data = load_model("clusterization", version)
+
+    # Preparar dados de entrada na ordem das features do modelo
+    with stage("encoding"):
+        X = np.array([[getattr(input_data, name) for name in CLUSTERIZATION_FEATURES]], dtype=np.float64)
+
+    with stage("predict"):
+        clusters, confidences = score_clusterization(model_data, X)
+    cluster_pred = int(clusters[0])
+
+    with stage("postprocess"):
+        # Criar perfil do cluster
+        cluster_profile = create_cluster_profile(cluster_pred)
+
+        return ClusterizationOutput(
+            cluster=cluster_pred,
+            cluster_profile=cluster_profile,
+            confidence=float(confidences[0])
+        )
+
+def predict_cluster_batch_sync(batch: ColumnarBatchInput, version: Optional[str] = None) -> ClusterizationBatchOutput:
+    """Predição de cluster para um lote colunar"""
+    model_data = load_model("clusterization", version)
+    size = len(batch)
+    with stage("encoding"):
+        columns, errors = coerce_batch_columns(batch, ClusterizationInput)
+        rows = valid_batch_rows(size, errors)
+
+    results: List[Optional[ClusterizationOutput]] = [None] * size
+    if len(rows):
+        with stage("encoding"):
+            X = np.column_stack([columns[name][rows] for name in CLUSTERIZATION_FEATURES]).astype(np.float64)
+        with stage("predict"):
+            clusters, confidences = score_clusterization(model_data, X)
+        with stage("postprocess"):
+            for index, cluster, confidence in zip(rows, clusters, confidences):
+                results[index] = ClusterizationOutput(
+                    cluster=int(cluster),
+                    cluster_profile=create_cluster_profile(int(cluster)),
+                    confidence=float(confidence)
+                )
+
+    return ClusterizationBatchOutput(count=size, results=results, errors=batch_errors(errors))
+
+def predict_purchase_sync(input_data: ClassificationInput, version: Optional[str] = None) -> ClassificationOutput:
+    """Predição de recompra para um único cliente"""
+    # Carregar modelo
+    model_data = load_model("classification", version)
+    model = model_data["tree_backend"]  # predict_proba nativo ou compilado
+
+    # Preparar dados como colunas de um lote de tamanho 1
+    with stage("encoding"):
+        columns = {key: [value] for key, value in input_data.dict().items()}
+        X = build_classification_matrix(model_data, columns)
+
+    # Fazer predição de recompra em 30 dias
+    with stage("predict"):
+        probability = model.predict_proba(X)[0][1]  # Probabilidade da classe positiva (vai comprar)
+    prediction = probability > 0.5
+
+    with stage("postprocess"):
+        return ClassificationOutput(
+            will_purchase=bool(prediction),
+            probability=float(probability),
+            risk_category=classify_risk(probability)
+        )
+
+def predict_purchase_batch_sync(batch: ColumnarBatchInput, version: Optional[str] = None) -> ClassificationBatchOutput:
+    """Predição de recompra para um lote colunar"""
+    model_data = load_model("classification", version)
+    model = model_data["tree_backend"]  # predict_proba nativo ou compilado
+    size = len(batch)
+    with stage("encoding"):
+        columns, errors = coerce_batch_columns(batch, ClassificationInput)
+        rows = valid_batch_rows(size, errors)
+
+    results: List[Optional[ClassificationOutput]] = [None] * size
+    if len(rows):
+        with stage("encoding"):
+            X = build_classification_matrix(model_data, {key: values[rows] for key, values in columns.items()})
+        with stage("predict"):
+            probabilities = model.predict_proba(X)[:, 1]
+        with stage("postprocess"):
+            for index, probability in zip(rows, probabilities):
+                results[index] = ClassificationOutput(
+                    will_purchase=bool(probability > 0.5),
+                    probability=float(probability),
+                    risk_category=classify_risk(probability)
+                )
+
+    return ClassificationBatchOutput(count=size, results=results, errors=batch_errors(errors))
+
+def recommend_routes_sync(input_data: RecommendationInput, top_k: int = 3, version: Optional[str] = None) -> RecommendationOutput:
+    """Recomendação de rotas para uma única viagem"""
+    # Carregar modelos
+    models = load_model("recommendation", version)
+    model = models["tree_backend"]  # predict_proba nativo ou compilado
+
+    # Preparar dados de entrada
+    with stage("encoding"):
+        X = models["feature_plan"].encode_records([input_data.dict()])
+
+    # Fazer predição - obter probabilidades para todas as rotas possíveis
+    with stage("predict"):
+        probabilities = model.predict_proba(X)
+
+    with stage("postprocess"):
+        return build_recommendation_outputs(models, probabilities, [input_data.cluster], [top_k])[0]
+
+def recommend_routes_many_sync(items: List[Tuple[RecommendationInput, int, Optional[str]]]) -> List[Any]:
+    """
+    Recomendação para requisições unitárias agrupadas pelo micro-batcher
+    Cada item é (entrada, top_k, versão). Uma chamada a predict_proba por versão
+    de modelo no lote; falhas ao carregar uma versão afetam só os registros dela
+    """
+    results: List[Any] = [None] * len(items)
+
+    by_version: Dict[Optional[str], List[int]] = {}
+    for index, (_, _, version) in enumerate(items):
+        by_version.setdefault(version, []).append(index)
+
+    for version, indices in by_version.items():
+        try:
+            models = load_model("recommendation", version)
+        except Exception as e:
+            for index in indices:
+                results[index] = e
+            continue
+
+        with stage("encoding"):
+            records = [items[index][0].dict() for index in indices]
+            plan = models["feature_plan"]
+            # Registros sem uma frequência que a versão não preenche falham sozinhos
+            missing = plan.frequency_errors(
+                {feature: [record[feature] for record in records] for feature in plan.required_frequencies},
+                len(records)
+            )
+            for position, detail in missing.items():
+                results[indices[position]] = MissingFeatureError(detail)
+            records = [record for position, record in enumerate(records) if position not in missing]
+            indices = [index for position, index in enumerate(indices) if position not in missing]
+            if not indices:
+                continue
+            X = plan.encode_records(records)
+        with stage("predict"):
+            probabilities = models["tree_backend"].predict_proba(X)
+        with stage("postprocess"):
+            outputs = build_recommendation_outputs(
+                models,
+                probabilities,
+                [items[index][0].cluster for index in indices],
+                [items[index][1] for index in indices]
+            )
+            for index, output in zip(indices, outputs):
+                results[index] = output
+    return results
+
+def recommend_routes_batch_sync(batch: ColumnarBatchInput, top_k: int = 3, version: Optional[str] = None) -> RecommendationBatchOutput:
+    """Recomendação de rotas para um lote colunar"""
+    models = load_model("recommendation", version)
+    model = models["tree_backend"]  # predict_proba nativo ou compilado
+    size = len(batch)
+
+    with stage("encoding"):
+        columns, errors = coerce_batch_columns(batch, RecommendationInput)
+        for index, detail in models["feature_plan"].frequency_errors(columns, size).items():
+            errors.setdefault(index, detail)
+        rows = valid_batch_rows(size, errors)
+
+    results: List[Optional[RecommendationOutput]] = [None] * size
+    if len(rows):
+        with stage("encoding"):
+            X = models["feature_plan"].encode_columns(columns, rows)
+        with stage("predict"):
+            probabilities = model.predict_proba(X)
+        with stage("postprocess"):
+            outputs = build_recommendation_outputs(
+                models,
+                probabilities,
+                columns["cluster"][rows].tolist(),
+                [top_k] * len(rows)
+            )
+            for index, output in zip(rows, outputs):
+                results[index] = output
+
+    return RecommendationBatchOutput(count=size, results=results, errors=batch_errors(errors))
+
+# ============================================================================
+# PONTUAÇÃO EM MASSA (ARROW)
+# ============================================================================
+# Saídas por coluna (arrays NumPy) das linhas válidas de um bloco de colunas. Usadas
+# pelos endpoints /arrow, que devolvem as predições como colunas Arrow.
+
+def score_cluster_columns(model_data: Dict[str, Any], columns: Dict[str, np.ndarray], rows: np.ndarray, top_k: int) -> Dict[str, np.ndarray]:
+    """Cluster e confiança das linhas `rows`"""
+    X = np.column_stack([columns[name][rows] for name in CLUSTERIZATION_FEATURES]).astype(np.float64)
+    clusters, confidences = score_clusterization(model_data, X)
+    return {"cluster": clusters.astype(np.int64), "confidence": confidences.astype(np.float64)}
+
+def score_purchase_columns(model_data: Dict[str, Any], columns: Dict[str, np.ndarray], rows: np.ndarray, top_k: int) -> Dict[str, np.ndarray]:
+    """Probabilidade de recompra e categoria de risco das linhas `rows`"""
+    X = build_classification_matrix(model_data, {key: values[rows] for key, values in columns.items()})
+    probabilities = model_data["tree_backend"].predict_proba(X)[:, 1].astype(np.float64)
+    risk = np.where(probabilities >= 0.6, "Alto", np.where(probabilities >= 0.3, "Médio", "Baixo")).astype(object)
+    return {"will_purchase": probabilities > 0.5, "probability": probabilities, "risk_category": risk}
+
+def score_routes_columns(models: Dict[str, Any], columns: Dict[str, np.ndarray], rows: np.ndarray, top_k: int) -> Dict[str, np.ndarray]:
+    """Top-k rotas (route_i, probability_i) e cluster do usuário das linhas `rows`"""
+    X = models["feature_plan"].encode_columns(columns, rows)
+    probabilities = models["tree_backend"].predict_proba(X)
+    top = select_top_k(probabilities, top_k)
+    routes = np.asarray(models["route_names"], dtype=object)[top]
+    top_probabilities = np.take_along_axis(probabilities, top, axis=1).astype(np.float64)
+
+    outputs = {"user_cluster": columns["cluster"][rows].astype(np.int64)}
+    for rank in range(top.shape[1]):
+        outputs[f"route_{rank + 1}"] = routes[:, rank]
+        outputs[f"probability_{rank + 1}"] = top_probabilities[:, rank]
+    return outputs
+
+# Modelo -> (schema de entrada, função de pontuação por colunas)
+ARROW_SCORERS = {
+    "clusterization": (ClusterizationInput, score_cluster_columns),
+    "classification": (ClassificationInput, score_purchase_columns),
+    "recommendation": (RecommendationInput, score_routes_columns),
+}
+
+def score_arrow_sync(model_type: str, body: bytes, version: Optional[str] = None, top_k: int = DEFAULT_TOP_K) -> bytes:
+    """
+    Pontua um stream Arrow IPC/Parquet e devolve as predições como stream Arrow IPC
+    A tabela é processada em blocos de ML_API_ARROW_CHUNK_ROWS registros
+    """
+    model_data = load_model(model_type, version)
+    record_schema, score_columns = ARROW_SCORERS[model_type]
+
+    with stage("validation"):
+        table = arrow_io.read_table(body)
+    if table.num_rows == 0:
+        raise arrow_io.ArrowInputError("O lote deve conter ao menos um registro")
+
+    def empty_outputs() -> Dict[str, np.ndarray]:
+        # Bloco sem registros válidos: mesmas colunas (e tipos) do exemplo do schema, todas nulas
+        example = schema_example(record_schema).dict()
+        columns = {name: np.array([value], dtype=object if isinstance(value, str) else None)
+                   for name, value in example.items()}
+        return {name: values[:0] for name, values in score_columns(model_data, columns, np.arange(1), top_k).items()}
+
+    def batches():
+        for _, chunk in arrow_io.iter_chunks(table):
+            with stage("encoding"):
+                columns, errors = arrow_io.table_columns(chunk, record_schema)
+                if "feature_plan" in model_data:
+                    for index, detail in model_data["feature_plan"].frequency_errors(columns, chunk.num_rows).items():
+                        errors.setdefault(index, detail)
+                rows = valid_batch_rows(chunk.num_rows, errors)
+            if len(rows):
+                with stage("predict"):
+                    outputs = score_columns(model_data, columns, rows, top_k)
+            else:
+                outputs = empty_outputs()
+            with stage("postprocess"):
+                yield arrow_io.record_batch(chunk.num_rows, rows, outputs, errors)
+
+    return arrow_io.write_stream(batches())
+
+# ============================================================================
+# PROTOCOLO BINÁRIO (SOCKET UNIX)
+# ============================================================================
+# Frames de layout fixo pontuados pelas mesmas funções por colunas dos endpoints /arrow
+# (binary_protocol.py); sempre com a versão ativa dos modelos.
+
+def score_binary_sync(model_type: str, records: np.ndarray, top_k: int) -> bytes:
+    """Pontua os registros de um frame binário e devolve os resultados codificados"""
+    model_data = load_model(model_type)
+    record_schema, score_columns = ARROW_SCORERS[model_type]
+
+    with stage("encoding"):
+        columns, errors = binary_protocol.record_columns(records, record_schema)
+        if "feature_plan" in model_data:
+            for index, detail in model_data["feature_plan"].frequency_errors(columns, len(records)).items():
+                errors.setdefault(index, detail)
+        rows = valid_batch_rows(len(records), errors)
+    outputs: Dict[str, np.ndarray] = {}
+    if len(rows):
+        with stage("predict"):
+            outputs = score_columns(model_data, columns, rows, top_k)
+    with stage("postprocess"):
+        return binary_protocol.encode_results(model_type, top_k, len(records), rows, outputs)
+
+async def score_binary_frame(model_type: str, records: np.ndarray, top_k: int) -> bytes:
+    return await inference_executors[model_type].run(score_binary_sync, model_type, records, top_k)
+
+# Caminho do socket Unix (ML_API_UDS_PATH); sem ele o listener só sobe com um socket do prefork.py
+UDS_SOCKET_PATH = binary_protocol.configured_socket_path()
+# Socket criado pelo prefork.py antes do fork: todos os workers aceitam conexões nele
+binary_listener_socket = None
+binary_server = binary_protocol.BinaryScoringServer(
+    {model_type: binary_protocol.record_dtype(record_schema) for model_type, (record_schema, _) in ARROW_SCORERS.items()},
+    score_binary_frame,
+    default_top_k=DEFAULT_TOP_K,
+    max_top_k=MAX_TOP_K,
+    max_records=MAX_BATCH_SIZE,
+    controllers=admission_controllers
+)
+
+# ============================================================================
+# PONTUAÇÃO EM STREAMING (NDJSON)
+# ============================================================================
+# Cada bloco de linhas do corpo é pontuado pela mesma função dos endpoints /batch.
+
+# Modelo -> (schema colunar, função de lote)
+STREAM_SCORERS = {
+    "clusterization": (ClusterizationBatchInput, lambda batch, top_k, version: predict_cluster_batch_sync(batch, version)),
+    "classification": (ClassificationBatchInput, lambda batch, top_k, version: predict_purchase_batch_sync(batch, version)),
+    "recommendation": (RecommendationBatchInput, recommend_routes_batch_sync),
+}
+
+def score_stream_chunk_sync(model_type: str, chunk: List[Tuple[int, Any, str]],
+                            top_k: int = DEFAULT_TOP_K, version: Optional[str] = None) -> Tuple[bytes, int]:
+    """
+    Pontua um bloco do stream NDJSON
+    Retorna as linhas de saída (na ordem de entrada) e quantos registros falharam
+    """
+    batch_schema, score_batch = STREAM_SCORERS[model_type]
+    records = [record for _, record, error in chunk if not error]
+
+    results: List[Any] = []
+    batch_errors_by_row: Dict[int, str] = {}
+    if records:
+        columns = ndjson_stream.record_columns(records, list(batch_schema.model_fields))
+        output = score_batch(batch_schema.model_construct(**columns), top_k, version)
+        results = output.results
+        batch_errors_by_row = {error.index: error.detail for error in output.errors}
+
+    with stage("serialization"):
+        lines = []
+        failed = 0
+        position = 0
+        for index, record, error in chunk:
+            if not error:
+                error = batch_errors_by_row.get(position)
+                result = results[position]
+                position += 1
+            if error:
+                failed += 1
+                lines.append(ndjson_stream.ndjson_line({"index": index, "error": error}))
+            else:
+                lines.append(ndjson_stream.ndjson_line({"index": index, "result": result.dict()}))
+        return b"".join(lines), failed
+
+# Micro-batching do /recommendation (ML_API_MICROBATCH_RECOMMENDATION[_MAX_SIZE|_MAX_WAIT_MS])
+_recommendation_batching = configured_micro_batching("recommendation")
+recommendation_batcher = MicroBatcher(
+    "recommendation",
+    recommend_routes_many_sync,
+    inference_executors["recommendation"],
+    max_batch_size=_recommendation_batching["max_batch_size"],
+    max_wait_ms=_recommendation_batching["max_wait_ms"]
+) if _recommendation_batching["enabled"] else None
+
+def schema_example(record_schema: Type[BaseModel]) -> BaseModel:
+    """Instância de um schema de entrada a partir do exemplo da documentação"""
+    return record_schema(**record_schema.model_config["json_schema_extra"]["example"])
+
+def warm_up_model(model_type: str, version: str):
+    """
+    Executa uma predição sintética com o modelo de uma versão recém-carregada
+    Garante que a primeira requisição real após a troca não pague inicializações tardias
+    """
+    if model_type == "clusterization":
+        predict_cluster_sync(schema_example(ClusterizationInput), version)
+    elif model_type == "classification":
+        predict_purchase_sync(schema_example(ClassificationInput), version)
+    elif model_type == "recommendation":
+        recommend_routes_sync(schema_example(RecommendationInput), MAX_TOP_K, version)
+
+# Cache de resultados dos endpoints unitários (ML_API_CACHE_<ENDPOINT>[_MAX_ENTRIES|_TTL_SECONDS])
+prediction_caches: Dict[str, Optional[PredictionCache]] = {}
+for _endpoint in ("clusterization", "classification"):
+    _cache_config = configured_prediction_cache(_endpoint)
+    prediction_caches[_endpoint] = PredictionCache(
+        _endpoint,
+        max_entries=_cache_config["max_entries"],
+        ttl_seconds=_cache_config["ttl_seconds"]
+    ) if _cache_config["enabled"] else None
+
+async def cached_prediction(endpoint: str, input_data: BaseModel, version: str, compute):
+    """
+    Executa a predição através do cache do endpoint, quando habilitado
+    A chave inclui a versão do modelo: uma troca de versão nunca serve resultados antigos
+    """
+    cache = prediction_caches.get(endpoint)
+    if cache is None:
+        return await compute()
+
+    async def shared():
+        # O cálculo é compartilhado com as requisições coalescidas: não herda o prazo de quem o iniciou
+        with deadline_scope(None):
+            return await compute()
+
+    return await cache.get_or_compute(cache_key(input_data.dict(), version), shared)
+
+# Registro de versões dos modelos - carga lazy, troca atômica da versão ativa
+model_registry = ModelRegistry(
+    BASE_PATH,
+    load_model_from_disk,
+    warm_up=warm_up_model,
+    active_version=MODEL_VERSION,
+    keep_versions=MODEL_KEEP_VERSIONS
+)
+
+def pinned_model_version(response: Response,
+                         x_model_version: Optional[str] = Header(None, description="Fixa a versão dos modelos (ex.: v1)"),
+                         model_version: Optional[str] = Query(None, description="Fixa a versão dos modelos (ex.: v1)")) -> str:
+    """
+    Resolve a versão dos modelos usada em uma requisição
+    A versão é fixada no início da requisição: uma troca concorrente não a afeta
+    """
+    requested = x_model_version or model_version
+    try:
+        version = model_registry.resolve(requested)
+    except UnknownModelVersion:
+        raise HTTPException(status_code=404, detail=f"Versão de modelo desconhecida: {requested}")
+    response.headers["X-Model-Version"] = version
+    return version
+
+# Features por cliente (fk_contact) para os endpoints /<modelo>/customer/{fk_contact}
+feature_store = FeatureStore(configured_store_path())
+
+# Agregações incrementais alimentadas por POST /customers/purchases (por processo)
+customer_aggregator = (
+    CustomerAggregator.load(CUSTOMER_AGGREGATES_PATH)
+    if CUSTOMER_AGGREGATES_PATH and os.path.exists(CUSTOMER_AGGREGATES_PATH)
+    else CustomerAggregator()
+)
+
+def customer_input(table_name: str, fk_contact: str, record_schema: Type[BaseModel]) -> Tuple[BaseModel, str]:
+    """
+    Entrada do modelo montada com as features do cliente
+    As agregações incrementais (mais recentes) têm prioridade sobre o feature store, exceto
+    para clientes que já estavam no store quando o primeiro evento chegou (estado parcial)
+    """
+    record = customer_aggregator.features(table_name, fk_contact)
+    if record is not None:
+        return record_schema(**record), "incremental"
+    try:
+        record, generation = feature_store.features(table_name, fk_contact)
+    except LookupError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Cliente não encontrado no feature store: {fk_contact}")
+    return record_schema(**record), generation
+
+def stored_customer(fk_contact: str) -> bool:
+    """Se o cliente está na geração atual do feature store (já tem histórico de compras)"""
+    current = feature_store.current
+    return current is not None and current.row(fk_contact) is not None
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Exige o token administrativo (ML_API_ADMIN_TOKEN) quando ele está configurado"""
+    if ADMIN_TOKEN and not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Token administrativo inválido")
+
+def require_admin_endpoint(x_admin_token: Optional[str] = Header(None)):
+    """
+    Endpoints de diagnóstico e de ingestão de compras: inexistentes (404) sem
+    ML_API_ADMIN_TOKEN configurado, e com ele sempre exigem o token (expõem estado interno
+    do worker ou alteram as features servidas)
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    require_admin_token(x_admin_token)
+
 # ============================================================================
 # ENDPOINTS DA API
 # ============================================================================
@@ -363,311 +1730,484 @@ async def root():
         "endpoints": [
             "/clusterization - Segmentação de clientes",
             "/classification - Predição de recompra",
-            "/recommendation - Recomendação de rotas"
+            "/recommendation - Recomendação de rotas",
+            "/clusterization/batch - Segmentação de clientes em lote",
+            "/classification/batch - Predição de recompra em lote",
+            "/recommendation/batch - Recomendação de rotas em lote",
+            "/clusterization/arrow - Segmentação de clientes em massa (Arrow/Parquet)",
+            "/classification/arrow - Predição de recompra em massa (Arrow/Parquet)",
+            "/recommendation/arrow - Recomendação de rotas em massa (Arrow/Parquet)",
+            "/clusterization/stream - Segmentação de clientes em streaming (NDJSON)",
+            "/classification/stream - Predição de recompra em streaming (NDJSON)",
+            "/recommendation/stream - Recomendação de rotas em streaming (NDJSON)",
+            "/clusterization/customer/{fk_contact} - Segmentação de um cliente pelo feature store",
+            "/classification/customer/{fk_contact} - Predição de recompra de um cliente pelo feature store",
+            "/customers/purchases - Ingestão de compras nas agregações incrementais por cliente",
+            "/models - Versões dos modelos disponíveis e ativa"
         ]
     }
 
 @app.post("/clusterization", response_model=ClusterizationOutput)
-async def predict_cluster(input_data: ClusterizationInput):
+async def predict_cluster(input_data: ClusterizationInput, version: str = Depends(pinned_model_version)):
     """
     Endpoint para predição de cluster de cliente
     
     Recebe dados comportamentais do cliente e retorna o cluster identificado
     """
     try:
-        # Carregar modelo
-        model_data = load_model("clusterization")
-        model = model_data["model"]
-        scaler = model_data["scaler"]
-        
-        # Preparar dados de entrada com nomes de colunas
-        feature_names = [
-            "gmv_mean", "gmv_total", "purchase_count", "gmv_std",
-            "tickets_mean", "tickets_total", "tickets_std",
-            "round_trip_rate", "weekend_rate", "preferred_day",
-            "avg_hour", "preferred_month", "avg_company_freq"
-        ]
-        
-        features_dict = {
-            "gmv_mean": input_data.gmv_mean,
-            "gmv_total": input_data.gmv_total,
-            "purchase_count": input_data.purchase_count,
-            "gmv_std": input_data.gmv_std,
-            "tickets_mean": input_data.tickets_mean,
-            "tickets_total": input_data.tickets_total,
-            "tickets_std": input_data.tickets_std,
-            "round_trip_rate": input_data.round_trip_rate,
-            "weekend_rate": input_data.weekend_rate,
-            "preferred_day": input_data.preferred_day,
-            "avg_hour": input_data.avg_hour,
-            "preferred_month": input_data.preferred_month,
-            "avg_company_freq": input_data.avg_company_freq
-        }
-        
-        # Criar DataFrame com nomes de colunas
-        features_df = pd.DataFrame([features_dict])
-        
-        # Normalizar features - K-Means é sensível à escala das variáveis
-        features_scaled = scaler.transform(features_df)
-        
-        # Fazer predição do cluster
-        cluster_pred = model.predict(features_scaled)[0]
-        
-        # Calcular distâncias para medir confiança
-        # Menor distância ao centroide = maior confiança na classificação
-        distances = model.transform(features_scaled)[0]
-        confidence = 1.0 / (1.0 + min(distances))
-        
-        # Criar perfil do cluster
-        cluster_profile = create_cluster_profile(cluster_pred)
-        
-        return ClusterizationOutput(
-            cluster=int(cluster_pred),
-            cluster_profile=cluster_profile,
-            confidence=float(confidence)
+        return await cached_prediction(
+            "clusterization", input_data, version,
+            lambda: inference_executors["clusterization"].run(predict_cluster_sync, input_data, version)
         )
-        
     except Exception as e:
         logger.error(f"Erro na predição de cluster: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro na predição: {str(e)}")
 
+@app.post("/clusterization/batch", response_model=ClusterizationBatchOutput)
+async def predict_cluster_batch(batch: ClusterizationBatchInput, version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para predição de cluster em lote (layout colunar)
+    
+    Todos os registros válidos são normalizados e pontuados como uma única matriz.
+    Registros inválidos são reportados em `errors` sem derrubar o lote.
+    """
+    try:
+        return await inference_executors["clusterization"].run(predict_cluster_batch_sync, batch, version)
+    except Exception as e:
+        logger.error(f"Erro na predição de cluster em lote: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro na predição: {str(e)}")
+
+@app.get("/clusterization/customer/{fk_contact}", response_model=CustomerClusterizationOutput)
+async def predict_cluster_customer(fk_contact: str, version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para predição de cluster a partir apenas do fk_contact
+    
+    As 13 features agregadas do cliente vêm do feature store local
+    """
+    input_data, generation = customer_input("clusterization", fk_contact, ClusterizationInput)
+    try:
+        output = await cached_prediction(
+            "clusterization", input_data, version,
+            lambda: inference_executors["clusterization"].run(predict_cluster_sync, input_data, version)
+        )
+    except Exception as e:
+        logger.error(f"Erro na predição de cluster do cliente {fk_contact}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro na predição: {str(e)}")
+    return CustomerClusterizationOutput(**output.dict(), fk_contact=fk_contact, feature_store_generation=generation)
+
 @app.post("/classification", response_model=ClassificationOutput)
-async def predict_purchase(input_data: ClassificationInput):
+async def predict_purchase(input_data: ClassificationInput, version: str = Depends(pinned_model_version)):
     """
     Endpoint para predição de recompra em 30 dias
     
     Recebe dados históricos do cliente e retorna probabilidade de recompra
     """
     try:
-        # Carregar modelo
-        model_data = load_model("classification")
-        model = model_data["model"]
-        feature_columns = model_data["feature_columns"]
-        label_encoders = model_data.get("label_encoders", {})
-        
-        # Preparar dados em formato DataFrame
-        data_dict = input_data.dict()
-        
-        # Aplicar label encoders para variáveis categóricas (origem, destino, empresa)
-        # Tratamento defensivo para valores não vistos durante treinamento
-        for col, encoder in label_encoders.items():
-            if col in data_dict:
-                try:
-                    # Tentar transformar usando o encoder
-                    str_value = str(data_dict[col])
-                    if hasattr(encoder, 'classes_') and str_value in encoder.classes_:
-                        data_dict[col] = encoder.transform([str_value])[0]
-                    else:
-                        # Se valor não existe no encoder, usar valor padrão
-                        # Evita erro em dados não vistos no treinamento
-                        data_dict[col] = 0
-                except Exception as e:
-                    logger.warning(f"Erro ao codificar {col} na classificação: {e}. Usando valor padrão.")
-                    data_dict[col] = 0
-        
-        # Criar DataFrame com as features na ordem correta
-        df = pd.DataFrame([data_dict])
-        
-        # Garantir que todas as features estão presentes
-        for col in feature_columns:
-            if col not in df.columns:
-                df[col] = 0
-        
-        # Selecionar apenas as colunas do modelo
-        X = df[feature_columns]
-        
-        # Fazer predição de recompra em 30 dias
-        probability = model.predict_proba(X)[0][1]  # Probabilidade da classe positiva (vai comprar)
-        prediction = probability > 0.5
-        
-        # Determinar categoria de risco baseada na probabilidade
-        # Thresholds definidos para ações de marketing diferenciadas
-        if probability >= 0.6:
-            risk_category = "Alto"    # Cliente muito provável de comprar - ofertas premium
-        elif probability >= 0.3:
-            risk_category = "Médio"   # Cliente moderado - campanhas direcionadas
-        else:
-            risk_category = "Baixo"   # Cliente improvável - campanhas de reativação
-        
-        return ClassificationOutput(
-            will_purchase=bool(prediction),
-            probability=float(probability),
-            risk_category=risk_category
+        return await cached_prediction(
+            "classification", input_data, version,
+            lambda: inference_executors["classification"].run(predict_purchase_sync, input_data, version)
         )
-        
     except Exception as e:
         logger.error(f"Erro na predição de classificação: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro na predição: {str(e)}")
 
+@app.post("/classification/batch", response_model=ClassificationBatchOutput)
+async def predict_purchase_batch(batch: ClassificationBatchInput, version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para predição de recompra em lote (layout colunar)
+    
+    As colunas categóricas são codificadas de uma vez e o lote é pontuado
+    com uma única chamada a predict_proba.
+    """
+    try:
+        return await inference_executors["classification"].run(predict_purchase_batch_sync, batch, version)
+    except Exception as e:
+        logger.error(f"Erro na predição de classificação em lote: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro na predição: {str(e)}")
+
+@app.get("/classification/customer/{fk_contact}", response_model=CustomerClassificationOutput)
+async def predict_purchase_customer(fk_contact: str, version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para predição de recompra a partir apenas do fk_contact
+    
+    As 25 features do cliente vêm do feature store local
+    """
+    input_data, generation = customer_input("classification", fk_contact, ClassificationInput)
+    try:
+        output = await cached_prediction(
+            "classification", input_data, version,
+            lambda: inference_executors["classification"].run(predict_purchase_sync, input_data, version)
+        )
+    except Exception as e:
+        logger.error(f"Erro na predição de classificação do cliente {fk_contact}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro na predição: {str(e)}")
+    return CustomerClassificationOutput(**output.dict(), fk_contact=fk_contact, feature_store_generation=generation)
+
+@app.post("/customers/purchases", response_model=PurchaseEventsOutput, dependencies=[Depends(require_admin_endpoint)])
+async def ingest_purchases(payload: PurchaseEventsInput):
+    """
+    Aplica compras novas às agregações por cliente (O(1) por evento)
+    As features dos clientes afetados ficam disponíveis na hora para os endpoints
+    /<modelo>/customer/{fk_contact} deste processo; clientes que já estão no feature store
+    seguem com as features do store (o estado incremental não tem o histórico deles)
+    Recusada (409) com vários workers: use a ingestão em lote (customer_aggregates.py)
+    Recusada (503) enquanto o feature store existe no disco mas não está aberto: sem ele não
+    dá para saber quais clientes já têm histórico
+    """
+    if SERVER_WORKERS > 1:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Ingestão por HTTP indisponível com {SERVER_WORKERS} workers (cada um teria um estado "
+                   f"diferente); use customer_aggregates.py --publish"
+        )
+    if feature_store.current is None and feature_store.active_generation() is not None:
+        raise HTTPException(status_code=503, detail="Feature store ainda não carregado; tente novamente",
+                            headers={"Retry-After": "1"})
+    accepted, errors = await asyncio.get_running_loop().run_in_executor(
+        None, customer_aggregator.ingest, payload.events, stored_customer
+    )
+    return PurchaseEventsOutput(
+        accepted=accepted,
+        customers=len(customer_aggregator),
+        errors=[BatchItemError(index=index, detail=detail) for index, detail in errors]
+    )
+
 @app.post("/recommendation", response_model=RecommendationOutput)
-async def recommend_routes(input_data: RecommendationInput):
+async def recommend_routes(input_data: RecommendationInput,
+                           response: Response,
+                           top_k: int = Query(DEFAULT_TOP_K, ge=1, le=MAX_TOP_K, description="Quantidade de rotas recomendadas"),
+                           version: str = Depends(pinned_model_version)):
     """
     Endpoint para recomendação de rotas
     
     Recebe dados da viagem atual e retorna top 3 rotas recomendadas
+    (ou as top k em `top_routes` quando `top_k` é informado, ex.: 5 ou 10)
+    Sob sobrecarga (modo degradado habilitado), responde com as rotas populares do
+    cluster/origem sem rodar o modelo; a resposta traz o header X-Degraded
     """
+    reason = degraded_reason()
+    if reason is not None:
+        # Só usa um modelo já em memória: carregar do disco aqui travaria o event loop
+        popular = model_registry.loaded(version).get("recommendation", {}).get("popular_routes")
+        if popular is None:
+            raise HTTPException(status_code=503, detail="Endpoint sobrecarregado e sem rotas populares para o modo degradado",
+                                headers={"Retry-After": "1"})
+        response.headers[DEGRADED_HEADER] = f"popular-routes; reason={reason}"
+        return popular_routes_output(popular, input_data, top_k)
     try:
-        # Carregar modelos
-        models = load_model("recommendation")
-        model = models["model"]
-        label_encoder = models["label_encoder"]
-        feature_encoders = models["feature_encoders"]
-        
-        # Preparar dados de entrada
-        data_dict = input_data.dict()
-        
-        # Processar features de data/hora
-        datetime_features = process_datetime_features(
-            data_dict["date_purchase"], 
-            data_dict["time_purchase"]
-        )
-        data_dict.update(datetime_features)
-        
-        # Adicionar features de metadata que podem estar faltando
-        if 'data_clusterizacao' not in data_dict:
-            data_dict['data_clusterizacao'] = datetime.now().strftime('%Y-%m-%d')
-        if 'versao_modelo' not in data_dict:
-            data_dict['versao_modelo'] = 'XGBoost_v1.0'
-        
-        # Aplicar encoders para features categóricas
-        for col, encoder in feature_encoders.items():
-            if col in data_dict:
-                try:
-                    # Converter para string e aplicar encoder
-                    str_value = str(data_dict[col])
-                    if hasattr(encoder, 'classes_') and str_value in encoder.classes_:
-                        data_dict[col] = int(encoder.transform([str_value])[0])  # Garantir int
-                    else:
-                        # Se valor não existe no encoder, usar valor padrão
-                        data_dict[col] = 0
-                except Exception as e:
-                    logger.warning(f"Erro ao codificar {col}: {e}. Usando valor padrão.")
-                    data_dict[col] = 0
-        
-        # Forçar conversão de campos específicos que podem ser problemáticos
-        # XGBoost requer que todas as features sejam numéricas
-        # Campos categóricos já foram processados pelos encoders
-        problem_fields = {
-            'fk_contact': str,
-            'place_origin_return': str, 
-            'place_destination_return': str,
-            'fk_return_ota_bus_company': str,
-            'date_purchase': str,
-            'time_purchase': str,
-            'data_clusterizacao': str,
-            'versao_modelo': str
-        }
-        
-        for field, expected_type in problem_fields.items():
-            if field in data_dict:
-                try:
-                    # Se é string, tentar converter para hash numérico ou valor padrão
-                    if isinstance(data_dict[field], str):
-                        if field in ['place_origin_return', 'place_destination_return']:
-                            # Estes geralmente são "0" como string
-                            data_dict[field] = 0 if data_dict[field] == "0" else hash(data_dict[field]) % 10000
-                        elif field == 'fk_return_ota_bus_company':
-                            # Geralmente "1" como string
-                            data_dict[field] = 1 if data_dict[field] == "1" else int(pd.to_numeric(data_dict[field], errors='coerce'))
-                        elif field in ['data_clusterizacao', 'versao_modelo']:
-                            # Para campos de metadata, usar hash consistente
-                            data_dict[field] = abs(hash(data_dict[field])) % 10000
-                        else:
-                            # Para outros campos string, usar hash
-                            data_dict[field] = abs(hash(data_dict[field])) % 100000
-                    else:
-                        # Se já é numérico, garantir que é int
-                        data_dict[field] = int(pd.to_numeric(data_dict[field], errors='coerce'))
-                except:
-                    data_dict[field] = 0
-        
-        # Converter para DataFrame
-        df = pd.DataFrame([data_dict])
-        
-        # Garantir que todas as features necessárias estão presentes
-        required_features = [
-            'fk_contact', 'date_purchase', 'time_purchase', 'place_origin_departure',
-            'place_destination_departure', 'place_origin_return', 'place_destination_return',
-            'fk_departure_ota_bus_company', 'fk_return_ota_bus_company', 'gmv_success',
-            'total_tickets_quantity_success', 'day_of_week', 'month', 'quarter',
-            'is_weekend', 'hour', 'period_of_day', 'route_departure', 'route_return',
-            'is_round_trip', 'departure_company_freq', 'return_company_freq',
-            'origin_dept_freq', 'dest_dept_freq', 'route_departure_freq', 'cluster',
-            'data_clusterizacao', 'versao_modelo'
-        ]
-        
-        for feature in required_features:
-            if feature not in df.columns:
-                # Adicionar valores padrão apropriados para as features faltantes
-                if feature == 'data_clusterizacao':
-                    # Data de clusterização - usar data atual formatada
-                    df[feature] = datetime.now().strftime('%Y-%m-%d')
-                elif feature == 'versao_modelo':
-                    # Versão do modelo - usar valor padrão
-                    df[feature] = 'XGBoost_v1.0'
-                else:
-                    df[feature] = 0
-        
-        # Converter colunas object para numeric para XGBoost
-        object_columns = ['fk_contact', 'place_origin_return', 'place_destination_return', 
-                         'fk_return_ota_bus_company', 'data_clusterizacao', 'versao_modelo']
-        
-        for col in object_columns:
-            if col in df.columns:
-                # Converter object para numeric
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-        
-        # Garantir que todas as colunas são numéricas
-        for col in required_features:
-            if col in df.columns:
-                if df[col].dtype == 'object':
-                    logger.warning(f"Convertendo coluna {col} de object para numeric")
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-        
-        # Debug: verificar tipos das colunas
-        object_cols = [col for col in df[required_features].columns if df[col].dtype == 'object']
-        if object_cols:
-            logger.error(f"Colunas ainda em object: {object_cols}")
-            # Forçar conversão final
-            for col in object_cols:
-                df[col] = 0  # Valor padrão seguro
-        
-        # Fazer predição - obter probabilidades para todas as rotas possíveis
-        probabilities = model.predict_proba(df[required_features])[0]
-        
-        # Obter top 3 rotas com maior probabilidade
-        # Ordenação decrescente das probabilidades
-        top_3_indices = np.argsort(probabilities)[-3:][::-1]
-        
-        # Converter índices de volta para rotas originais usando label encoder
-        top_3_routes = []
-        for i, idx in enumerate(top_3_indices):
-            route_encoded = label_encoder.inverse_transform([idx])[0]
-            
-            # Tentar decodificar a rota usando o encoder de features
-            route_original = route_encoded
-            if "route_departure" in feature_encoders:
-                try:
-                    route_original = feature_encoders["route_departure"].inverse_transform([route_encoded])[0]
-                except:
-                    route_original = str(route_encoded)
-            
-            top_3_routes.append({
-                "rank": i + 1,
-                "route": str(route_original),
-                "probability": float(probabilities[idx]),
-                "confidence": float(probabilities[idx] * 100)
-            })
-        
-        return RecommendationOutput(
-            top_3_routes=top_3_routes,
-            user_cluster=int(input_data.cluster)
-        )
-        
+        if recommendation_batcher is not None:
+            # Requisições concorrentes são agrupadas em um único predict_proba
+            with stage("microbatch"):
+                return await recommendation_batcher.submit((input_data, top_k, version))
+        return await inference_executors["recommendation"].run(recommend_routes_sync, input_data, top_k, version)
+    except MissingFeatureError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Erro na recomendação: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro na recomendação: {str(e)}")
 
+@app.post("/recommendation/batch", response_model=RecommendationBatchOutput)
+async def recommend_routes_batch(batch: RecommendationBatchInput,
+                                 top_k: int = Query(DEFAULT_TOP_K, ge=1, le=MAX_TOP_K, description="Quantidade de rotas recomendadas"),
+                                 version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para recomendação de rotas em lote (layout colunar)
+    
+    Os registros válidos formam uma única matriz e o XGBoost é chamado
+    uma única vez para o lote inteiro.
+    """
+    try:
+        return await inference_executors["recommendation"].run(recommend_routes_batch_sync, batch, top_k, version)
+    except Exception as e:
+        logger.error(f"Erro na recomendação em lote: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro na recomendação: {str(e)}")
+
+async def score_arrow(model_type: str, request: Request, version: str, top_k: int = DEFAULT_TOP_K) -> Response:
+    """Corpo comum dos endpoints /arrow: lê o corpo binário e pontua no pool do modelo"""
+    if not arrow_io.arrow_available():
+        raise HTTPException(status_code=501, detail="Entrada Arrow indisponível: pyarrow não está instalado")
+    body = await request.body()
+    try:
+        content = await inference_executors[model_type].run(score_arrow_sync, model_type, body, version, top_k)
+    except arrow_io.ArrowInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erro na pontuação Arrow ({model_type}): {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro na predição: {str(e)}")
+    return Response(content=content, media_type=arrow_io.ARROW_STREAM_MEDIA_TYPE)
+
+@app.post("/clusterization/arrow", response_class=Response, openapi_extra=arrow_io.ARROW_REQUEST_BODY)
+async def predict_cluster_arrow(request: Request, version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para predição de cluster em massa (Arrow IPC ou Parquet)
+    
+    Colunas de entrada iguais às de ClusterizationInput; responde um stream Arrow IPC
+    com `cluster`, `confidence` e `error` (uma linha por registro de entrada).
+    """
+    return await score_arrow("clusterization", request, version)
+
+@app.post("/classification/arrow", response_class=Response, openapi_extra=arrow_io.ARROW_REQUEST_BODY)
+async def predict_purchase_arrow(request: Request, version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para predição de recompra em massa (Arrow IPC ou Parquet)
+    
+    Colunas de entrada iguais às de ClassificationInput; responde um stream Arrow IPC
+    com `will_purchase`, `probability`, `risk_category` e `error`.
+    """
+    return await score_arrow("classification", request, version)
+
+@app.post("/recommendation/arrow", response_class=Response, openapi_extra=arrow_io.ARROW_REQUEST_BODY)
+async def recommend_routes_arrow(request: Request,
+                                 top_k: int = Query(DEFAULT_TOP_K, ge=1, le=MAX_TOP_K, description="Quantidade de rotas recomendadas"),
+                                 version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para recomendação de rotas em massa (Arrow IPC ou Parquet)
+    
+    Colunas de entrada iguais às de RecommendationInput; responde um stream Arrow IPC
+    com `user_cluster`, `route_1..k`, `probability_1..k` e `error`.
+    """
+    return await score_arrow("recommendation", request, version, top_k)
+
+def stream_predictions(model_type: str, request: Request, version: str, top_k: int = DEFAULT_TOP_K) -> Response:
+    """
+    Corpo comum dos endpoints /stream: lê o NDJSON em blocos e devolve cada bloco
+    pontuado assim que fica pronto. A última linha resume o stream (`count`, `errors`);
+    uma falha que interrompe o stream é sinalizada por uma linha com `fatal: true`
+    """
+    async def lines():
+        count = failed = 0
+        try:
+            async for chunk in ndjson_stream.ndjson_chunks(request.stream()):
+                output, chunk_failed = await inference_executors[model_type].run(
+                    score_stream_chunk_sync, model_type, chunk, top_k, version
+                )
+                count += len(chunk)
+                failed += chunk_failed
+                # Só volta a ler o corpo quando o servidor aceitar estas linhas (contrapressão)
+                yield output
+        except ClientDisconnect:
+            raise
+        except ndjson_stream.StreamInputError as e:
+            yield ndjson_stream.ndjson_line({"error": str(e), "fatal": True})
+            return
+        except Exception as e:
+            logger.error(f"Erro na pontuação em streaming ({model_type}): {str(e)}")
+            yield ndjson_stream.ndjson_line({"error": f"Erro na predição: {str(e)}", "fatal": True})
+            return
+        yield ndjson_stream.ndjson_line({"count": count, "errors": failed})
+
+    return ndjson_stream.NDJSONStreamingResponse(lines())
+
+@app.post("/clusterization/stream", response_class=ndjson_stream.NDJSONStreamingResponse,
+          openapi_extra=ndjson_stream.NDJSON_REQUEST_BODY)
+async def predict_cluster_stream(request: Request, version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para predição de cluster em streaming (NDJSON)
+    
+    Um ClusterizationInput por linha; responde uma linha por registro, na ordem de
+    entrada: {"index": i, "result": {...}} ou {"index": i, "error": "..."}.
+    """
+    return stream_predictions("clusterization", request, version)
+
+@app.post("/classification/stream", response_class=ndjson_stream.NDJSONStreamingResponse,
+          openapi_extra=ndjson_stream.NDJSON_REQUEST_BODY)
+async def predict_purchase_stream(request: Request, version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para predição de recompra em streaming (NDJSON)
+    
+    Um ClassificationInput por linha; responde uma linha por registro, na ordem de entrada.
+    """
+    return stream_predictions("classification", request, version)
+
+@app.post("/recommendation/stream", response_class=ndjson_stream.NDJSONStreamingResponse,
+          openapi_extra=ndjson_stream.NDJSON_REQUEST_BODY)
+async def recommend_routes_stream(request: Request,
+                                  top_k: int = Query(DEFAULT_TOP_K, ge=1, le=MAX_TOP_K, description="Quantidade de rotas recomendadas"),
+                                  version: str = Depends(pinned_model_version)):
+    """
+    Endpoint para recomendação de rotas em streaming (NDJSON)
+    
+    Um RecommendationInput por linha; responde uma linha por registro, na ordem de entrada.
+    """
+    return stream_predictions("recommendation", request, version, top_k)
+
+# ============================================================================
+# VERSÕES DOS MODELOS
+# ============================================================================
+
+@app.get("/models")
+async def list_model_versions():
+    """Versões disponíveis em artefacts/, versão ativa e estado da última troca"""
+    return model_registry.status()
+
+@app.post("/models/reload", status_code=202, dependencies=[Depends(require_admin_token)])
+async def reload_models(background_tasks: BackgroundTasks,
+                        version: Optional[str] = Query(None, description="Versão a ativar (padrão: a mais recente)")):
+    """
+    Carrega uma versão em segundo plano, executa o warm-up e a torna ativa
+    Até a troca, a versão atual continua atendendo normalmente
+    """
+    available = model_registry.discover()
+    target = version or (available[-1] if available else None)
+    if target not in available:
+        raise HTTPException(status_code=404, detail=f"Versão de modelo desconhecida: {target}")
+    if model_registry.reloading:
+        raise HTTPException(status_code=409, detail="Já existe uma troca de versão em andamento")
+
+    background_tasks.add_task(activate_model_version, target)
+    return {"status": "loading", "version": target, "active_version": model_registry.active_version}
+
+def activate_model_version(version: str):
+    """Ativa uma versão registrando falhas (executado fora do event loop)"""
+    try:
+        model_registry.activate(version)
+    except Exception as e:
+        logger.error(f"Troca para a versão {version} não concluída: {e}")
+
+async def watch_model_versions():
+    """Ativa automaticamente novas versões publicadas em artefacts/"""
+    failed = set()
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        available = model_registry.discover()
+        if not available:
+            continue
+        newest = available[-1]
+        if newest == model_registry.active_version or newest in failed or model_registry.reloading:
+            continue
+        logger.info(f"Nova versão de modelos encontrada: {newest}")
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, model_registry.activate, newest)
+        except Exception:
+            # Não tenta novamente a mesma versão até um reload manual
+            failed.add(newest)
+
+async def watch_feature_store():
+    """Ativa novas gerações do feature store publicadas pelo feature_store.py"""
+    while True:
+        await asyncio.sleep(FEATURE_STORE_REFRESH_INTERVAL)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, feature_store.refresh)
+        except Exception as e:
+            logger.error(f"Erro ao atualizar o feature store: {e}")
+
+# ============================================================================
+# ENDPOINTS DE DIAGNÓSTICO
+# ============================================================================
+
+def profile_response(stacks, output_format: str, skip: int, summary: Dict[str, Any]):
+    """Perfil em collapsed stacks (texto, para flamegraph) ou resumo JSON com as funções mais amostradas"""
+    if output_format == "collapsed":
+        return PlainTextResponse(collapsed(stacks))
+    return {**summary, "top_functions": top_functions(stacks, skip=skip), "collapsed": collapsed(stacks)}
+
+@app.get("/debug/profile", dependencies=[Depends(require_admin_endpoint)])
+async def profile_worker(seconds: float = Query(10.0, gt=0, description="Duração da amostragem"),
+                         interval_ms: float = Query(DEFAULT_INTERVAL * 1000, ge=1, le=1000, description="Intervalo entre amostras"),
+                         format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+                         include_idle: bool = Query(False, description="Incluir threads ociosas (esperando trabalho)")):
+    """
+    Amostra as pilhas de todas as threads deste worker por `seconds` e devolve o perfil
+    Com vários workers, cada chamada perfila apenas o worker que a atendeu
+    """
+    if seconds > MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Duração máxima do perfil: {MAX_PROFILE_SECONDS:g}s")
+    try:
+        profile = profiler_control.start_window(seconds, interval_ms / 1000, include_idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # A amostragem roda na sua própria thread; o event loop segue atendendo (e aparece no perfil)
+    await asyncio.sleep(seconds)
+    await asyncio.get_running_loop().run_in_executor(None, profile.stop)
+
+    stacks = profile.snapshot()
+    return profile_response(stacks, format, 1, {
+        "pid": os.getpid(),
+        "seconds": seconds,
+        "interval_ms": interval_ms,
+        "samples": profile.samples,
+        "stacks": len(stacks)
+    })
+
+@app.post("/debug/profile/slow", status_code=202, dependencies=[Depends(require_admin_endpoint)])
+async def start_slow_request_profile(threshold_ms: float = Query(500.0, gt=0, description="Latência a partir da qual a requisição é capturada"),
+                                     seconds: float = Query(60.0, gt=0, description="Duração da captura"),
+                                     interval_ms: float = Query(DEFAULT_INTERVAL * 1000, ge=1, le=1000)):
+    """
+    Amostra continuamente por `seconds` e agrega só o intervalo das requisições mais lentas
+    que `threshold_ms` (substitui uma captura anterior); resultado em GET /debug/profile/slow
+    """
+    if seconds > MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Duração máxima do perfil: {MAX_PROFILE_SECONDS:g}s")
+    profiler_control.start_slow(threshold_ms / 1000, seconds, interval_ms / 1000)
+    return profiler_control.status()["slow_requests"]
+
+@app.get("/debug/profile/slow", dependencies=[Depends(require_admin_endpoint)])
+async def slow_request_profile(format: str = Query("collapsed", pattern="^(collapsed|json)$")):
+    """Perfil agregado das requisições lentas capturadas (pilhas prefixadas pelo endpoint)"""
+    profile = profiler_control.slow
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Nenhuma captura de requisições lentas iniciada")
+    return profile_response(profile.snapshot(), format, 2, {
+        "pid": os.getpid(),
+        **profiler_control.status()["slow_requests"]
+    })
+
+@app.delete("/debug/profile/slow", dependencies=[Depends(require_admin_endpoint)])
+async def stop_slow_request_profile():
+    """Encerra a captura de requisições lentas antes do prazo (o resultado continua disponível)"""
+    if profiler_control.slow is not None and profiler_control.slow.running:
+        await asyncio.get_running_loop().run_in_executor(None, profiler_control.slow.stop)
+    return profiler_control.status()
+
+def models_memory() -> Dict[str, Any]:
+    """Tamanho retido de cada modelo em cache, por versão (percorre os objetos: fora do event loop)"""
+    return {
+        version: {model_type: bundle_memory(bundle) for model_type, bundle in model_registry.loaded(version).items()}
+        for version in model_registry.status()["loaded"]
+    }
+
+@app.get("/debug/memory", dependencies=[Depends(require_admin_endpoint)])
+async def memory_report():
+    """
+    Memória do worker: RSS/PSS do processo, tamanho aproximado de cada modelo e encoder
+    em cache, coletas do GC por geração e estado do tracemalloc
+    """
+    loop = asyncio.get_running_loop()
+    models_mb = await loop.run_in_executor(None, models_memory)
+    gc_stats = await loop.run_in_executor(None, gc_monitor.stats)
+    return {
+        "pid": os.getpid(),
+        "process_mb": process_memory(),
+        "models": models_mb,
+        "gc": gc_stats,
+        "tracemalloc": allocation_tracker.status()
+    }
+
+@app.post("/debug/memory/allocations", dependencies=[Depends(require_admin_endpoint)])
+async def start_allocation_tracking(frames: int = Query(1, ge=1, le=50, description="Quadros guardados por alocação")):
+    """
+    Liga o tracemalloc e tira o snapshot de referência (uma nova chamada o substitui)
+    O rastreamento deixa as alocações mais lentas: desligar com DELETE ao terminar
+    """
+    await asyncio.get_running_loop().run_in_executor(None, allocation_tracker.start, frames)
+    return allocation_tracker.status()
+
+@app.get("/debug/memory/allocations", dependencies=[Depends(require_admin_endpoint)])
+async def allocation_diff(limit: int = Query(25, ge=1, le=500),
+                          group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$")):
+    """Maiores crescimentos de memória por local de alocação desde o snapshot de referência"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, allocation_tracker.compare, limit, group_by)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.delete("/debug/memory/allocations", dependencies=[Depends(require_admin_endpoint)])
+async def stop_allocation_tracking():
+    """Desliga o tracemalloc e descarta o snapshot de referência"""
+    allocation_tracker.stop()
+    return allocation_tracker.status()
+
 # ============================================================================
 # ENDPOINT DE SAÚDE
 # ============================================================================
@@ -676,21 +2216,9 @@ async def recommend_routes(input_data: RecommendationInput):
 async def health_check():
     """Endpoint para verificar a saúde da API"""
     try:
-        # Verificar se os arquivos de modelo existem
-        model_status = {}
-        
-        # Verificar clusterização
-        model_status["clusterization"] = os.path.exists(MODEL_PATHS["clusterization"])
-        
-        # Verificar classificação
-        model_status["classification"] = os.path.exists(MODEL_PATHS["classification"])
-        
-        # Verificar recomendação
-        model_status["recommendation"] = all([
-            os.path.exists(MODEL_PATHS["recommendation"]["model"]),
-            os.path.exists(MODEL_PATHS["recommendation"]["label_encoder"]),
-            os.path.exists(MODEL_PATHS["recommendation"]["feature_encoders"])
-        ])
+        # Verificar se os arquivos de modelo da versão ativa existem
+        model_status = artefacts_status(model_registry.paths())
+        loaded_models = model_registry.loaded()
         
         all_healthy = all(model_status.values())
         
@@ -699,8 +2227,36 @@ async def health_check():
             "timestamp": datetime.now().isoformat(),
             "models": model_status,
             "cache_status": {
-                "loaded_models": list(model_cache.keys()),
-                "cache_size": len(model_cache)
+                "loaded_models": list(loaded_models.keys()),
+                "cache_size": len(loaded_models)
+            },
+            "model_registry": model_registry.status(),
+            "tree_backends": {
+                model_type: bundle["tree_backend"].describe()
+                for model_type, bundle in loaded_models.items() if "tree_backend" in bundle
+            },
+            "feature_plans": {
+                model_type: bundle["feature_plan"].describe()
+                for model_type, bundle in loaded_models.items() if "feature_plan" in bundle
+            },
+            "feature_store": feature_store.describe(),
+            "admission": {name: controller.stats() for name, controller in sorted(admission_controllers.items())},
+            "binary_protocol": binary_server.stats() if binary_server.server is not None else None,
+            "customer_aggregates": customer_aggregator.stats(),
+            "inference_executors": {
+                model_type: executor.stats() for model_type, executor in inference_executors.items()
+            },
+            "micro_batching": {
+                "recommendation": recommendation_batcher.stats() if recommendation_batcher is not None else None
+            },
+            "prediction_cache": {
+                endpoint: cache.stats() if cache is not None else None
+                for endpoint, cache in prediction_caches.items()
+            },
+            # Memória do worker que atendeu (com prefork.py, PSS < RSS indica modelos compartilhados)
+            "worker": {
+                "pid": os.getpid(),
+                "memory_mb": process_memory()
             }
         }
         
@@ -711,34 +2267,127 @@ async def health_check():
             "timestamp": datetime.now().isoformat()
         }
 
+@app.get("/startup")
+async def startup_check():
+    """
+    Relatório de inicialização do worker: marcos (segundos desde o início do processo),
+    imports mais lentos e tempo de carga de cada artefato
+    Os imports feitos durante o unpickling trazem o artefato que os disparou (`during`)
+    """
+    return startup_report.report()
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 200 apenas quando os modelos da versão ativa estão carregados e aquecidos
+    Diferente do /health (liveness), retorna 503 durante a pré-carga
+    """
+    ready = model_registry.ready()
+    status = model_registry.status()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "active_version": status["active_version"],
+            "warm_models": status["warm"].get(status["active_version"], []),
+            "preload_errors": preload_errors,
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Métricas no formato texto do Prometheus
+    Latência por endpoint e por etapa, requisições em andamento, estado dos modelos,
+    dos pools de inferência, do micro-batching e do cache de resultados
+    """
+    registry_status = model_registry.status()
+    executor_stats = {model_type: executor.stats() for model_type, executor in inference_executors.items()}
+    cache_stats = {endpoint: cache.stats() for endpoint, cache in prediction_caches.items() if cache is not None}
+    batcher_stats = {"recommendation": recommendation_batcher.stats()} if recommendation_batcher is not None else {}
+
+    families = [
+        metric_family("ml_api_model_active", "gauge", "Versão ativa dos modelos",
+                      [({"version": registry_status["active_version"]}, 1)]),
+        metric_family("ml_api_model_loaded", "gauge", "Modelos carregados em memória por versão",
+                      [({"version": version, "model": model_type}, 1)
+                       for version, models in registry_status["loaded"].items() for model_type in models]),
+        metric_family("ml_api_model_warm", "gauge", "Modelos aquecidos por versão",
+                      [({"version": version, "model": model_type}, 1)
+                       for version, models in registry_status["warm"].items() for model_type in models]),
+        metric_family("ml_api_model_load_seconds", "gauge", "Tempo de carga de cada modelo",
+                      [({"version": version, "model": model_type}, seconds)
+                       for version, models in registry_status["load_seconds"].items()
+                       for model_type, seconds in models.items()]),
+        metric_family("ml_api_inference_queue_depth", "gauge", "Chamadas aguardando no pool de inferência",
+                      [({"model": model_type}, stats["queue_depth"]) for model_type, stats in executor_stats.items()]),
+        metric_family("ml_api_inference_running", "gauge", "Chamadas em execução no pool de inferência",
+                      [({"model": model_type}, stats["running"]) for model_type, stats in executor_stats.items()]),
+        metric_family("ml_api_inference_completed_total", "counter", "Chamadas concluídas no pool de inferência",
+                      [({"model": model_type}, stats["completed"]) for model_type, stats in executor_stats.items()]),
+        metric_family("ml_api_inference_failed_total", "counter", "Chamadas com falha no pool de inferência",
+                      [({"model": model_type}, stats["failed"]) for model_type, stats in executor_stats.items()]),
+        metric_family("ml_api_microbatch_batches_total", "counter", "Lotes despachados pelo micro-batcher",
+                      [({"endpoint": endpoint}, stats["batches"]) for endpoint, stats in batcher_stats.items()]),
+        metric_family("ml_api_microbatch_items_total", "counter", "Requisições agrupadas pelo micro-batcher",
+                      [({"endpoint": endpoint}, stats["items"]) for endpoint, stats in batcher_stats.items()]),
+        metric_family("ml_api_prediction_cache_entries", "gauge", "Resultados no cache de predições",
+                      [({"endpoint": endpoint}, stats["entries"]) for endpoint, stats in cache_stats.items()])
+    ]
+    for counter in ("hits", "misses", "coalesced", "evictions", "expirations"):
+        families.append(metric_family(
+            f"ml_api_prediction_cache_{counter}_total", "counter", f"Cache de predições: {counter}",
+            [({"endpoint": endpoint}, stats[counter]) for endpoint, stats in cache_stats.items()]
+        ))
+    families.extend(admission_families(admission_controllers))
+
+    return PlainTextResponse(render_metrics(families), media_type="text/plain; version=0.0.4")
+
 # ============================================================================
 # INICIALIZAÇÃO
 # ============================================================================
 
+# Erros da última pré-carga por modelo (expostos no /ready)
+preload_errors: Dict[str, str] = {}
+
+async def preload_models():
+    """
+    Carrega e aquece os três modelos da versão ativa, cada um no seu pool de inferência
+    O unpickling dos artefatos é serial (_unpickle_lock); só a pré-compilação das
+    estruturas de inferência e o warm-up rodam em paralelo. A carga é single-flight,
+    então uma requisição que chegue antes aguarda a mesma leitura do disco
+    """
+    version = model_registry.active_version
+    logger.info(f"Pré-carregando modelos da versão {version}...")
+    started = time.perf_counter()
+
+    results = await asyncio.gather(
+        *(inference_executors[model_type].run(model_registry.prepare, model_type, version) for model_type in MODEL_TYPES),
+        return_exceptions=True
+    )
+    for model_type, result in zip(MODEL_TYPES, results):
+        if isinstance(result, Exception):
+            preload_errors[model_type] = str(result)
+            logger.error(f"✗ Erro ao carregar modelo {model_type}: {result}")
+        else:
+            preload_errors.pop(model_type, None)
+            logger.info(f"✓ Modelo {model_type} carregado e aquecido")
+    logger.info(f"Pré-carga concluída em {time.perf_counter() - started:.2f}s")
+    startup_report.milestone("models_ready")
+    logger.info(startup_report.summary())
+    # Inicialização concluída: os imports seguintes (dentro de funções) não passam mais pela medição
+    startup_report.uninstall()
+
+# Fim do import do módulo (marco do relatório de inicialização)
+startup_report.milestone("main_imported")
+
 if __name__ == "__main__":
     import uvicorn
     
-    # Pré-carregar modelos para melhor performance (warm-up)
-    # Evita latência na primeira requisição de cada modelo
-    logger.info("Iniciando API e pré-carregando modelos...")
-    
-    try:
-        load_model("clusterization")
-        logger.info("✓ Modelo de clusterização carregado")
-    except Exception as e:
-        logger.error(f"✗ Erro ao carregar modelo de clusterização: {e}")
-    
-    try:
-        load_model("classification")
-        logger.info("✓ Modelo de classificação carregado")
-    except Exception as e:
-        logger.error(f"✗ Erro ao carregar modelo de classificação: {e}")
-    
-    try:
-        load_model("recommendation")
-        logger.info("✓ Modelo de recomendação carregado")
-    except Exception as e:
-        logger.error(f"✗ Erro ao carregar modelo de recomendação: {e}")
+    # A pré-carga e o warm-up dos modelos rodam no lifespan da aplicação,
+    # tanto aqui quanto com `uvicorn main:app` (Docker)
+    logger.info("Iniciando API...")
     
     # Iniciar servidor
     uvicorn.run(app, host="0.0.0.0", port=3021)
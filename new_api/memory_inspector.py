@@ -0,0 +1,249 @@
+"""
+Inspeção de memória do worker
+
+- Tamanho retido aproximado de cada modelo em cache: percorre o grafo de objetos a
+  partir de cada entrada do bundle (sys.getsizeof + gc.get_referents), contando cada
+  objeto uma única vez. Memória nativa que o Python não enxerga é estimada à parte:
+  árvores do sklearn pelos arrays de nós/valores e o booster do XGBoost pelo tamanho
+  do modelo serializado (save_raw).
+- Maiores alocações entre dois snapshots do tracemalloc (ligado sob demanda: o
+  rastreamento custa CPU e memória em toda alocação).
+- Coletas do GC por geração, com objetos coletados e tempo de pausa.
+
+Os tamanhos são aproximados (alocador, fragmentação e páginas compartilhadas entre
+workers não entram) e servem para comparar entradas e acompanhar crescimento.
+"""
+
+import gc
+import sys
+import threading
+import time
+import tracemalloc
+from types import BuiltinFunctionType, CodeType, FunctionType, ModuleType
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+# Objetos compartilhados por todo o processo: não pertencem a um modelo
+_SKIP_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType, CodeType)
+
+def _native_size(obj: Any) -> int:
+    """Memória fora do heap do Python de objetos conhecidos (0 para os demais)"""
+    cls = type(obj)
+    module = cls.__module__ or ""
+    if module.startswith("xgboost") and cls.__name__ == "Booster":
+        # O booster vive no C++ do XGBoost; o modelo serializado é uma boa aproximação
+        try:
+            return len(obj.save_raw("ubj"))
+        except Exception:
+            return 0
+    if module.startswith("sklearn.tree") and cls.__name__ == "Tree":
+        # Os arrays de nós e valores do __getstate__ são vistas da memória da própria árvore
+        try:
+            return sum(value.nbytes for value in obj.__getstate__().values() if isinstance(value, np.ndarray))
+        except Exception:
+            return 0
+    return 0
+
+def retained_size(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Bytes alcançáveis a partir de `obj` e ainda não contados em `seen`
+    (compartilhar `seen` entre chamadas evita contar duas vezes objetos em comum)
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    pending = [obj]
+    while pending:
+        current = pending.pop()
+        if id(current) in seen or isinstance(current, _SKIP_TYPES):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current, 0) + _native_size(current)
+        if isinstance(current, np.ndarray):
+            if current.dtype == object:
+                # Elementos de arrays de objetos (classes_ de encoders de texto)
+                pending.extend(current.ravel().tolist())
+            elif current.base is not None and not current.flags.owndata:
+                # Vista: os dados pertencem à base
+                pending.append(current.base)
+            continue
+        pending.extend(gc.get_referents(current))
+    return total
+
+def _mb(size: int) -> float:
+    return round(size / (1024 * 1024), 3)
+
+def _encoders(bundle: Dict[str, Any]) -> Dict[str, Any]:
+    """Encoders (objetos com classes_) no bundle ou em dicionários de primeiro nível"""
+    encoders = {}
+    for key, value in bundle.items():
+        if hasattr(value, "classes_"):
+            encoders[key] = value
+        elif isinstance(value, dict):
+            encoders.update({f"{key}.{name}": item for name, item in value.items() if hasattr(item, "classes_")})
+    return encoders
+
+def bundle_memory(bundle: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Tamanho retido de cada entrada de um modelo em cache
+    Objetos referenciados por mais de uma entrada (o backend de árvores aponta para o
+    modelo, o plano de features para as tabelas de consulta) ficam com a primeira entrada
+    em ordem de carga; `total_mb` não conta nada duas vezes
+    """
+    seen: Set[int] = set()
+    entries = {key: retained_size(value, seen) for key, value in bundle.items()}
+    encoders = {}
+    for name, encoder in _encoders(bundle).items():
+        classes = np.asarray(encoder.classes_)
+        encoders[name] = {"classes": int(classes.size), "classes_mb": _mb(retained_size(classes))}
+    return {
+        "total_mb": _mb(sum(entries.values())),
+        "entries_mb": {key: _mb(size) for key, size in entries.items()},
+        "encoders": encoders
+    }
+
+# ============================================================================
+# GC
+# ============================================================================
+
+class GCMonitor:
+    """Coletas, objetos coletados e pausas por geração (via gc.callbacks)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[int, float] = {}
+        self.collections = [0, 0, 0]
+        self.collected = [0, 0, 0]
+        self.uncollectable = [0, 0, 0]
+        self.pause_seconds = [0.0, 0.0, 0.0]
+        self.max_pause_seconds = [0.0, 0.0, 0.0]
+
+    def install(self):
+        if self._callback not in gc.callbacks:
+            gc.callbacks.append(self._callback)
+
+    def uninstall(self):
+        if self._callback in gc.callbacks:
+            gc.callbacks.remove(self._callback)
+
+    def _callback(self, phase: str, info: Dict[str, int]):
+        # O GC roda na thread que disparou a coleta; indexado pela thread
+        ident = threading.get_ident()
+        if phase == "start":
+            self._started[ident] = time.perf_counter()
+            return
+        started = self._started.pop(ident, None)
+        generation = info["generation"]
+        with self._lock:
+            self.collections[generation] += 1
+            self.collected[generation] += info["collected"]
+            self.uncollectable[generation] += info["uncollectable"]
+            if started is not None:
+                pause = time.perf_counter() - started
+                self.pause_seconds[generation] += pause
+                self.max_pause_seconds[generation] = max(self.max_pause_seconds[generation], pause)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            generations = [
+                {
+                    "generation": generation,
+                    "collections": self.collections[generation],
+                    "collected": self.collected[generation],
+                    "uncollectable": self.uncollectable[generation],
+                    "pause_total_ms": round(self.pause_seconds[generation] * 1000, 3),
+                    "pause_max_ms": round(self.max_pause_seconds[generation] * 1000, 3)
+                }
+                for generation in range(3)
+            ]
+        return {
+            "enabled": gc.isenabled(),
+            "threshold": gc.get_threshold(),
+            # Alocações desde a última coleta de cada geração (o que dispara a próxima)
+            "count": gc.get_count(),
+            "tracked_objects": len(gc.get_objects()),
+            "garbage": len(gc.garbage),
+            "generations": generations,
+            # Contadores do interpretador desde o início do processo
+            "interpreter": gc.get_stats()
+        }
+
+# ============================================================================
+# TRACEMALLOC
+# ============================================================================
+
+class AllocationTracker:
+    """Snapshot de referência do tracemalloc e comparação com o estado atual"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.baseline_time: Optional[float] = None
+        self.frames = 1
+
+    def start(self, frames: int = 1):
+        """Liga o rastreamento (se preciso) e tira o snapshot de referência"""
+        with self._lock:
+            if tracemalloc.is_tracing() and tracemalloc.get_traceback_limit() != frames:
+                tracemalloc.stop()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self.frames = frames
+            self.baseline = self._snapshot()
+            self.baseline_time = time.time()
+
+    def stop(self):
+        with self._lock:
+            self.baseline = None
+            self.baseline_time = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        # Sem as alocações do próprio tracemalloc
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>")
+        ))
+
+    def compare(self, limit: int = 25, group_by: str = "lineno") -> Dict[str, Any]:
+        """Maiores diferenças de memória entre o snapshot de referência e agora"""
+        with self._lock:
+            if self.baseline is None or not tracemalloc.is_tracing():
+                raise LookupError("tracemalloc não iniciado (POST /debug/memory/allocations)")
+            current = self._snapshot()
+            differences = current.compare_to(self.baseline, group_by)
+            traced, peak = tracemalloc.get_traced_memory()
+        top: List[Dict[str, Any]] = [
+            {
+                "location": [f"{frame.filename}:{frame.lineno}" for frame in diff.traceback],
+                "size_diff_kb": round(diff.size_diff / 1024, 1),
+                "size_kb": round(diff.size / 1024, 1),
+                "count_diff": diff.count_diff,
+                "count": diff.count
+            }
+            for diff in differences[:limit]
+        ]
+        return {
+            "baseline_time": self.baseline_time,
+            "seconds_since_baseline": round(time.time() - self.baseline_time, 3),
+            "group_by": group_by,
+            "traced_mb": _mb(traced),
+            "peak_mb": _mb(peak),
+            "size_diff_mb": _mb(sum(diff.size_diff for diff in differences)),
+            "top": top
+        }
+
+    def status(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        traced, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "frames": self.frames if tracing else None,
+            "baseline_time": self.baseline_time,
+            "traced_mb": _mb(traced),
+            "peak_mb": _mb(peak),
+            "overhead_mb": _mb(tracemalloc.get_tracemalloc_memory()) if tracing else 0.0
+        }
@@ -0,0 +1,222 @@
+"""
+Métricas da API no formato texto do Prometheus
+
+Cada requisição carrega (via contextvars) um registro de tempos por etapa:
+validação (leitura do corpo + pydantic), fila do pool de inferência, codificação
+das features, predição, pós-processamento e serialização da resposta. Os tempos
+alimentam histogramas por endpoint/etapa e voltam ao cliente no header
+`Server-Timing`, visível nos traces do navegador/cliente.
+
+Implementado sem dependências: o formato de exposição do Prometheus é texto simples.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+
+# Limites (s) dos buckets dos histogramas de latência
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Etapas executadas fora de uma requisição (micro-lotes, warm-up)
+BACKGROUND_ENDPOINT = "background"
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def metric_family(name: str, metric_type: str, help_text: str,
+                  samples: Iterable[Tuple[Dict[str, Any], float]]) -> List[str]:
+    """Linhas de uma família gauge/counter: [(labels, valor), ...]"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        if value is None:
+            continue
+        lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+    return lines
+
+class Histogram:
+    """Histograma com buckets fixos e rótulos, seguro para threads"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: Any):
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labelnames + ("le",), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+REQUEST_DURATION = Histogram(
+    "ml_api_request_duration_seconds",
+    "Latência das requisições por endpoint",
+    ("endpoint", "method", "status")
+)
+STAGE_DURATION = Histogram(
+    "ml_api_stage_duration_seconds",
+    "Latência por etapa do processamento (validation, queue, encoding, predict, postprocess, serialization)",
+    ("endpoint", "stage")
+)
+
+_in_flight: Dict[str, int] = {}
+_in_flight_lock = threading.Lock()
+
+# Chamados ao fim de cada requisição com (endpoint, início, fim) em time.perf_counter
+_request_observers: List[Callable[[str, float, float], None]] = []
+
+def add_request_observer(callback: Callable[[str, float, float], None]):
+    _request_observers.append(callback)
+
+# ============================================================================
+# TEMPOS POR REQUISIÇÃO
+# ============================================================================
+
+class RequestTimings:
+    """Tempos acumulados por etapa de uma requisição"""
+    __slots__ = ("endpoint", "started", "handler_finished", "stages", "_lock")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.handler_finished: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage_name: str, seconds: float):
+        with self._lock:
+            self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """Valor do header Server-Timing (durações em ms)"""
+        with self._lock:
+            return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages.items())
+
+_current_request: ContextVar[Optional[RequestTimings]] = ContextVar("ml_api_request_timings", default=None)
+
+def observe_stage(stage_name: str, seconds: float):
+    """Registra a duração de uma etapa no histograma e na requisição corrente"""
+    timings = _current_request.get()
+    STAGE_DURATION.observe(seconds, timings.endpoint if timings is not None else BACKGROUND_ENDPOINT, stage_name)
+    if timings is not None:
+        timings.add(stage_name, seconds)
+
+@contextmanager
+def stage(stage_name: str):
+    """Mede o bloco como uma etapa da requisição corrente"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage_name, time.perf_counter() - started)
+
+class TimedRoute(APIRoute):
+    """
+    Rota do FastAPI que mede a requisição inteira e as etapas feitas pelo próprio framework
+    validation = leitura do corpo + validação pydantic + dependências (até o endpoint começar)
+    serialization = do retorno do endpoint até a resposta pronta
+    """
+
+    def get_route_handler(self):
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            @functools.wraps(call)
+            async def timed_call(*args, **kwargs):
+                timings = _current_request.get()
+                if timings is not None:
+                    observe_stage("validation", time.perf_counter() - timings.started)
+                try:
+                    return await call(*args, **kwargs)
+                finally:
+                    if timings is not None:
+                        timings.handler_finished = time.perf_counter()
+            self.dependant.call = timed_call
+
+        handler = super().get_route_handler()
+        endpoint = self.path
+
+        async def timed_handler(request):
+            timings = RequestTimings(endpoint)
+            token = _current_request.set(timings)
+            with _in_flight_lock:
+                _in_flight[endpoint] = _in_flight.get(endpoint, 0) + 1
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                if timings.handler_finished is not None:
+                    observe_stage("serialization", time.perf_counter() - timings.handler_finished)
+                timings.add("total", time.perf_counter() - timings.started)
+                response.headers["Server-Timing"] = timings.server_timing()
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            except RequestValidationError:
+                status = 422
+                raise
+            finally:
+                finished = time.perf_counter()
+                REQUEST_DURATION.observe(finished - timings.started, endpoint, request.method, status)
+                for observer in _request_observers:
+                    observer(endpoint, timings.started, finished)
+                with _in_flight_lock:
+                    _in_flight[endpoint] -= 1
+                _current_request.reset(token)
+
+        return timed_handler
+
+def in_flight_family() -> List[str]:
+    with _in_flight_lock:
+        samples = [({"endpoint": endpoint}, count) for endpoint, count in sorted(_in_flight.items())]
+    return metric_family("ml_api_requests_in_flight", "gauge", "Requisições em andamento por endpoint", samples)
+
+def render_metrics(families: Iterable[List[str]]) -> str:
+    """Exposição completa: histogramas de latência, requisições em andamento e famílias extras"""
+    lines = REQUEST_DURATION.render() + STAGE_DURATION.render() + in_flight_family()
+    for family in families:
+        lines.extend(family)
+    return "\n".join(lines) + "\n"
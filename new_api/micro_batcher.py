@@ -0,0 +1,182 @@
+"""
+Micro-batching dinâmico de requisições unitárias
+
+Requisições concorrentes de um registro são agrupadas por até `max_batch_size`
+registros ou `max_wait_ms` milissegundos (o que ocorrer primeiro) e pontuadas com
+uma única chamada ao modelo. Cada requisição recebe de volta apenas o seu resultado.
+
+Só há espera quando há concorrência: uma requisição que chega com a fila vazia e nenhum
+lote em andamento é despachada na hora (servidor ocioso não paga os `max_wait_ms`).
+
+Usado no /recommendation, onde o custo fixo de cada predict_proba do XGBoost
+multiclasse domina a latência sob pico de tráfego.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from admission import DeadlineExceeded, current_deadline
+from inference_executor import STATS_WINDOW, InferenceExecutor
+
+def configured_micro_batching(name: str) -> Dict[str, Any]:
+    """
+    Lê a configuração do micro-batching de um endpoint das variáveis de ambiente
+    ML_API_MICROBATCH_<ENDPOINT>=0 desliga o agrupamento para o endpoint
+    """
+    prefix = f"ML_API_MICROBATCH_{name.upper()}"
+    return {
+        "enabled": os.getenv(prefix, "1") not in ("0", "false", "False"),
+        "max_batch_size": max(1, int(os.getenv(f"{prefix}_MAX_SIZE", "32"))),
+        "max_wait_ms": max(0.0, float(os.getenv(f"{prefix}_MAX_WAIT_MS", "2")))
+    }
+
+class MicroBatcher:
+    """Agrupa requisições concorrentes em lotes e distribui os resultados"""
+
+    def __init__(self,
+                 name: str,
+                 process_batch: Callable[[List[Any]], List[Any]],
+                 executor: InferenceExecutor,
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 2.0):
+        """
+        `process_batch` recebe a lista de itens e devolve uma lista do mesmo tamanho;
+        uma posição contendo uma Exception falha apenas a requisição correspondente.
+        """
+        self.name = name
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_times = deque(maxlen=STATS_WINDOW)
+        self._batches = 0
+        self._items = 0
+        # Lotes despachados sem espera (fila vazia e nenhum lote em andamento)
+        self._immediate = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Enfileira um item e aguarda o resultado do lote em que ele for incluído"""
+        loop = asyncio.get_running_loop()
+        if self._collector is None or self._collector.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            # Contexto vazio: o coletor não herda o contexto da requisição que o iniciou
+            self._collector = contextvars.Context().run(asyncio.create_task, self._collect())
+
+        future = loop.create_future()
+        # O prazo da requisição vai junto: o lote roda no contexto do coletor, não no dela
+        await self._queue.put((item, future, time.perf_counter(), current_deadline()))
+        return await future
+
+    async def _collect(self):
+        """Laço de coleta: fecha um lote por tamanho ou por tempo e o despacha"""
+        while True:
+            pending = [await self._queue.get()]
+            # Sozinha em um servidor ocioso: não há com quem agrupar, não espera
+            idle = not self._inflight and self._queue.empty()
+            deadline = time.perf_counter() + (0.0 if idle else self.max_wait)
+            if idle:
+                self._immediate += 1
+
+            while len(pending) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    # Sem espera: ainda aproveita o que já está na fila
+                    if self._queue.empty():
+                        break
+                    pending.append(self._queue.get_nowait())
+                    continue
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Não aguarda o lote terminar: o próximo lote já pode ser coletado
+            # (a concorrência real é limitada pelo pool de inferência)
+            task = asyncio.create_task(self._dispatch(pending))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, pending: List[tuple]):
+        """Executa um lote no pool de inferência e devolve cada resultado ao seu chamador"""
+        dispatched = time.perf_counter()
+        # Itens cujo prazo acabou enquanto esperavam o lote saem antes do modelo
+        expired = []
+        for entry in pending:
+            deadline = entry[3]
+            if deadline is not None:
+                try:
+                    deadline.check()
+                except DeadlineExceeded as e:
+                    expired.append((entry, e))
+        if expired:
+            for (_, future, _, _), error in expired:
+                if not future.done():
+                    future.set_exception(error)
+            dropped = {id(entry) for entry, _ in expired}
+            pending = [entry for entry in pending if id(entry) not in dropped]
+            if not pending:
+                return
+
+        with self._lock:
+            self._batches += 1
+            self._items += len(pending)
+            self._batch_sizes[len(pending)] += 1
+            self._queue_times.extend(dispatched - submitted for _, _, submitted, _ in pending)
+
+        items = [item for item, _, _, _ in pending]
+        try:
+            results = await self.executor.run(self.process_batch, items)
+        except Exception as e:
+            results = [e] * len(pending)
+
+        for (_, future, _, _), result in zip(pending, results):
+            if future.done():
+                continue  # requisição cancelada pelo cliente
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """Tamanhos de lote obtidos e latência de enfileiramento (ms)"""
+        with self._lock:
+            queue_times = np.array(self._queue_times) * 1000
+            stats = {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "immediate_batches": self._immediate,
+                "items": self._items,
+                "mean_batch_size": round(self._items / self._batches, 3) if self._batches else None,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items()))
+            }
+
+        if len(queue_times):
+            stats["queue_ms"] = {
+                "mean": round(float(queue_times.mean()), 3),
+                "p50": round(float(np.percentile(queue_times, 50)), 3),
+                "p95": round(float(np.percentile(queue_times, 95)), 3),
+                "max": round(float(queue_times.max()), 3)
+            }
+        else:
+            stats["queue_ms"] = None
+        return stats
+
+    def close(self):
+        """Interrompe o laço de coleta"""
+        if self._collector is not None:
+            self._collector.cancel()
@@ -0,0 +1,262 @@
+"""
+Registro de versões dos modelos
+
+Descobre as versões publicadas em `artefacts/<versão>/`, mantém em memória as versões
+carregadas e troca a versão ativa de forma atômica. Cada modelo é carregado uma única
+vez mesmo sob requisições concorrentes (single-flight). Uma nova versão é carregada e
+aquecida em segundo plano; só depois a referência ativa é trocada. Requisições em
+andamento continuam com os objetos da versão que resolveram no início, então nenhuma
+requisição é perdida durante a troca.
+
+No máximo `keep_versions` versões ficam em memória, descartando a usada há mais tempo
+(nunca a ativa nem a que está sendo ativada), inclusive quando uma versão é carregada
+por uma requisição que a fixou (X-Model-Version): um cliente que percorra todas as
+versões publicadas não as acumula em memória.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODEL_TYPES = ("clusterization", "classification", "recommendation")
+
+# Artefatos opcionais: versões sem eles continuam válidas (a API usa um comportamento padrão)
+OPTIONAL_ARTEFACTS = {"frequency_maps", "popular_routes"}
+
+def model_paths(base_path: str, version: str) -> Dict[str, Any]:
+    """Caminhos dos artefatos de uma versão (mesma estrutura gerada pelos notebooks)"""
+    return {
+        "clusterization": f"{base_path}/{version}/clusterization/modelo_clusterizacao.pkl",
+        "classification": f"{base_path}/{version}/classification/modelo_recompra_30dias.pkl",
+        "recommendation": {
+            "model": f"{base_path}/{version}/recommendation/modelo_recomendacao.pkl",
+            "label_encoder": f"{base_path}/{version}/recommendation/label_encoder.pkl",
+            "feature_encoders": f"{base_path}/{version}/recommendation/feature_encoders.pkl",
+            # Exportado pelo notebook de clusterização (frequency encoding do dataset de treino)
+            "frequency_maps": f"{base_path}/{version}/clusterization/frequency_maps.json",
+            # Rotas populares por cluster/origem (modo degradado do /recommendation)
+            "popular_routes": f"{base_path}/{version}/recommendation/popular_routes.json"
+        }
+    }
+
+def artefacts_status(paths: Dict[str, Any]) -> Dict[str, bool]:
+    """Indica, por modelo, se todos os arquivos de artefato existem"""
+    status = {}
+    for model_type, path in paths.items():
+        files = [file_path for name, file_path in path.items() if name not in OPTIONAL_ARTEFACTS] \
+            if isinstance(path, dict) else [path]
+        status[model_type] = all(os.path.exists(file_path) for file_path in files)
+    return status
+
+def version_sort_key(version: str):
+    """Ordenação natural de versões: v2 < v10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", version)]
+
+class UnknownModelVersion(KeyError):
+    """Versão solicitada não existe em artefacts/"""
+
+class ModelRegistry:
+    """Versões carregadas dos modelos e troca atômica da versão ativa"""
+
+    def __init__(self,
+                 base_path: str,
+                 loader: Callable[[str, Dict[str, Any]], Any],
+                 warm_up: Optional[Callable[[str, str], None]] = None,
+                 active_version: Optional[str] = None,
+                 keep_versions: int = 2):
+        """
+        `loader(model_type, paths)` carrega um modelo do disco e `warm_up(model_type, version)`
+        executa uma predição sintética com ele antes de a versão ser ativada.
+        """
+        self.base_path = base_path
+        self.loader = loader
+        self.warm_up = warm_up
+        self.keep_versions = max(1, keep_versions)
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._warm: Dict[str, set] = {}
+        self._load_locks: Dict[Tuple[str, str], threading.RLock] = {}
+        self._load_seconds: Dict[str, Dict[str, float]] = {}
+        # Último uso (time.monotonic) de cada versão em memória: ordem do descarte (LRU)
+        self._last_used: Dict[str, float] = {}
+        self._reload = {"status": "idle", "version": None, "error": None, "finished_at": None}
+
+        available = self.discover()
+        self._active = active_version or (available[-1] if available else "v1")
+
+    # ------------------------------------------------------------------ versões
+
+    def discover(self) -> List[str]:
+        """Versões publicadas em artefacts/ com todos os artefatos presentes"""
+        if not os.path.isdir(self.base_path):
+            return []
+        versions = [
+            name for name in os.listdir(self.base_path)
+            if os.path.isdir(os.path.join(self.base_path, name))
+            and all(artefacts_status(model_paths(self.base_path, name)).values())
+        ]
+        return sorted(versions, key=version_sort_key)
+
+    @property
+    def active_version(self) -> str:
+        return self._active
+
+    @property
+    def reloading(self) -> bool:
+        return self._reload_lock.locked()
+
+    def paths(self, version: Optional[str] = None) -> Dict[str, Any]:
+        return model_paths(self.base_path, version or self._active)
+
+    def resolve(self, version: Optional[str] = None) -> str:
+        """Versão efetiva de uma requisição: a fixada pelo cliente ou a ativa no momento"""
+        if not version:
+            return self._active
+        with self._lock:
+            if version in self._cache:
+                return version
+        if version not in self.discover():
+            raise UnknownModelVersion(version)
+        return version
+
+    # ------------------------------------------------------------------ modelos
+
+    def _cached(self, model_type: str, version: str) -> Any:
+        with self._lock:
+            bundle = self._cache.get(version, {}).get(model_type)
+            if bundle is not None:
+                self._last_used[version] = time.monotonic()
+            return bundle
+
+    def _load_lock(self, model_type: str, version: str) -> threading.RLock:
+        with self._lock:
+            return self._load_locks.setdefault((version, model_type), threading.RLock())
+
+    def get(self, model_type: str, version: Optional[str] = None) -> Any:
+        """Modelo de uma versão (a ativa por padrão), carregado sob demanda"""
+        version = version or self._active
+        cached = self._cached(model_type, version)
+        if cached is not None:
+            return cached
+
+        # Single-flight: requisições concorrentes aguardam a mesma leitura do disco
+        with self._load_lock(model_type, version):
+            cached = self._cached(model_type, version)
+            if cached is not None:
+                return cached
+            started = time.perf_counter()
+            bundle = self.loader(model_type, self.paths(version))
+            with self._lock:
+                self._cache.setdefault(version, {})[model_type] = bundle
+                self._load_seconds.setdefault(version, {})[model_type] = round(time.perf_counter() - started, 4)
+                self._last_used[version] = time.monotonic()
+                self._evict_old_versions()
+            return bundle
+
+    def prepare(self, model_type: str, version: Optional[str] = None) -> Any:
+        """Carrega o modelo e executa o warm-up uma única vez por versão"""
+        version = version or self._active
+        bundle = self.get(model_type, version)
+        with self._load_lock(model_type, version):
+            with self._lock:
+                if model_type in self._warm.get(version, ()):
+                    return bundle
+            if self.warm_up is not None:
+                self.warm_up(model_type, version)
+            with self._lock:
+                self._warm.setdefault(version, set()).add(model_type)
+        return bundle
+
+    def ready(self, version: Optional[str] = None) -> bool:
+        """Indica se todos os modelos da versão (a ativa por padrão) estão carregados e aquecidos"""
+        with self._lock:
+            warm = self._warm.get(version or self._active, set())
+            return all(model_type in warm for model_type in MODEL_TYPES)
+
+    def loaded(self, version: Optional[str] = None) -> Dict[str, Any]:
+        """Modelos já carregados de uma versão (a ativa por padrão)"""
+        with self._lock:
+            return dict(self._cache.get(version or self._active, {}))
+
+    def activate(self, version: str) -> None:
+        """
+        Carrega e aquece todos os modelos de `version` e só então a torna ativa
+        Executado em segundo plano; a versão anterior continua servindo até a troca.
+        """
+        if version not in self.discover():
+            raise UnknownModelVersion(version)
+        if not self._reload_lock.acquire(blocking=False):
+            raise RuntimeError("Já existe uma troca de versão em andamento")
+
+        with self._lock:
+            self._reload = {"status": "loading", "version": version, "error": None, "finished_at": None}
+        started = time.perf_counter()
+        try:
+            for model_type in MODEL_TYPES:
+                self.prepare(model_type, version)
+
+            with self._lock:
+                previous = self._active
+                self._active = version
+                self._last_used[version] = time.monotonic()
+                self._evict_old_versions()
+                self._reload = {
+                    "status": "ready",
+                    "version": version,
+                    "error": None,
+                    "finished_at": datetime.now().isoformat()
+                }
+            logger.info(f"Versão {version} ativada (anterior: {previous}) em {time.perf_counter() - started:.2f}s")
+
+        except Exception as e:
+            logger.error(f"Falha ao ativar versão {version}: {e}")
+            with self._lock:
+                if version != self._active:
+                    # Não mantém em memória uma versão parcialmente carregada
+                    self._forget(version)
+                self._reload = {"status": "failed", "version": version, "error": str(e), "finished_at": datetime.now().isoformat()}
+            raise
+        finally:
+            self._reload_lock.release()
+
+    def _evict_old_versions(self):
+        """
+        Descarta as versões usadas há mais tempo além de `keep_versions` (chamado com o lock)
+        A ativa e a que está sendo ativada nunca são descartadas
+        """
+        protected = {self._active}
+        if self._reload["status"] == "loading":
+            protected.add(self._reload["version"])
+        others = sorted((name for name in self._cache if name not in protected),
+                        key=lambda name: self._last_used.get(name, 0.0), reverse=True)
+        for version in others[max(0, self.keep_versions - len(protected)):]:
+            # Requisições em andamento mantêm suas próprias referências aos objetos
+            self._forget(version)
+            logger.info(f"Versão {version} removida da memória")
+
+    def _forget(self, version: str):
+        self._cache.pop(version, None)
+        self._warm.pop(version, None)
+        self._load_seconds.pop(version, None)
+        self._last_used.pop(version, None)
+        for key in [key for key in self._load_locks if key[0] == version]:
+            del self._load_locks[key]
+
+    def status(self) -> Dict[str, Any]:
+        """Estado do registro para /health e /models"""
+        with self._lock:
+            return {
+                "active_version": self._active,
+                "available_versions": self.discover(),
+                "loaded": {version: sorted(models) for version, models in self._cache.items()},
+                "warm": {version: sorted(models) for version, models in self._warm.items()},
+                "load_seconds": {version: dict(models) for version, models in self._load_seconds.items()},
+                "reload": dict(self._reload)
+            }
@@ -0,0 +1,106 @@
+"""
+Pontuação em streaming (NDJSON)
+
+Os endpoints /<modelo>/stream leem o corpo da requisição incrementalmente, um registro
+JSON por linha, pontuam em blocos de tamanho fixo e devolvem uma linha NDJSON por
+registro à medida que cada bloco termina. A memória fica limitada a um bloco de
+entrada e um de saída, independentemente do tamanho do corpo.
+
+Contrapressão: o próximo bloco só é lido depois que as linhas do anterior foram
+entregues ao servidor, que por sua vez só aceita mais bytes quando o cliente consome a
+resposta. Um cliente lento em ler segura a leitura do corpo (e o TCP segura o envio).
+O cliente precisa ler a resposta enquanto envia o corpo (ex.: curl, httpx assíncrono);
+clientes que só leem a resposta ao final do upload travam em corpos grandes.
+"""
+
+import json
+import os
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Registros pontuados por bloco
+STREAM_CHUNK_ROWS = max(1, int(os.getenv("ML_API_STREAM_CHUNK_ROWS", "1000")))
+# Maior linha aceita; protege a memória contra um corpo sem quebras de linha
+STREAM_MAX_LINE_BYTES = max(1024, int(os.getenv("ML_API_STREAM_MAX_LINE_BYTES", str(1024 * 1024))))
+
+# Documentação do corpo NDJSON no OpenAPI (o FastAPI não o infere de `Request`)
+NDJSON_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {NDJSON_MEDIA_TYPE: {"schema": {"type": "string", "description": "Um registro JSON por linha"}}}
+    }
+}
+
+class StreamInputError(ValueError):
+    """Corpo que não pode continuar a ser lido (linha acima do limite)"""
+
+def parse_line(line: bytes) -> Tuple[Any, str]:
+    """Registro de uma linha, ou (None, erro) se não for um objeto JSON"""
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return None, f"JSON inválido: {e}"
+    if not isinstance(record, dict):
+        return None, "Cada linha deve ser um objeto JSON"
+    return record, ""
+
+async def ndjson_chunks(body: AsyncIterator[bytes],
+                        chunk_rows: int = STREAM_CHUNK_ROWS,
+                        max_line_bytes: int = STREAM_MAX_LINE_BYTES) -> AsyncIterator[List[Tuple[int, Any, str]]]:
+    """
+    Agrupa as linhas do corpo em blocos de até `chunk_rows` itens (índice, registro, erro)
+    Linhas em branco são ignoradas e não consomem índice
+    """
+    chunk: List[Tuple[int, Any, str]] = []
+    pending = b""
+    index = 0
+    async for data in body:
+        pending += data
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        if len(pending) > max_line_bytes:
+            raise StreamInputError(f"Linha {index} excede {max_line_bytes} bytes")
+        for line in lines:
+            if not line.strip():
+                continue
+            record, error = parse_line(line)
+            chunk.append((index, record, error))
+            index += 1
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+    if pending.strip():
+        record, error = parse_line(pending)
+        chunk.append((index, record, error))
+    if chunk:
+        yield chunk
+
+def record_columns(records: List[Dict[str, Any]], field_names: List[str]) -> Dict[str, List[Any]]:
+    """Layout colunar dos registros de um bloco (campos ausentes viram None e são reportados)"""
+    return {name: [record.get(name) for record in records] for name in field_names}
+
+def ndjson_line(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que pode ler o corpo da requisição enquanto responde
+
+    A StreamingResponse do Starlette consome `receive` em paralelo para detectar a
+    desconexão do cliente, o que roubaria os blocos do corpo ainda não lidos. Aqui a
+    desconexão é detectada pela própria leitura do corpo (ClientDisconnect).
+    """
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except ClientDisconnect:
+            return
+        if self.background is not None:
+            await self.background()
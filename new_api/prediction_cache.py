@@ -0,0 +1,130 @@
+"""
+Cache de resultados de predição
+
+Respostas dos endpoints unitários ficam em memória, indexadas por um hash canônico da
+entrada já validada e da versão do modelo que a atendeu. O cache é limitado em
+tamanho (LRU) e em tempo (TTL). Requisições idênticas simultâneas aguardam um único
+cálculo em andamento em vez de repeti-lo.
+
+Usado no /clusterization e no /classification, onde o CRM repontua os mesmos
+clientes várias vezes em poucos minutos.
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+def configured_prediction_cache(name: str) -> Dict[str, Any]:
+    """
+    Lê a configuração do cache de um endpoint das variáveis de ambiente
+    ML_API_CACHE_<ENDPOINT>=1 liga o cache para o endpoint (desligado por padrão)
+    """
+    prefix = f"ML_API_CACHE_{name.upper()}"
+    return {
+        "enabled": os.getenv(prefix, "0") not in ("0", "false", "False"),
+        "max_entries": max(1, int(os.getenv(f"{prefix}_MAX_ENTRIES", "10000"))),
+        "ttl_seconds": max(0.0, float(os.getenv(f"{prefix}_TTL_SECONDS", "300")))
+    }
+
+def cache_key(payload: Dict[str, Any], *context: Any) -> str:
+    """
+    Hash canônico de uma entrada validada e do contexto da predição (versão, top_k...)
+    Chaves ordenadas e separadores fixos: a ordem dos campos no JSON não altera a chave
+    """
+    canonical = json.dumps([payload, *context], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class PredictionCache:
+    """Cache LRU com TTL e coalescência de requisições idênticas em andamento"""
+
+    def __init__(self, name: str, max_entries: int = 10000, ttl_seconds: float = 300.0):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Resultado em cache ainda válido, ou None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key: str, value: Any):
+        """Armazena um resultado, descartando o menos usado recentemente se cheio"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Devolve o resultado em cache ou calcula-o uma única vez por chave
+        Falhas não são armazenadas e são repassadas a todas as requisições que aguardavam
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            with self._lock:
+                self._coalesced += 1
+            # shield: o cancelamento de uma requisição não derruba o cálculo compartilhado
+            return await asyncio.shield(task)
+
+        with self._lock:
+            self._misses += 1
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        # Armazenar e liberar a chave ficam com a própria tarefa: não dependem de quem a
+        # iniciou continuar aguardando (cancelado, o cálculo segue e o resultado é guardado)
+        task.add_done_callback(functools.partial(self._settle, key))
+        return await asyncio.shield(task)
+
+    def _settle(self, key: str, task: asyncio.Task):
+        """Fim do cálculo compartilhado: guarda o resultado (falhas não) e libera a chave"""
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de acerto, falta, coalescência e descarte"""
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "entries": len(self._entries),
+                "inflight": len(self._inflight),
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "hit_rate": round((self._hits + self._coalesced) / lookups, 4) if lookups else None
+            }
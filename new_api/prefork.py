@@ -0,0 +1,297 @@
+"""
+Servidor multi-worker com memória de modelos compartilhada
+
+Os modelos são carregados uma única vez no processo pai, que então faz fork dos
+workers uvicorn sobre o mesmo socket. As páginas dos modelos são compartilhadas
+copy-on-write entre os workers, em vez de cada worker manter a sua própria cópia
+da RandomForest, do XGBoost e dos encoders.
+
+Para que as páginas continuem compartilhadas:
+- os arrays NumPy dos modelos são copiados para uma única região de memória
+  compartilhada e marcados como somente leitura (longe dos objetos Python cujos
+  contadores de referência mudam a cada requisição);
+- os objetos carregados vão para a geração permanente do GC (gc.freeze), evitando
+  que as coletas dos workers escrevam nos cabeçalhos dos objetos.
+
+Uso:
+    python prefork.py --workers 4 --port 3021
+"""
+
+import argparse
+import gc
+import logging
+import mmap
+import os
+import signal
+import socket
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Arrays menores que isso não compensam a realocação
+SHARE_MIN_BYTES = 1024
+# Alinhamento de cada array dentro da região compartilhada
+SHARE_ALIGNMENT = 64
+
+def configured_server_workers() -> int:
+    """Número de workers: ML_API_WORKERS ou os núcleos disponíveis para o processo"""
+    value = os.getenv("ML_API_WORKERS")
+    if value:
+        return max(1, int(value))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# ============================================================================
+# ARRAYS EM MEMÓRIA COMPARTILHADA
+# ============================================================================
+
+def _text_only(value: np.ndarray) -> bool:
+    """Array de objetos só com textos (ex.: classes_ dos label encoders)"""
+    return value.dtype == object and value.size > 0 and all(isinstance(item, str) for item in value.flat)
+
+def _shareable(value: Any) -> bool:
+    if not isinstance(value, np.ndarray) or isinstance(value.base, mmap.mmap):
+        return False
+    if value.dtype == object:
+        # Só textos viram array de largura fixa; objetos mistos ficam no heap de cada worker
+        return _text_only(value)
+    return value.nbytes >= SHARE_MIN_BYTES
+
+def _fixed_width(array: np.ndarray) -> np.ndarray:
+    """Textos de um array de objetos como array `U` de largura fixa (cabe na região compartilhada)"""
+    return np.asarray(array.tolist(), dtype=str) if array.dtype == object else array
+
+def _collect_arrays(root: Any) -> List[Tuple[Any, Any, np.ndarray]]:
+    """
+    Percorre dicts, listas e atributos de objetos a partir de `root`
+    Retorna (container, chave, array) para cada array elegível
+    """
+    found = []
+    seen = set()
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (str, bytes, int, float, bool, type(None), np.ndarray)):
+            continue
+        seen.add(id(obj))
+
+        if isinstance(obj, dict):
+            items = list(obj.items())
+        elif isinstance(obj, list):
+            items = list(enumerate(obj))
+        elif isinstance(obj, tuple):
+            # Tuplas são imutáveis: apenas desce nos elementos
+            stack.extend(obj)
+            continue
+        elif hasattr(obj, "__dict__"):
+            items = list(vars(obj).items())
+        else:
+            continue
+
+        for key, value in items:
+            if _shareable(value):
+                found.append((obj, key, value))
+            else:
+                stack.append(value)
+    return found
+
+def share_arrays(root: Any) -> Dict[str, int]:
+    """
+    Move os arrays NumPy numéricos de um modelo carregado para uma região mmap
+    anônima e compartilhada, substituindo as referências por visões somente leitura
+    Arrays de objetos só com textos (classes_ dos encoders) entram como arrays `U` de
+    largura fixa (bytes contíguos e imutáveis no lugar de ponteiros para objetos str)
+
+    Objetos de extensão sem __dict__ (ex.: a árvore Cython do sklearn, o Booster do
+    XGBoost) não são alcançados; a memória deles segue compartilhada por copy-on-write.
+    """
+    found = _collect_arrays(root)
+    unique = {}
+    for _, _, array in found:
+        if id(array) not in unique:
+            unique[id(array)] = _fixed_width(array)
+    if not unique:
+        return {"arrays": 0, "bytes": 0}
+
+    offsets = {}
+    size = 0
+    for key, array in unique.items():
+        offsets[key] = size
+        size += -(-array.nbytes // SHARE_ALIGNMENT) * SHARE_ALIGNMENT
+
+    region = mmap.mmap(-1, size, flags=mmap.MAP_SHARED)
+    views = {}
+    for key, array in unique.items():
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=region, offset=offsets[key])
+        view[...] = array
+        view.flags.writeable = False
+        views[key] = view
+
+    for container, key, array in found:
+        if isinstance(container, (dict, list)):
+            container[key] = views[id(array)]
+        else:
+            setattr(container, key, views[id(array)])
+    return {"arrays": len(unique), "bytes": size}
+
+# ============================================================================
+# MEMÓRIA POR PROCESSO
+# ============================================================================
+
+def process_memory(pid: Any = "self") -> Optional[Dict[str, float]]:
+    """
+    Memória de um processo em MB a partir de /proc/<pid>/smaps_rollup (Linux)
+    `pss` divide as páginas compartilhadas entre os processos que as usam: a soma do
+    PSS dos workers é o consumo real, enquanto a soma do RSS conta os modelos N vezes
+    """
+    fields = {
+        "Rss": "rss", "Pss": "pss",
+        "Shared_Clean": "shared_clean", "Shared_Dirty": "shared_dirty",
+        "Private_Clean": "private_clean", "Private_Dirty": "private_dirty"
+    }
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    memory = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in fields:
+            memory[fields[name]] = round(int(value.split()[0]) / 1024, 1)
+    return memory
+
+def report_workers_memory(workers: Dict[int, int]):
+    """Registra no log a memória de cada worker e o total (RSS vs PSS)"""
+    total_rss = total_pss = 0.0
+    for index, pid in sorted(workers.items()):
+        memory = process_memory(pid)
+        if memory is None:
+            continue
+        total_rss += memory.get("rss", 0)
+        total_pss += memory.get("pss", 0)
+        logger.info(f"Worker {index} (pid {pid}): {memory}")
+    logger.info(f"Memória dos workers: RSS somado {total_rss:.1f} MB, PSS somado {total_pss:.1f} MB")
+
+# ============================================================================
+# SUPERVISOR
+# ============================================================================
+
+def preload_shared_models(api) -> None:
+    """
+    Carrega os modelos da versão ativa no processo pai e os prepara para o fork
+    A inferência de warm-up fica para cada worker (pools de threads e OpenMP não
+    sobrevivem ao fork)
+    """
+    for model_type in ("clusterization", "classification", "recommendation"):
+        bundle = api.model_registry.get(model_type)
+        shared = share_arrays(bundle)
+        logger.info(f"✓ Modelo {model_type} carregado ({shared['arrays']} arrays, "
+                    f"{shared['bytes'] / 1024 / 1024:.1f} MB em memória compartilhada)")
+    gc.collect()
+    gc.freeze()
+
+def run_worker(api, sock: socket.socket, log_level: str):
+    """Processo filho: serve a aplicação no socket herdado do pai"""
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(api.app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor multi-worker com modelos compartilhados")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=3021)
+    parser.add_argument("--workers", type=int, default=configured_server_workers())
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--memory-report-interval", type=float, default=60.0,
+                        help="Intervalo (s) do relatório de memória por worker; 0 desliga")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    import main as api
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    # Protocolo binário (ML_API_UDS_PATH): o socket Unix também é criado aqui e herdado
+    uds_path = api.UDS_SOCKET_PATH
+    if uds_path:
+        api.binary_listener_socket = api.binary_protocol.bind_unix_socket(uds_path)
+
+    if api.FAST_START:
+        # ML_API_FAST_START: os workers sobem sem esperar a carga e carregam os modelos
+        # em segundo plano (cada um com a sua cópia)
+        logger.info("Início rápido: modelos carregados por cada worker após o fork")
+    else:
+        logger.info(f"Pré-carregando modelos no processo pai (pid {os.getpid()})...")
+        preload_shared_models(api)
+
+    # Os workers recusam o que depende de estado por processo (ingestão de compras por HTTP)
+    api.SERVER_WORKERS = args.workers
+
+    workers: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(api, sock, args.log_level)
+            finally:
+                os._exit(0)
+        workers[index] = pid
+        logger.info(f"Worker {index} iniciado (pid {pid})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    next_report = time.monotonic() + min(args.memory_report_interval, 10.0)
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            index = next((i for i, p in workers.items() if p == pid), None)
+            if index is not None:
+                del workers[index]
+                if not stopping:
+                    # Worker caiu: sobe outro com os mesmos modelos compartilhados
+                    logger.warning(f"Worker {index} (pid {pid}) terminou com status {status}; reiniciando")
+                    spawn(index)
+            continue
+
+        if args.memory_report_interval > 0 and not stopping and time.monotonic() >= next_report:
+            report_workers_memory(workers)
+            next_report = time.monotonic() + args.memory_report_interval
+        time.sleep(0.5)
+
+    if uds_path and os.path.exists(uds_path):
+        os.unlink(uds_path)
+    logger.info("Todos os workers finalizados")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Profiler por amostragem para workers em produção
+
+Uma thread lê periodicamente a pilha de todas as threads do processo
+(`sys._current_frames`), sem instrumentar o código: o custo é proporcional à taxa de
+amostragem (padrão 100 amostras/s), não ao número de chamadas. O event loop, os pools
+de inferência e o micro-batcher aparecem cada um com o nome da sua thread.
+
+O resultado sai no formato "collapsed stacks" (uma linha `thread;f1;f2;f3 N` por pilha),
+aceito diretamente por flamegraph.pl, speedscope e inferno.
+
+Dois modos:
+- janela: amostra o worker inteiro por N segundos e devolve o perfil;
+- requisições lentas: amostra continuamente em um buffer circular e, a cada requisição
+  acima do limite de latência, agrega as amostras do intervalo em que ela esteve em
+  andamento (o que o worker fazia enquanto ela demorava), prefixadas pelo endpoint.
+"""
+
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# Intervalo padrão entre amostras (s)
+DEFAULT_INTERVAL = 0.01
+# Instantes de amostragem mantidos no buffer do modo de requisições lentas (5 min a 100 Hz)
+SLOW_BUFFER_SAMPLES = 30_000
+
+Stack = Tuple[str, ...]
+
+class StackSampler(ABC):
+    """Thread que amostra as pilhas de todas as demais threads em intervalo fixo"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Rótulo por objeto de código: formatar nomes a cada amostra custaria mais que a leitura
+        self._labels: Dict[Any, str] = {}
+        self.samples = 0
+        self.started: Optional[float] = None
+        self.stopped: Optional[float] = None
+        self._until: Optional[float] = None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _stacks(self) -> List[Tuple[str, Stack]]:
+        """Pilha atual (da raiz para a folha) de cada thread, exceto a do próprio sampler"""
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not self.include_idle and _is_idle(frame.f_code):
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            labels.reverse()
+            stacks.append((names.get(ident, f"thread-{ident}"), tuple(labels)))
+        return stacks
+
+    @abstractmethod
+    def record(self, timestamp: float, stacks: List[Tuple[str, Stack]]):
+        """Destino de cada amostra: pilhas (thread, quadros) lidas no instante `timestamp`"""
+
+    def _run(self):
+        next_sample = time.perf_counter()
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            if self._until is not None and now >= self._until:
+                break
+            self.record(now, self._stacks())
+            self.samples += 1
+            next_sample += self.interval
+            # Se a amostragem atrasou (GIL disputado), não tenta compensar as perdidas
+            delay = next_sample - time.perf_counter()
+            if delay < 0:
+                next_sample = time.perf_counter()
+                delay = 0
+            self._stop.wait(delay)
+        self.stopped = time.time()
+
+    def start(self, duration: Optional[float] = None):
+        """Inicia a amostragem; com `duration` (s) ela para sozinha"""
+        self.started = time.time()
+        self._until = None if duration is None else time.perf_counter() + duration
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+# Funções em que uma thread está apenas esperando trabalho (fila do pool, select do event loop)
+IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("thread.py", "_worker"), ("queue.py", "get"), ("selectors.py", "select")
+}
+
+def _is_idle(code) -> bool:
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES
+
+class WindowProfile(StackSampler):
+    """Perfil agregado do worker inteiro durante uma janela de tempo"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, include_idle: bool = False):
+        super().__init__(interval, include_idle)
+        self.stacks: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, timestamp: float, stacks: List[Tuple[str, Stack]]):
+        with self._lock:
+            for thread_name, stack in stacks:
+                self.stacks[(thread_name,) + stack] += 1
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.stacks)
+
+class SlowRequestProfile(StackSampler):
+    """
+    Amostragem contínua em buffer circular; cada requisição acima de `threshold`
+    segundos agrega as amostras do seu intervalo, com o endpoint como raiz da pilha
+    """
+
+    def __init__(self, threshold: float, interval: float = DEFAULT_INTERVAL, include_idle: bool = False,
+                 buffer_samples: int = SLOW_BUFFER_SAMPLES):
+        super().__init__(interval, include_idle)
+        self.threshold = threshold
+        self._buffer: deque = deque(maxlen=buffer_samples)
+        self.stacks: Counter = Counter()
+        self.slow_requests: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, timestamp: float, stacks: List[Tuple[str, Stack]]):
+        # deque.append é atômica: sem lock no caminho da amostragem
+        self._buffer.append((timestamp, stacks))
+
+    def observe(self, endpoint: str, started: float, finished: float):
+        """Chamado ao fim de cada requisição (tempos de time.perf_counter)"""
+        if finished - started < self.threshold:
+            return
+        # Cópia do buffer (a thread de amostragem segue escrevendo); percorre só o fim dele
+        window = []
+        for timestamp, stacks in reversed(list(self._buffer)):
+            if timestamp < started:
+                break
+            if timestamp <= finished:
+                window.extend(stacks)
+        with self._lock:
+            self.slow_requests[endpoint] += 1
+            for thread_name, stack in window:
+                self.stacks[(endpoint, thread_name) + stack] += 1
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.stacks)
+
+def collapsed(stacks: Counter) -> str:
+    """Formato "collapsed stacks" (flamegraph.pl / speedscope): `a;b;c contagem` por linha"""
+    lines = [";".join(frame.replace(";", ":") for frame in stack) + f" {count}"
+             for stack, count in stacks.most_common()]
+    return "\n".join(lines) + ("\n" if lines else "")
+
+def top_functions(stacks: Counter, limit: int = 30, skip: int = 1) -> List[Dict[str, Any]]:
+    """
+    Funções com mais amostras no topo da pilha (`self`), com o `total` (em qualquer ponto da pilha)
+    `skip` ignora os primeiros níveis da pilha (thread e, no modo lento, endpoint)
+    """
+    own: Counter = Counter()
+    total: Counter = Counter()
+    samples = sum(stacks.values())
+    for stack, count in stacks.items():
+        frames = stack[skip:]
+        if not frames:
+            continue
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return [
+        {"function": frame, "self": count, "self_pct": round(count / samples * 100, 2),
+         "total": total[frame], "total_pct": round(total[frame] / samples * 100, 2)}
+        for frame, count in own.most_common(limit)
+    ] if samples else []
+
+class ProfilerControl:
+    """Um perfil de janela e um de requisições lentas por worker, no máximo"""
+
+    def __init__(self):
+        self.window: Optional[WindowProfile] = None
+        self.slow: Optional[SlowRequestProfile] = None
+
+    def start_window(self, seconds: float, interval: float, include_idle: bool = False) -> WindowProfile:
+        """Inicia um perfil de `seconds` segundos do worker inteiro"""
+        if self.window is not None and self.window.running:
+            raise RuntimeError("Já existe um perfil em andamento neste worker")
+        self.window = WindowProfile(interval, include_idle)
+        self.window.start(seconds)
+        return self.window
+
+    def start_slow(self, threshold: float, seconds: float, interval: float, include_idle: bool = False) -> SlowRequestProfile:
+        """Inicia (ou reinicia) a captura de requisições lentas por `seconds` segundos"""
+        if self.slow is not None and self.slow.running:
+            self.slow.stop()
+        profile = SlowRequestProfile(threshold, interval, include_idle)
+        profile.start(seconds)
+        self.slow = profile
+        return profile
+
+    def stop(self):
+        """Interrompe as amostragens em andamento (os resultados são mantidos)"""
+        for profile in (self.window, self.slow):
+            if profile is not None and profile.running:
+                profile.stop()
+
+    def observe(self, endpoint: str, started: float, finished: float):
+        """Observador de requisições (metrics.add_request_observer)"""
+        profile = self.slow
+        # As próprias chamadas de diagnóstico (/debug/*) não entram no perfil
+        if profile is not None and profile.running and not endpoint.startswith("/debug/"):
+            profile.observe(endpoint, started, finished)
+
+    def status(self) -> Dict[str, Any]:
+        profile = self.slow
+        return {
+            "window_running": self.window is not None and self.window.running,
+            "slow_requests": None if profile is None else {
+                "running": profile.running,
+                "threshold_ms": round(profile.threshold * 1000, 3),
+                "interval_ms": round(profile.interval * 1000, 3),
+                "started": profile.started,
+                "stopped": profile.stopped,
+                "samples": profile.samples,
+                "captured": dict(profile.slow_requests)
+            }
+        }
@@ -0,0 +1,16 @@
+"""
+Introspecção dos schemas pydantic de entrada
+
+Usado pelo main.py (lotes colunares), pelo arrow_io.py e pelo binary_protocol.py, que
+montam colunas e layouts a partir dos mesmos schemas unitários.
+"""
+
+import typing
+from typing import Any, Tuple
+
+def field_type(field: Any) -> Tuple[Any, bool]:
+    """Tipo base de um campo de schema e se ele é opcional (Optional[int] -> (int, True))"""
+    if field.is_required():
+        return field.annotation, False
+    args = [arg for arg in typing.get_args(field.annotation) if arg is not type(None)]
+    return (args[0] if len(args) == 1 else field.annotation), True
@@ -0,0 +1,132 @@
+"""
+Relatório de inicialização do worker
+
+Mede o tempo de parede de cada import de primeiro nível (fastapi, numpy, sklearn,
+xgboost...) e de cada carga de artefato, além de marcos da inicialização (módulo
+importado, aplicação pronta para aceitar conexões, modelos carregados). Serve para
+acompanhar o cold start dos containers: o que atrasa a abertura da porta e o que
+cada modelo puxa quando é carregado (imports feitos durante o unpickling aparecem
+com o artefato que os disparou).
+
+Os imports são medidos envolvendo `builtins.__import__`: apenas o import mais externo
+de cada thread é cronometrado (o tempo dos imports internos já está nele), então o
+custo por import é uma comparação.
+
+Só usa a biblioteca padrão: precisa ser importado antes de todo o resto no main.py.
+"""
+
+import builtins
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+# Imports mais rápidos que isso não entram no relatório
+MIN_IMPORT_SECONDS = 0.005
+
+def process_age() -> Optional[float]:
+    """Segundos desde o início do processo (Linux: /proc/self/stat); None em outros sistemas"""
+    try:
+        with open("/proc/self/stat") as f:
+            # O nome do processo pode conter espaços: os campos começam depois do ")"
+            fields = f.read().rpartition(")")[2].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StartupReport:
+    """Imports, cargas de artefatos e marcos com o instante relativo ao início do processo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._original_import = None
+        # Instante (perf_counter) equivalente ao início do processo
+        age = process_age()
+        self.origin = time.perf_counter() - (age if age is not None else 0.0)
+        self.imports: List[Dict[str, Any]] = []
+        self.artefacts: List[Dict[str, Any]] = []
+        self.milestones: Dict[str, float] = {}
+
+    def _offset(self, instant: float) -> float:
+        return round(instant - self.origin, 4)
+
+    def install(self):
+        """Passa a medir os imports (chamado no topo do main.py)"""
+        if self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+        self.milestone("main_import_started")
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        """Devolve o __import__ original (chamado ao fim da inicialização)"""
+        if self._original_import is not None:
+            # Só desfaz se ninguém envolveu o __import__ depois de nós
+            if builtins.__import__ == self._timed_import:
+                builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        local = self._local
+        # Só o import mais externo de cada thread, e só de módulos ainda não carregados
+        if level or getattr(local, "depth", 0) or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        local.depth = 1
+        started = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            local.depth = 0
+            seconds = time.perf_counter() - started
+            if seconds >= MIN_IMPORT_SECONDS:
+                entry = {"module": name, "seconds": round(seconds, 4), "at": self._offset(started)}
+                artefact = getattr(local, "artefact", None)
+                if artefact is not None:
+                    entry["during"] = artefact
+                with self._lock:
+                    self.imports.append(entry)
+
+    @contextmanager
+    def artefact(self, name: str):
+        """Mede a carga de um artefato; imports disparados dentro dela ficam associados a ele"""
+        local = self._local
+        previous = getattr(local, "artefact", None)
+        local.artefact = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            local.artefact = previous
+            entry = {"artefact": name, "seconds": round(time.perf_counter() - started, 4), "at": self._offset(started)}
+            with self._lock:
+                self.artefacts.append(entry)
+
+    def milestone(self, name: str):
+        """Registra um marco na primeira vez em que ele ocorre"""
+        with self._lock:
+            self.milestones.setdefault(name, self._offset(time.perf_counter()))
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            imports = sorted(self.imports, key=lambda entry: entry["seconds"], reverse=True)
+            return {
+                "pid": os.getpid(),
+                "milestones_seconds": dict(self.milestones),
+                "loaded_modules": {module: module in sys.modules for module in ("pandas", "sklearn", "xgboost", "pyarrow")},
+                "imports": imports,
+                "artefacts": list(self.artefacts)
+            }
+
+    def summary(self, limit: int = 8) -> str:
+        """Resumo em uma linha para o log"""
+        report = self.report()
+        milestones = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in report["milestones_seconds"].items())
+        imports = ", ".join(f"{entry['module']} {entry['seconds']:.2f}s" for entry in report["imports"][:limit])
+        return f"Inicialização: {milestones} | imports mais lentos: {imports}"
+
+startup_report = StartupReport()
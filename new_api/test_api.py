@@ -8,6 +8,9 @@ Este script testa todos os endpoints da API com dados REAIS extraídos dos datas
 - Recomendação: Transação real de 2018-12-05 do dataset de clusterização
 """
 
+import datetime
+import os
+import uuid
 import requests
 import json
 import time
@@ -15,6 +18,33 @@ import time
 # URL base da API
 BASE_URL = "http://localhost:3021"
 
+# Dados reais do dataset de recomendação (transação real)
+# Transação de dezembro de 2018 - viagem de ida e volta
+RECOMMENDATION_PAYLOAD = {
+    "fk_contact": "37228485e0dc83d84d1bcd1bef3dc632301bf6cb22c8b5",
+    "date_purchase": "2018-12-05",
+    "time_purchase": "15:07:57",
+    "place_origin_departure": "10e4e7caf8b078429bb1c80b1a10118ac6f963eff098fd25a66c78862ae5ebce",
+    "place_destination_departure": "e6d41d208672a4e50b86d959f4a6254975e6fb9b0881166af52c9fe3b5825de2",
+    "place_origin_return": "0",
+    "place_destination_return": "0",
+    "fk_departure_ota_bus_company": "36ebe205bcdfc499a25e6923f4450fa8d48196ceb4fa0ce077d9d8ec4a36926d",
+    "fk_return_ota_bus_company": "1",
+    "gmv_success": 155.97,
+    "total_tickets_quantity_success": 1,
+    "route_departure": "10e4e7caf8b078429bb1c80b1a10118ac6f963eff098fd25a66c78862ae5ebce_to_e6d41d208672a4e50b86d959f4a6254975e6fb9b0881166af52c9fe3b5825de2",
+    "route_return": "0_to_0",
+    "is_round_trip": 1,
+    "departure_company_freq": 2139,
+    "return_company_freq": 1548675,
+    "origin_dept_freq": 862,
+    "dest_dept_freq": 5,
+    "route_departure_freq": 1,
+    "cluster": 0
+}
+# Campos de frequency encoding (o servidor os preenche quando omitidos)
+RECOMMENDATION_FREQUENCIES = {key: value for key, value in RECOMMENDATION_PAYLOAD.items() if key.endswith("_freq")}
+
 def test_health():
     """Testa o endpoint de saúde"""
     print("🔍 Testando endpoint /health...")
@@ -125,30 +155,7 @@ def test_recommendation():
     """Testa o endpoint de recomendação"""
     print("\n🔍 Testando endpoint /recommendation...")
     
-    # Dados reais do dataset de recomendação (transação real)
-    # Transação de dezembro de 2018 - viagem de ida e volta
-    payload = {
-        "fk_contact": "37228485e0dc83d84d1bcd1bef3dc632301bf6cb22c8b5",
-        "date_purchase": "2018-12-05",
-        "time_purchase": "15:07:57",
-        "place_origin_departure": "10e4e7caf8b078429bb1c80b1a10118ac6f963eff098fd25a66c78862ae5ebce",
-        "place_destination_departure": "e6d41d208672a4e50b86d959f4a6254975e6fb9b0881166af52c9fe3b5825de2",
-        "place_origin_return": "0",
-        "place_destination_return": "0",
-        "fk_departure_ota_bus_company": "36ebe205bcdfc499a25e6923f4450fa8d48196ceb4fa0ce077d9d8ec4a36926d",
-        "fk_return_ota_bus_company": "1",
-        "gmv_success": 155.97,
-        "total_tickets_quantity_success": 1,
-        "route_departure": "10e4e7caf8b078429bb1c80b1a10118ac6f963eff098fd25a66c78862ae5ebce_to_e6d41d208672a4e50b86d959f4a6254975e6fb9b0881166af52c9fe3b5825de2",
-        "route_return": "0_to_0",
-        "is_round_trip": 1,
-        "departure_company_freq": 2139,
-        "return_company_freq": 1548675,
-        "origin_dept_freq": 862,
-        "dest_dept_freq": 5,
-        "route_departure_freq": 1,
-        "cluster": 0
-    }
+    payload = RECOMMENDATION_PAYLOAD
     
     try:
         response = requests.post(
@@ -158,7 +165,59 @@ def test_recommendation():
         )
         print(f"Status: {response.status_code}")
         print(f"Resposta: {json.dumps(response.json(), indent=2)}")
-        return response.status_code == 200
+
+        # Sem os campos *_freq: preenchidos pelo servidor (422 se a versão não tem frequency_maps.json)
+        without_freq = {key: value for key, value in payload.items() if not key.endswith("_freq")}
+        omitted = requests.post(f"{BASE_URL}/recommendation", json=without_freq)
+        print(f"Sem *_freq -> Status: {omitted.status_code}")
+        return response.status_code == 200 and omitted.status_code in (200, 422)
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
+def test_recommendation_frequencies():
+    """Testa o preenchimento dos *_freq pelo plano de features (unitário e em lote)"""
+    print("\n🔍 Testando frequências preenchidas pelo servidor...")
+
+    # Mesma transação real do test_recommendation, com e sem as frequências
+    frequencies = RECOMMENDATION_FREQUENCIES
+    payload = {key: value for key, value in RECOMMENDATION_PAYLOAD.items() if key not in frequencies}
+
+    try:
+        informed = requests.post(f"{BASE_URL}/recommendation", json={**payload, **frequencies})
+        omitted = requests.post(f"{BASE_URL}/recommendation", json=payload)
+        print(f"Com *_freq -> Status: {informed.status_code} | Sem *_freq -> Status: {omitted.status_code}")
+
+        # Tabelas carregadas pela versão ativa (None: campo obrigatório na entrada)
+        plan = requests.get(f"{BASE_URL}/health").json()["feature_plans"]["recommendation"]
+        fillable = all(size is not None for size in plan["frequency_maps"].values())
+        print(f"Tabelas de frequência: {plan['frequency_maps']}")
+
+        # Lote misto: o registro 0 sem frequências (preenchidas da tabela), o 1 com as informadas
+        batch = {key: [value, value] for key, value in payload.items()}
+        batch.update({key: [None, value] for key, value in frequencies.items()})
+        response = requests.post(f"{BASE_URL}/recommendation/batch", json=batch)
+        print(f"Lote -> Status: {response.status_code}")
+        if informed.status_code != 200 or response.status_code != 200:
+            return False
+        result = response.json()
+
+        if not fillable:
+            # Sem frequency_maps.json: 422 no unitário e erro apenas no registro sem frequências
+            return (
+                omitted.status_code == 422
+                and [error["index"] for error in result["errors"]] == [0]
+                and result["results"][1]["top_3_routes"] == informed.json()["top_3_routes"]
+            )
+        ok = (
+            omitted.status_code == 200
+            and not result["errors"]
+            and result["results"][0]["top_3_routes"] == omitted.json()["top_3_routes"]
+            and result["results"][1]["top_3_routes"] == informed.json()["top_3_routes"]
+        )
+        if not ok:
+            print("❌ Lote e unitário divergem no preenchimento das frequências")
+        return ok
     except Exception as e:
         print(f"❌ Erro: {e}")
         return False
@@ -201,6 +260,344 @@ def test_edge_cases():
         print(f"❌ Erro no teste de casos extremos: {e}")
         return False
 
+def test_batch_endpoints():
+    """Testa os endpoints em lote (layout colunar) com um registro inválido proposital"""
+    print("\n🔍 Testando endpoints /batch...")
+    
+    # Dois clientes reais + um registro com valor inválido (deve voltar em 'errors')
+    clusterization_batch = {
+        "gmv_mean": [112.86, 264.25, "invalido"],
+        "gmv_total": [1128.58, 2578.4, 100.0],
+        "purchase_count": [10, 15, 1],
+        "gmv_std": [69.10, 166.05, 0.0],
+        "tickets_mean": [1.0, 1.92, 1.0],
+        "tickets_total": [10, 29, 1],
+        "tickets_std": [0.0, 0.8, 0.0],
+        "round_trip_rate": [1.0, 1.0, 0.0],
+        "weekend_rate": [0.2, 0.23, 0.0],
+        "preferred_day": [2, 1, 3],
+        "avg_hour": [15.5, 14.55, 10.0],
+        "preferred_month": [12, 7, 1],
+        "avg_company_freq": [25000.0, 69493.0, 100.0]
+    }
+    
+    try:
+        response = requests.post(
+            f"{BASE_URL}/clusterization/batch",
+            json=clusterization_batch,
+            headers={"Content-Type": "application/json"}
+        )
+        print(f"Status: {response.status_code}")
+        print(f"Resposta: {json.dumps(response.json(), indent=2)}")
+        if response.status_code != 200:
+            return False
+        
+        result = response.json()
+        ok = (
+            result["count"] == 3
+            and result["results"][2] is None
+            and [error["index"] for error in result["errors"]] == [2]
+        )
+        if not ok:
+            print("❌ Erro por registro não reportado como esperado")
+        return ok
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
+def test_stream_endpoints():
+    """Testa o /clusterization/stream (NDJSON) com linhas inválidas no meio do corpo"""
+    print("\n🔍 Testando endpoint /clusterization/stream...")
+    record = {
+        "gmv_mean": 112.86, "gmv_total": 1128.58, "purchase_count": 10, "gmv_std": 69.10,
+        "tickets_mean": 1.0, "tickets_total": 10, "tickets_std": 0.0, "round_trip_rate": 1.0,
+        "weekend_rate": 0.2, "preferred_day": 2, "avg_hour": 15.5, "preferred_month": 12,
+        "avg_company_freq": 25000.0
+    }
+    # Mais registros que um bloco padrão (ML_API_STREAM_CHUNK_ROWS=1000): atravessa blocos
+    lines = [json.dumps(record)] * 1200
+    # JSON inválido, linha que não é objeto e valor inválido; a linha em branco não conta
+    lines[500] = "{isto não é json"
+    lines[501] = "[1, 2, 3]"
+    lines[1100] = json.dumps(dict(record, gmv_mean="invalido"))
+    lines.insert(700, "")
+    expected_errors = [500, 501, 1100]
+
+    try:
+        response = requests.post(
+            f"{BASE_URL}/clusterization/stream",
+            data=("\n".join(lines) + "\n").encode(),
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        print(f"Status: {response.status_code}")
+        if response.status_code != 200:
+            return False
+
+        output = [json.loads(line) for line in response.text.splitlines()]
+        summary = output.pop()
+        print(f"Resumo: {summary} | primeira linha: {output[0]}")
+        expected = requests.post(f"{BASE_URL}/clusterization", json=record).json()
+        ok = (
+            summary == {"count": 1200, "errors": len(expected_errors)}
+            and [line["index"] for line in output] == list(range(1200))
+            and [line["index"] for line in output if "error" in line] == expected_errors
+            and all(line["result"]["cluster"] == expected["cluster"] for line in output if "result" in line)
+        )
+        if not ok:
+            print("❌ Linhas do stream fora do esperado")
+        return ok
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
+def test_admission_control():
+    """Testa prazos (X-Request-Deadline-Ms), modo degradado e rejeição por sobrecarga"""
+    print("\n🔍 Testando controle de admissão...")
+    payload = RECOMMENDATION_PAYLOAD
+
+    try:
+        # Header inválido: 400 antes de qualquer trabalho
+        invalid = [
+            requests.post(f"{BASE_URL}/recommendation", json=payload, headers={"X-Request-Deadline-Ms": value}).status_code
+            for value in ("abc", "-5")
+        ]
+        print(f"Prazo inválido -> Status: {invalid}")
+
+        # Requisição normal primeiro: o endpoint passa a ter um tempo de atendimento estimado
+        warm = requests.post(f"{BASE_URL}/recommendation", json=payload)
+        admission = requests.get(f"{BASE_URL}/health").json()["admission"]["RECOMMENDATION"]
+
+        # Prazo menor que o tempo de atendimento: 504 ou, com modo degradado, rotas populares
+        response = requests.post(f"{BASE_URL}/recommendation", json=payload, headers={"X-Request-Deadline-Ms": "0.001"})
+        degraded = response.headers.get("X-Degraded")
+        print(f"Prazo de 0.001ms -> Status: {response.status_code} | X-Degraded: {degraded} | "
+              f"modo degradado: {admission['degraded_mode']}")
+        if admission["degraded_mode"]:
+            # 503: versão sem popular_routes.json para responder em modo degradado
+            deadline_ok = (
+                (response.status_code == 200 and degraded == "popular-routes; reason=deadline"
+                 and bool(response.json()["top_3_routes"]))
+                or (response.status_code == 503 and "Retry-After" in response.headers)
+            )
+        else:
+            deadline_ok = response.status_code == 504 and "Retry-After" in response.headers
+
+        return invalid == [400, 400] and warm.status_code == 200 and deadline_ok and check_overload()
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
+def check_overload() -> bool:
+    """
+    Sobrecarga no /clusterization/stream: streams com o corpo ainda aberto seguram as vagas
+    (e a fila) do endpoint; a próxima requisição deve ser rejeitada com 503 + Retry-After
+    (o controle de admissão não usa 429). Só roda com limite de concorrência configurado
+    (ML_API_ADMISSION_CLUSTERIZATION_STREAM_MAX_CONCURRENCY / _MAX_QUEUE) e fila pequena
+    """
+    import threading
+
+    record = json.dumps({
+        "gmv_mean": 112.86, "gmv_total": 1128.58, "purchase_count": 10, "gmv_std": 69.10,
+        "tickets_mean": 1.0, "tickets_total": 10, "tickets_std": 0.0, "round_trip_rate": 1.0,
+        "weekend_rate": 0.2, "preferred_day": 2, "avg_hour": 15.5, "preferred_month": 12,
+        "avg_company_freq": 25000.0
+    })
+    # O controlador do endpoint só existe depois da primeira requisição
+    requests.post(f"{BASE_URL}/clusterization/stream", data=(record + "\n").encode())
+    admission = requests.get(f"{BASE_URL}/health").json()["admission"].get("CLUSTERIZATION_STREAM")
+    if admission is None or not admission["max_concurrency"] or admission["max_concurrency"] + admission["max_queue"] > 16:
+        print("Sem limite de concorrência (pequeno) no /clusterization/stream; sobrecarga não testada")
+        return True
+
+    release = threading.Event()
+
+    def held_body():
+        yield (record + "\n").encode()
+        release.wait(30)
+        yield (record + "\n").encode()
+
+    held = [
+        threading.Thread(target=requests.post, args=(f"{BASE_URL}/clusterization/stream",), kwargs={"data": held_body()})
+        for _ in range(admission["max_concurrency"] + admission["max_queue"])
+    ]
+    for thread in held:
+        thread.start()
+    try:
+        # Espera as requisições seguradas ocuparem as vagas e a fila
+        for _ in range(100):
+            admission = requests.get(f"{BASE_URL}/health").json()["admission"]["CLUSTERIZATION_STREAM"]
+            if admission["in_flight"] == admission["max_concurrency"] and admission["queue_depth"] == admission["max_queue"]:
+                break
+            time.sleep(0.1)
+        response = requests.post(f"{BASE_URL}/clusterization/stream", data=(record + "\n").encode())
+        print(f"Sobrecarga -> Status: {response.status_code} | Retry-After: {response.headers.get('Retry-After')}")
+        return response.status_code == 503 and "Retry-After" in response.headers
+    finally:
+        release.set()
+        for thread in held:
+            thread.join()
+
+def test_model_versions():
+    """Testa a listagem de versões e a fixação de versão por header"""
+    print("\n🔍 Testando endpoint /models...")
+    try:
+        response = requests.get(f"{BASE_URL}/models")
+        print(f"Status: {response.status_code}")
+        print(f"Resposta: {json.dumps(response.json(), indent=2)}")
+        if response.status_code != 200:
+            return False
+        
+        active_version = response.json()["active_version"]
+        
+        # Versão inexistente deve ser rejeitada antes da predição
+        response = requests.post(
+            f"{BASE_URL}/clusterization",
+            json={},
+            headers={"X-Model-Version": "versao-inexistente"}
+        )
+        print(f"Versão inexistente -> Status: {response.status_code}")
+        return bool(active_version) and response.status_code == 404
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
+def test_customer_endpoints():
+    """Testa a pontuação por fk_contact (feature store) com um cliente inexistente"""
+    print("\n🔍 Testando endpoints /<modelo>/customer/{fk_contact}...")
+    try:
+        statuses = []
+        for endpoint in ("clusterization", "classification"):
+            response = requests.get(f"{BASE_URL}/{endpoint}/customer/cliente-inexistente")
+            print(f"/{endpoint}/customer -> Status: {response.status_code} {response.json()}")
+            statuses.append(response.status_code)
+        # 404: cliente fora do store; 503: store ainda não construído (feature_store.py)
+        return all(status in (404, 503) for status in statuses)
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
+def test_incremental_aggregates():
+    """Compara as agregações incrementais (POST /customers/purchases) com o groupby do feature store"""
+    print("\n🔍 Testando endpoint /customers/purchases...")
+    fk_contact = f"teste-incremental-{uuid.uuid4().hex}"
+    # Compras em ordem cronológica com valores quebrados (médias e desvios não triviais)
+    events = [
+        {"fk_contact": fk_contact, "date_purchase": date, "time_purchase": time_purchase,
+         "place_origin_departure": origin, "place_destination_departure": destination,
+         "place_origin_return": origin_return, "fk_departure_ota_bus_company": company,
+         "gmv_success": gmv, "total_tickets_quantity_success": tickets}
+        for date, time_purchase, origin, destination, origin_return, company, gmv, tickets in [
+            ("2024-01-05", "08:15:00", "origem_1", "destino_2", None, "empresa_1", 155.97, 1),
+            ("2024-02-17", "19:40:12", "origem_2", "destino_1", "destino_1", "empresa_2", 79.52, 2),
+            ("2024-02-18", "07:05:33", "origem_1", "destino_3", None, "empresa_1", 82.48, 1),
+            ("2024-06-30", "23:59:59", "origem_3", "destino_2", None, "empresa_3", 1210.1, 3),
+        ]
+    ]
+    try:
+        response = requests.post(
+            f"{BASE_URL}/customers/purchases",
+            json={"events": events},
+            headers={"X-Admin-Token": os.getenv("ML_API_ADMIN_TOKEN", "")}
+        )
+        print(f"Status: {response.status_code} {response.json()}")
+        if response.status_code == 404:
+            print("Ingestão desabilitada (servidor sem ML_API_ADMIN_TOKEN); teste ignorado")
+            return True
+        if response.status_code == 409:
+            print("Servidor com vários workers (ingestão por HTTP recusada); teste ignorado")
+            return True
+        if response.status_code != 200 or response.json()["accepted"] != len(events):
+            return False
+
+        incremental = requests.get(f"{BASE_URL}/classification/customer/{fk_contact}").json()
+
+        # Mesmas compras pelo groupby da construção do feature store, pontuadas pelo /classification
+        import pandas as pd
+        from feature_store import build_tables
+
+        table = build_tables(pd.DataFrame(events), pd.Timestamp(datetime.date.today()))["classification"]
+        features = json.loads(table.to_json(orient="records"))[0]
+        expected = requests.post(f"{BASE_URL}/classification", json=features).json()
+        print(f"Incremental: {incremental} | groupby: {expected}")
+        return (
+            incremental.get("feature_store_generation") == "incremental"
+            and incremental.get("probability") == expected.get("probability")
+        )
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
+def test_aggregates_publish():
+    """Publica um estado incremental sobre um feature store local (customer_aggregates.publish)"""
+    print("\n🔍 Testando publicação das agregações incrementais no feature store...")
+    try:
+        import tempfile
+        import pandas as pd
+        import feature_store
+        from customer_aggregates import CustomerAggregator, publish
+
+        def purchase(fk_contact, date, gmv):
+            return {"fk_contact": fk_contact, "date_purchase": date, "time_purchase": "10:30:00",
+                    "place_origin_departure": "origem_1", "place_destination_departure": "destino_1",
+                    "place_origin_return": None, "fk_departure_ota_bus_company": "empresa_1",
+                    "gmv_success": gmv, "total_tickets_quantity_success": 1}
+
+        history = [purchase(f"cliente-{i}", f"2024-0{1 + i % 4}-1{i % 10}", 50.0 + i) for i in range(20)]
+        day = [purchase("cliente-3", "2024-06-02", 99.9), purchase("cliente-novo", "2024-06-02", 10.5)]
+        with tempfile.TemporaryDirectory() as store_path:
+            feature_store.write_generation(
+                store_path, feature_store.build_tables(pd.DataFrame(history), pd.Timestamp("2024-06-01")),
+                pd.Timestamp("2024-06-01")
+            )
+            # Estado novo com só um dia de compras, como no customer_aggregates.py --publish
+            store = feature_store.FeatureStore(store_path)
+            store.refresh()
+            aggregator = CustomerAggregator()
+            aggregator.ingest(day, lambda key: store.current.row(key) is not None)
+            publish(aggregator, store_path, datetime.date(2024, 6, 5))
+
+            store.refresh()
+            published = store.current
+            rebuilt = feature_store.build_tables(pd.DataFrame(history), pd.Timestamp("2024-06-05"))["classification"]
+            print(f"Clientes publicados: {published.manifest['rows']} (store anterior: 20)")
+            return (
+                published.manifest["rows"] == 21
+                # Cliente sem compras novas: igual a uma reconstrução na nova data de referência
+                and published.features("classification", "cliente-5") == rebuilt.loc["cliente-5"].to_dict()
+                # Cliente com histórico no store: parcial, segue com a linha do store (sem a compra nova)
+                and published.features("classification", "cliente-3")["gmv_ultima_compra"] == 53.0
+                and published.features("classification", "cliente-novo")["total_compras"] == 1
+            )
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
+def test_binary_protocol():
+    """Compara o protocolo binário (socket Unix) com o /clusterization, quando habilitado"""
+    print("\n🔍 Testando protocolo binário (ML_API_UDS_PATH)...")
+    path = os.getenv("ML_API_UDS_PATH")
+    if not path or not os.path.exists(path):
+        print("Socket não configurado nesta máquina; teste ignorado")
+        return True
+    try:
+        from binary_protocol import BinaryScoringClient
+
+        record = {
+            "gmv_mean": 112.86, "gmv_total": 1128.58, "purchase_count": 10, "gmv_std": 69.10,
+            "tickets_mean": 1.0, "tickets_total": 10, "tickets_std": 0.0, "round_trip_rate": 1.0,
+            "weekend_rate": 0.2, "preferred_day": 2, "avg_hour": 15.5, "preferred_month": 12,
+            "avg_company_freq": 25000.0
+        }
+        client = BinaryScoringClient(path)
+        result = client.score("clusterization", client.pack("clusterization", [record]))[0]
+        client.close()
+        expected = requests.post(f"{BASE_URL}/clusterization", json=record).json()
+        print(f"Binário: cluster {result['cluster']} | HTTP: cluster {expected['cluster']}")
+        return bool(result["ok"]) and int(result["cluster"]) == expected["cluster"]
+    except Exception as e:
+        print(f"❌ Erro: {e}")
+        return False
+
 def main():
     """Executa todos os testes"""
     print("🚀 Iniciando testes da API ML Models com DADOS REAIS...")
@@ -218,7 +615,16 @@ def main():
         ("Clusterização", test_clusterization),
         ("Classificação", test_classification),
         ("Recomendação", test_recommendation),
-        ("Casos Extremos", test_edge_cases)
+        ("Frequências (*_freq)", test_recommendation_frequencies),
+        ("Casos Extremos", test_edge_cases),
+        ("Lote (colunar)", test_batch_endpoints),
+        ("Stream (NDJSON)", test_stream_endpoints),
+        ("Controle de Admissão", test_admission_control),
+        ("Versões dos Modelos", test_model_versions),
+        ("Feature Store", test_customer_endpoints),
+        ("Ingestão de Compras", test_incremental_aggregates),
+        ("Publicação no Store", test_aggregates_publish),
+        ("Protocolo Binário", test_binary_protocol)
     ]
     
     results = []
@@ -0,0 +1,350 @@
+"""
+Avaliador compilado de ensembles de árvores
+
+Na carga do modelo, as árvores da RandomForest (sklearn) e do XGBoost são achatadas
+em arrays NumPy contíguos (feature, limiar, filhos, valores das folhas) com as árvores
+concatenadas. A predição percorre todas as árvores de todos os registros ao mesmo
+tempo, um nível de profundidade por iteração, sem o custo de despacho por chamada do
+sklearn (validação, joblib) e do XGBoost (DMatrix, checagem de nomes de features).
+
+Cada ensemble compilado é verificado contra o `predict_proba` nativo em pontos de
+prova gerados a partir dos próprios limiares das árvores; se divergir, não é usado.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Tolerância da verificação contra o predict_proba nativo
+VERIFY_ATOL = 1e-5
+
+TREE_BACKENDS = ("native", "compiled", "auto")
+
+def configured_tree_backend(model_type: str) -> Dict[str, Any]:
+    """
+    Lê o backend de inferência de um modelo das variáveis de ambiente
+    ML_API_TREE_BACKEND_<MODELO>: native (padrão), compiled ou auto
+    auto usa o ensemble compilado até ML_API_TREE_COMPILED_MAX_ROWS[_<MODELO>] registros
+    por chamada e o nativo (multithread) acima disso
+    """
+    backend = os.getenv(f"ML_API_TREE_BACKEND_{model_type.upper()}", "native").lower()
+    if backend not in TREE_BACKENDS:
+        logger.warning(f"Backend {backend} desconhecido para {model_type}; usando native")
+        backend = "native"
+    max_rows = os.getenv(f"ML_API_TREE_COMPILED_MAX_ROWS_{model_type.upper()}") or os.getenv("ML_API_TREE_COMPILED_MAX_ROWS", "64")
+    return {"backend": backend, "max_rows": max(1, int(max_rows))}
+
+class CompiledForest:
+    """Ensemble de árvores em arrays planos, avaliado de forma vetorizada"""
+
+    def __init__(self,
+                 kind: str,
+                 feature: np.ndarray,
+                 threshold: np.ndarray,
+                 left: np.ndarray,
+                 right: np.ndarray,
+                 default_left: np.ndarray,
+                 values: np.ndarray,
+                 roots: np.ndarray,
+                 depth: int,
+                 n_features: int,
+                 n_classes: int,
+                 tree_class: Optional[np.ndarray] = None,
+                 base_margin: float = 0.0,
+                 objective: Optional[str] = None):
+        self.kind = kind                    # "random_forest" ou "xgboost"
+        self.feature = feature              # índice da feature de cada nó (folhas: 0)
+        self.threshold = threshold          # limiar de cada nó
+        self.left = left                    # filho esquerdo (índice global; folhas apontam para si)
+        self.right = right                  # filho direito (índice global; folhas apontam para si)
+        self.default_left = default_left    # direção para valores ausentes (XGBoost)
+        self.values = values                # RF: probas por nó (n_nós x classes); XGB: peso da folha
+        self.roots = roots                  # nó raiz de cada árvore
+        self.depth = depth                  # profundidade máxima (iterações da travessia)
+        self.n_features = n_features
+        self.n_classes = n_classes
+        self.tree_class = tree_class        # XGB multiclasse: classe de cada árvore
+        self.base_margin = base_margin
+        self.objective = objective
+        # Filhos (esquerdo, direito) lado a lado: um único acesso escolhe o próximo nó
+        self.children = np.column_stack([left, right])
+        # XGB multiclasse: soma das folhas por classe como um produto de matrizes
+        self.class_matrix = (
+            np.eye(n_classes)[tree_class] if tree_class is not None and objective != "binary:logistic" else None
+        )
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """Índice da folha alcançada em cada árvore: matriz (registros x árvores)"""
+        if self.kind == "random_forest":
+            # O sklearn compara em float32 promovido a float64 (X <= limiar)
+            X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        else:
+            # O XGBoost compara em float32 (X < limiar)
+            X = np.asarray(X, dtype=np.float32)
+
+        has_missing = self.kind == "xgboost" and bool(np.isnan(X).any())
+        flat = X.ravel()
+        row_offsets = (np.arange(X.shape[0]) * X.shape[1])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.n_trees)).copy()
+        for _ in range(self.depth):
+            values = flat[row_offsets + self.feature[nodes]]
+            thresholds = self.threshold[nodes]
+            if self.kind == "random_forest":
+                go_right = values > thresholds
+            elif has_missing:
+                go_right = np.where(np.isnan(values), ~self.default_left[nodes], values >= thresholds)
+            else:
+                go_right = values >= thresholds
+            # Folhas apontam para si mesmas: ficam paradas até o fim da travessia
+            nodes = self.children[nodes, go_right.view(np.int8)]
+        return nodes
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Probabilidades por classe, no mesmo formato do predict_proba nativo"""
+        nodes = self.leaves(X)
+        if self.kind == "random_forest":
+            return self.values[nodes].mean(axis=1)
+
+        leaf_values = self.values[nodes].astype(np.float64)
+        if self.objective == "binary:logistic":
+            margin = self.base_margin + leaf_values.sum(axis=1)
+            positive = 1.0 / (1.0 + np.exp(-margin))
+            return np.column_stack([1.0 - positive, positive])
+
+        margins = self.base_margin + leaf_values @ self.class_matrix
+        margins -= margins.max(axis=1, keepdims=True)
+        exp = np.exp(margins)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def describe(self) -> dict:
+        return {
+            "kind": self.kind,
+            "trees": int(self.n_trees),
+            "nodes": int(self.n_nodes),
+            "depth": int(self.depth),
+            "bytes": int(sum(array.nbytes for array in (self.feature, self.threshold, self.left, self.right,
+                                                        self.default_left, self.values, self.roots)))
+        }
+
+def _tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    """Profundidade de uma árvore com filhos locais (-1 nas folhas)"""
+    depth = np.zeros(len(left), dtype=np.int64)
+    max_depth = 0
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        if left[node] != -1:
+            for child in (left[node], right[node]):
+                depth[child] = depth[node] + 1
+                max_depth = max(max_depth, depth[child])
+                stack.append(child)
+    return max_depth
+
+def _link_children(left: np.ndarray, right: np.ndarray, offset: int):
+    """Converte filhos locais em índices globais; folhas passam a apontar para si mesmas"""
+    own = np.arange(len(left)) + offset
+    is_leaf = left == -1
+    return (np.where(is_leaf, own, left + offset).astype(np.int32),
+            np.where(is_leaf, own, right + offset).astype(np.int32))
+
+def compile_random_forest(model) -> CompiledForest:
+    """Achata as árvores de uma RandomForestClassifier/ExtraTreesClassifier do sklearn"""
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise ValueError("RandomForest com múltiplas saídas não é suportada")
+
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    depth = 0
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        left, right = _link_children(tree.children_left, tree.children_right, offset)
+        is_leaf = tree.children_left == -1
+
+        node_values = tree.value[:, 0, :].astype(np.float64)
+        node_values = node_values / node_values.sum(axis=1, keepdims=True)
+
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(left)
+        rights.append(right)
+        values.append(node_values)
+        roots.append(offset)
+        depth = max(depth, _tree_depth(tree.children_left, tree.children_right))
+        offset += tree.node_count
+
+    return CompiledForest(
+        kind="random_forest",
+        feature=np.concatenate(features),
+        threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts),
+        right=np.concatenate(rights),
+        default_left=np.zeros(offset, dtype=bool),
+        values=np.concatenate(values),
+        roots=np.array(roots, dtype=np.int32),
+        depth=depth,
+        n_features=model.n_features_in_,
+        n_classes=len(model.classes_)
+    )
+
+def compile_xgboost(model) -> CompiledForest:
+    """Achata as árvores de um XGBClassifier (gbtree, multi:softprob ou binary:logistic)"""
+    booster = model.get_booster()
+    learner = json.loads(booster.save_raw(raw_format="json"))["learner"]
+    gradient_booster = learner["gradient_booster"]
+    objective = learner["objective"]["name"]
+    if gradient_booster["name"] != "gbtree":
+        raise ValueError(f"Booster {gradient_booster['name']} não é suportado")
+    if objective not in ("multi:softprob", "multi:softmax", "binary:logistic"):
+        raise ValueError(f"Objetivo {objective} não é suportado")
+
+    trees = gradient_booster["model"]["trees"]
+    tree_info = gradient_booster["model"]["tree_info"]
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is not None:
+        # O predict_proba do XGBClassifier usa apenas as árvores até a melhor iteração
+        n_trees = gradient_booster["model"]["iteration_indptr"][int(best_iteration) + 1]
+        trees, tree_info = trees[:n_trees], tree_info[:n_trees]
+
+    params = learner["learner_model_param"]
+    base_score = float(params["base_score"])
+    n_classes = max(int(params["num_class"]), 2)
+    base_margin = float(np.log(base_score / (1 - base_score))) if objective == "binary:logistic" else base_score
+
+    features, thresholds, lefts, rights, defaults, values, roots = [], [], [], [], [], [], []
+    depth = 0
+    offset = 0
+    for tree in trees:
+        if any(split_type != 0 for split_type in tree["split_type"]):
+            raise ValueError("Splits categóricos não são suportados")
+        tree_left = np.array(tree["left_children"], dtype=np.int64)
+        tree_right = np.array(tree["right_children"], dtype=np.int64)
+        left, right = _link_children(tree_left, tree_right, offset)
+        is_leaf = tree_left == -1
+
+        features.append(np.where(is_leaf, 0, tree["split_indices"]).astype(np.int32))
+        # Nas folhas, split_conditions guarda o peso da folha
+        conditions = np.array(tree["split_conditions"], dtype=np.float32)
+        thresholds.append(conditions)
+        values.append(np.where(is_leaf, conditions, 0).astype(np.float32))
+        defaults.append(np.array(tree["default_left"], dtype=bool))
+        lefts.append(left)
+        rights.append(right)
+        roots.append(offset)
+        depth = max(depth, _tree_depth(tree_left, tree_right))
+        offset += len(tree_left)
+
+    return CompiledForest(
+        kind="xgboost",
+        feature=np.concatenate(features),
+        threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts),
+        right=np.concatenate(rights),
+        default_left=np.concatenate(defaults),
+        values=np.concatenate(values),
+        roots=np.array(roots, dtype=np.int32),
+        depth=depth,
+        n_features=int(params["num_feature"]),
+        n_classes=n_classes,
+        tree_class=np.array(tree_info, dtype=np.int32),
+        base_margin=base_margin,
+        objective=objective
+    )
+
+def compile_tree_ensemble(model) -> CompiledForest:
+    """Compila o ensemble conforme o tipo do modelo treinado"""
+    if hasattr(model, "get_booster"):
+        return compile_xgboost(model)
+    if hasattr(model, "estimators_") and hasattr(getattr(model.estimators_[0], "tree_", None), "children_left"):
+        return compile_random_forest(model)
+    raise ValueError(f"Modelo {type(model).__name__} não é um ensemble de árvores suportado")
+
+def probe_matrix(forest: CompiledForest, size: int = 2000, seed: int = 42) -> np.ndarray:
+    """
+    Registros de prova que exercitam os limiares das árvores
+    Cada feature recebe limiares reais do ensemble, ligeiramente abaixo, exatamente
+    iguais ou ligeiramente acima, cobrindo os dois lados de cada comparação
+    """
+    rng = np.random.default_rng(seed)
+    is_split = forest.left != np.arange(forest.n_nodes)
+    X = np.zeros((size, forest.n_features))
+    for feature in range(forest.n_features):
+        candidates = np.unique(forest.threshold[is_split & (forest.feature == feature)])
+        if len(candidates) == 0:
+            X[:, feature] = rng.normal(0, 1, size)
+            continue
+        picks = rng.choice(candidates, size)
+        offsets = rng.choice([-1.0, 0.0, 1.0], size) * np.maximum(np.abs(picks), 1.0) * 1e-3
+        X[:, feature] = picks + offsets
+    return X
+
+def native_predict_proba(model, X: np.ndarray) -> np.ndarray:
+    """
+    predict_proba nativo sobre a matriz (colunas já na ordem de feature_names_in_)
+    Sem DataFrame: o resultado é o mesmo e o worker não precisa importar o pandas
+    """
+    return model.predict_proba(np.asarray(X, dtype=np.float64))
+
+def compile_and_verify(model, atol: float = VERIFY_ATOL) -> Optional[CompiledForest]:
+    """
+    Compila o ensemble e confere contra o predict_proba nativo
+    Retorna None (a API segue com o caminho nativo) se não suportado ou divergente
+    """
+    try:
+        forest = compile_tree_ensemble(model)
+        probe = probe_matrix(forest)
+        expected = native_predict_proba(model, probe)
+        compiled = forest.predict_proba(probe)
+        error = float(np.abs(compiled - expected).max())
+        if compiled.shape != expected.shape or error > atol:
+            logger.warning(f"Ensemble compilado divergiu do predict_proba nativo (erro máx. {error:.2e}); "
+                           "usando caminho nativo")
+            return None
+        logger.info(f"Ensemble compilado: {forest.describe()} (erro máx. {error:.2e})")
+        return forest
+
+    except Exception as e:
+        logger.warning(f"Não foi possível compilar o ensemble de árvores: {e}")
+        return None
+
+class TreeBackend:
+    """Escolhe, por chamada, entre o predict_proba nativo e o ensemble compilado"""
+
+    def __init__(self, model, backend: str = "native", max_rows: int = 64):
+        self.model = model
+        self.backend = backend
+        self.max_rows = max_rows
+        self.feature_names = list(getattr(model, "feature_names_in_", []))
+        self.compiled = compile_and_verify(model) if backend != "native" else None
+
+    def predict_proba(self, X) -> np.ndarray:
+        """`X` é o DataFrame (ou matriz) com as colunas na ordem do treinamento"""
+        if self.compiled is None or (self.backend == "auto" and len(X) > self.max_rows):
+            if isinstance(X, np.ndarray):
+                return native_predict_proba(self.model, X)
+            return self.model.predict_proba(X)
+        if hasattr(X, "to_numpy"):
+            if self.feature_names and list(X.columns) != self.feature_names:
+                X = X[self.feature_names]
+            X = X.to_numpy(dtype=np.float64)
+        return self.compiled.predict_proba(X)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend if self.compiled is not None else "native",
+            "requested": self.backend,
+            "max_rows": self.max_rows if self.backend == "auto" else None,
+            "compiled": self.compiled.describe() if self.compiled is not None else None
+        }